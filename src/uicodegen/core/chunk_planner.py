@@ -0,0 +1,331 @@
+"""
+Token-aware chunk planning for HTML translation
+"""
+import math
+import threading
+
+from uicodegen.utils.bedrock_client import BEDROCK_READ_TIMEOUT
+from uicodegen.utils.token_utils import estimate_tokens
+
+# Tokens used by the <aN></aN> envelope around each segment
+SEGMENT_ENVELOPE_TOKENS = 6
+
+# Tokens needed to express the same content in each language, relative to English
+LANGUAGE_TOKEN_RATIOS = {
+    "en": 1.0,
+    "en-sa": 1.0,
+    "zh-hans": 1.1,
+    "zh-hant": 1.2,
+    "ja": 1.3,
+    "vi": 1.5,
+    "ru": 1.6,
+    "uk": 1.7,
+    "es": 1.2,
+    "es-co": 1.2,
+    "es-ar": 1.2,
+    "id": 1.2,
+    "pt": 1.2,
+    "de": 1.3,
+    "th": 2.0,
+    "ar": 1.6,
+    "fr": 1.2,
+    "it": 1.2,
+    "pl": 1.5
+}
+
+# Fraction of the model's output limit a chunk is planned to fill
+OUTPUT_SAFETY_MARGIN = 0.8
+
+# Share of the read timeout a non-streaming response is planned to take at
+# the model's expected speed, and the speed assumed when none is declared
+READ_TIMEOUT_MARGIN = 0.5
+DEFAULT_TOKENS_PER_SECOND = 30
+
+# Smallest chunk worth splitting off to keep parallel workers busy
+MIN_PARALLEL_CHUNK_TOKENS = 1000
+
+# Context window used for models that do not declare one
+DEFAULT_CONTEXT_WINDOW = 200000
+
+# Weight of the newest observation in the rolling expansion ratio
+EXPANSION_SMOOTHING = 0.3
+
+# Observed expansion ratios outside this range are treated as noise
+MIN_EXPANSION_RATIO = 0.3
+MAX_EXPANSION_RATIO = 5.0
+
+def get_expansion_ratio(source_language, target_language):
+    """
+    Get the expected ratio of output tokens to input tokens for a language pair
+
+    Args:
+        source_language: Source language code
+        target_language: Target language code
+
+    Returns:
+        float: Expected output/input token ratio
+    """
+    source_ratio = LANGUAGE_TOKEN_RATIOS.get(source_language, 1.0)
+    target_ratio = LANGUAGE_TOKEN_RATIOS.get(target_language, 1.0)
+    return target_ratio / source_ratio
+
+class ExpansionTracker:
+    """
+    Rolling per-language-pair ratio of output tokens to source tokens
+
+    Starts from the static LANGUAGE_TOKEN_RATIOS estimate and moves towards
+    the ratios observed in completed chunks, so later chunks are sized from
+    how the model actually expands each language pair.
+    """
+
+    def __init__(self, smoothing=EXPANSION_SMOOTHING):
+        """
+        Initialize the tracker
+
+        Args:
+            smoothing (float): Weight of the newest observation
+        """
+        self.smoothing = smoothing
+        self._ratios = {}
+        self._lock = threading.Lock()
+
+    def get_ratio(self, source_language, target_language):
+        """
+        Get the current expansion ratio of a language pair
+
+        Args:
+            source_language: Source language code
+            target_language: Target language code
+
+        Returns:
+            float: Expected output/input token ratio
+        """
+        ratio = self._ratios.get((source_language, target_language))
+        if ratio is None:
+            return get_expansion_ratio(source_language, target_language)
+        return ratio
+
+    def record(self, source_language, target_language, segments, output_tokens, truncated=False):
+        """
+        Record the output of a translated chunk
+
+        A truncated chunk only gives a lower bound for the ratio, so it can
+        raise the ratio but never lower it.
+
+        Args:
+            source_language: Source language code
+            target_language: Target language code
+            segments: Dictionary of segments that were sent
+            output_tokens: Output tokens reported by the model
+            truncated: Whether the output hit the max_tokens limit
+        """
+        if not segments or not output_tokens:
+            return
+
+        text_tokens = sum(estimate_tokens(text) for text in segments.values())
+        translated_tokens = output_tokens - SEGMENT_ENVELOPE_TOKENS * len(segments)
+        if translated_tokens <= 0:
+            return
+
+        observed = min(max(translated_tokens / text_tokens, MIN_EXPANSION_RATIO), MAX_EXPANSION_RATIO)
+        key = (source_language, target_language)
+
+        with self._lock:
+            current = self._ratios.get(key)
+            if current is None:
+                current = get_expansion_ratio(source_language, target_language)
+
+            if truncated:
+                self._ratios[key] = max(current, observed)
+            else:
+                self._ratios[key] = current + self.smoothing * (observed - current)
+
+# Shared tracker used by all translation jobs
+expansion_tracker = ExpansionTracker()
+
+def estimate_segment_tokens(text, expansion_ratio):
+    """
+    Estimate the input and output tokens of a segment, envelope included
+
+    Args:
+        text: Segment text
+        expansion_ratio: Expected output/input token ratio
+
+    Returns:
+        tuple: (input_tokens, output_tokens)
+    """
+    text_tokens = estimate_tokens(text)
+    input_tokens = text_tokens + SEGMENT_ENVELOPE_TOKENS
+    output_tokens = math.ceil(text_tokens * expansion_ratio) + SEGMENT_ENVELOPE_TOKENS
+    return input_tokens, output_tokens
+
+def non_streaming_output_budget(model_config, read_timeout=None):
+    """
+    Get the output tokens a non-streaming response can carry
+
+    A non-streaming response arrives all at once, so it has to be generated
+    well within the client's read timeout.
+
+    Args:
+        model_config: Model configuration from MODEL_CONFIGS
+        read_timeout: Read timeout in seconds, by default the one of the
+            Bedrock clients
+
+    Returns:
+        int: Output token budget
+    """
+    if read_timeout is None:
+        read_timeout = BEDROCK_READ_TIMEOUT
+    tokens_per_second = model_config.get("expected_tokens_per_second", DEFAULT_TOKENS_PER_SECOND)
+    return int(read_timeout * READ_TIMEOUT_MARGIN * tokens_per_second)
+
+class ChunkPacker:
+    """
+    Incrementally pack segments into chunks within token and size budgets
+
+    Segments are added in document order. add() returns the previous chunk
+    once the next segment no longer fits in it, so chunks can be sent to the
+    model while the rest of the document is still being read.
+    """
+
+    def __init__(self, model_config, source_language, target_language, prompt_tokens=0, output_budget=None, max_chunk_chars=None, expansion_ratio=None, use_streaming=True):
+        """
+        Initialize the packer
+
+        Args:
+            model_config: Model configuration from MODEL_CONFIGS
+            source_language: Source language code
+            target_language: Target language code
+            prompt_tokens: Estimated tokens of the prompt around the segments
+            output_budget: Optional cap on estimated output tokens per chunk
+            max_chunk_chars: Optional hard limit on characters per chunk
+            expansion_ratio: Output/input token ratio to plan with; defaults
+                to the rolling ratio of the shared expansion tracker
+            use_streaming: Whether responses are streamed; without streaming
+                the output is also capped to arrive within the read timeout
+        """
+        if expansion_ratio is None:
+            expansion_ratio = expansion_tracker.get_ratio(source_language, target_language)
+        max_output_tokens = model_config["max_tokens"]
+        context_window = model_config.get("context_window", DEFAULT_CONTEXT_WINDOW)
+
+        self.expansion_ratio = expansion_ratio
+        self.output_budget = int(max_output_tokens * OUTPUT_SAFETY_MARGIN)
+        if output_budget:
+            self.output_budget = min(self.output_budget, output_budget)
+        if not use_streaming:
+            self.output_budget = min(self.output_budget, non_streaming_output_budget(model_config))
+        self.input_budget = context_window - max_output_tokens - prompt_tokens
+        self.max_chunk_chars = max_chunk_chars
+        self._reset()
+
+    def _reset(self):
+        """
+        Start an empty chunk
+        """
+        self.current_chunk = {}
+        self.current_input_tokens = 0
+        self.current_output_tokens = 0
+        self.current_chars = 0
+
+    def add(self, idx, text, estimate=None):
+        """
+        Add a segment
+
+        Args:
+            idx: Segment key
+            text: Segment text
+            estimate: Optional precomputed (input_tokens, output_tokens)
+
+        Returns:
+            dict: The completed previous chunk if this segment started a new
+            one, otherwise None
+        """
+        input_tokens, output_tokens = estimate or estimate_segment_tokens(text, self.expansion_ratio)
+        completed = None
+
+        # Start a new chunk when this segment would overflow any budget
+        if self.current_chunk and (
+            self.current_input_tokens + input_tokens > self.input_budget
+            or self.current_output_tokens + output_tokens > self.output_budget
+            or (self.max_chunk_chars and self.current_chars + len(text) > self.max_chunk_chars)
+        ):
+            completed = self.current_chunk
+            self._reset()
+
+        self.current_chunk[idx] = text
+        self.current_input_tokens += input_tokens
+        self.current_output_tokens += output_tokens
+        self.current_chars += len(text)
+        return completed
+
+    def flush(self):
+        """
+        Complete the current chunk
+
+        Returns:
+            dict: The current chunk, or None if it is empty
+        """
+        completed = self.current_chunk or None
+        self._reset()
+        return completed
+
+def plan_chunks(segments, model_config, source_language, target_language, prompt_tokens=0, min_chunks=1, max_chunk_chars=None, expansion_ratio=None, use_streaming=True):
+    """
+    Pack segments into chunks that fit the model's context and output limits
+
+    Each chunk is filled until its estimated translated output would pass
+    OUTPUT_SAFETY_MARGIN of the model's max_tokens, or its prompt would not
+    fit the context window next to max_tokens. When min_chunks is more than
+    one, the output budget is also capped so the work spreads over at least
+    that many chunks, as long as each chunk stays above
+    MIN_PARALLEL_CHUNK_TOKENS. Without streaming, chunks are also kept
+    small enough for the response to arrive within the read timeout.
+
+    Args:
+        segments: Dictionary of segments to translate, in document order
+        model_config: Model configuration from MODEL_CONFIGS
+        source_language: Source language code
+        target_language: Target language code
+        prompt_tokens: Estimated tokens of the prompt around the segments
+        min_chunks: Number of chunks the work should be spread over
+        max_chunk_chars: Optional hard limit on characters per chunk
+        expansion_ratio: Output/input token ratio to plan with; defaults to
+            the rolling ratio of the shared expansion tracker
+        use_streaming: Whether responses are streamed
+
+    Returns:
+        list: Dictionaries of segments, in document order
+    """
+    if expansion_ratio is None:
+        expansion_ratio = expansion_tracker.get_ratio(source_language, target_language)
+
+    estimates = {idx: estimate_segment_tokens(text, expansion_ratio) for idx, text in segments.items()}
+
+    parallel_budget = None
+    if min_chunks > 1:
+        total_output_tokens = sum(output_tokens for _, output_tokens in estimates.values())
+        parallel_budget = max(MIN_PARALLEL_CHUNK_TOKENS, math.ceil(total_output_tokens / min_chunks))
+
+    packer = ChunkPacker(
+        model_config,
+        source_language,
+        target_language,
+        prompt_tokens=prompt_tokens,
+        output_budget=parallel_budget,
+        max_chunk_chars=max_chunk_chars,
+        expansion_ratio=expansion_ratio,
+        use_streaming=use_streaming
+    )
+
+    chunks = []
+    for idx, text in segments.items():
+        completed = packer.add(idx, text, estimates[idx])
+        if completed:
+            chunks.append(completed)
+
+    completed = packer.flush()
+    if completed:
+        chunks.append(completed)
+
+    return chunks
@@ -1,59 +1,446 @@
 """
 HTML Translation module using LLM (AWS Bedrock with Claude)
 """
+import asyncio
+import codecs
+import html
 import os
+import re
 import time
-import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup, Comment, Doctype, NavigableString, Stylesheet
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 
-from uicodegen.utils.bedrock_client import get_bedrock_client
-from uicodegen.core.model_configs import MODEL_CONFIGS
-from uicodegen.core.language_configs import get_language_name
+from uicodegen.utils.bedrock_client import get_routed_client
+from uicodegen.utils.async_bedrock_client import async_available, get_async_routed_client, run_on_loop
+from uicodegen.utils.bedrock_limiter import is_read_timeout
+from uicodegen.utils.hedging import hedged_stream, hedged_stream_async
+from uicodegen.utils.html_scanner import HtmlScanner, scan_html, TEXT, START_TAG, END_TAG
+from uicodegen.utils.token_utils import estimate_tokens, CJK_PATTERN
+from uicodegen.core.model_configs import MODEL_CONFIGS, get_async_hedge_target, get_hedge_target
+from uicodegen.core.language_configs import get_language_name, DEFAULT_SOURCE_LANGUAGE
+from uicodegen.core.language_detector import AUTO_DETECT_LANGUAGE, detect_dominant_language, is_target_language
+from uicodegen.core.translation_memory import get_translation_memory
+from uicodegen.core.chunk_planner import ChunkPacker, plan_chunks, expansion_tracker, estimate_segment_tokens
 
 # HTML Translation-specific configuration
 HTML_TRANSLATION_PREFILL_PROMPT = "here is the translated content:"
 
-HTML_TRANSLATION_PROMPT_BASE = """
-You are an expert professional translator specializing in translating from {$SOURCE_LANGUAGE} to {$TARGET_LANGUAGE}. Your task is to translate HTML content while preserving all code structure and formatting.
-
-# TASK DESCRIPTION
-You need to translate the natural language text within HTML content from {$SOURCE_LANGUAGE} to {$TARGET_LANGUAGE}, while maintaining all HTML tags, variables, and special formatting intact.
-
-# TRANSLATION RULES
-1. Only translate the natural language text within the numbered tags (e.g., <a0>, <a1>).
-3. Maintain all HTML tags, attributes, and structure without modification.
-4. Ensure the translation is accurate, natural, and follows the conventions of {$TARGET_LANGUAGE}.
-5. Preserve any special characters, punctuation, and formatting that appears in the original text.
-
-# TRANSLATION PROCESS
-Let me break down my approach:
-1. First, I'll identify all translatable text segments within the numbered tags.
-2. For each segment, I'll:
-   a. Analyze the content to distinguish between code/variables and natural language
-   b. Preserve all code elements exactly as they appear
-   c. Translate only the natural language portions from {$SOURCE_LANGUAGE} to {$TARGET_LANGUAGE}
-   d. Ensure the translation maintains the original meaning and tone
-3. I'll verify that all variables and special formatting remain intact
-
-# EXAMPLE
-Input:
-<content>
-<a0>Hello, $USERNAME! Welcome to our website.</a0>
-</content>
-
-My thought process:
-- I need to translate "Hello" and "Welcome to our website" from English to Simplified Chinese 
-- I need to maintain the exclamation mark and proper punctuation
-
-Output:
-<a0>你好，$USERNAME！欢迎访问我们的网站。</a0>
-
-# CONTENT TO TRANSLATE
-{$HTML_CONTENT}
-
-I'll now translate the content from {$SOURCE_LANGUAGE} into {$TARGET_LANGUAGE}
+# Number of chunks sent to the model at the same time
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('HTML_TRANSLATION_CONCURRENCY', 4))
+
+# Follow-up requests for segments missing from the model's responses
+DEFAULT_MAX_RETRIES = 2
+
+# Bytes read from disk at a time when translating a document file
+STREAM_READ_SIZE = 64 * 1024
+
+# Estimated output tokens per chunk when translating a document file, which
+# together with the number of chunks in flight bounds the memory in use
+STREAM_CHUNK_OUTPUT_TOKENS = 4000
+
+# Stop reason recorded for a chunk whose response did not arrive within the
+# read timeout; like max_tokens, it makes the chunk get split
+READ_TIMEOUT_STOP_REASON = 'read_timeout'
+
+# Metrics of a chunk request that add up across requests. decode_time and
+# decode_output_tokens cover streamed requests from their first token on.
+CHUNK_METRIC_KEYS = (
+    'input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_write_input_tokens',
+    'streaming_chunks', 'truncated_chunks', 'decode_time', 'decode_output_tokens'
+)
+
+# A segment returned unchanged counts as untranslated when it has at least
+# this many words, or this many CJK characters
+UNTRANSLATED_MIN_WORDS = 3
+UNTRANSLATED_MIN_CJK_CHARS = 4
+WORD_PATTERN = re.compile(r"[^\W\d_]{2,}")
+
+# Prompt around the segments of a chunk; {$SOURCE_LANGUAGE} and
+# {$TARGET_LANGUAGE} are filled in once per language pair
+HTML_TRANSLATION_PROMPT_TEMPLATE = """You are an expert translator from {$SOURCE_LANGUAGE} to {$TARGET_LANGUAGE}. Translate the text of each numbered segment of an HTML page.
+Rules:
+- Reply with every segment in the same <aN>...</aN> format, one per line, and nothing else.
+- Translate only natural language. Keep code, variables, URLs, numbers and special characters as they are.
+- Keep every placeholder such as {1}, {/1} or {2/} exactly once, around the translated words that correspond to the words it wraps in the original.
+- Keep the escapes &lt; &gt; &amp; as they are.
+- Make the translation accurate and natural, following the conventions of {$TARGET_LANGUAGE}.
+Example: <a0>Hello, $USERNAME! {1}Welcome{/1} to our website.</a0> becomes <a0>你好，$USERNAME！{1}欢迎{/1}访问我们的网站。</a0> in Simplified Chinese.
+Segments:
 """
 
+# Segments of a model response, keyed by their chunk-local number
+RESPONSE_SEGMENT_PATTERN = re.compile(r"<a(\d+)>(.*?)</a\1>", re.DOTALL)
+
+# Text directly inside these elements is never translated
+SKIPPED_PARENT_TAGS = frozenset(["script", "style", "head", "title", "meta", "[document]"])
+
+# Inline elements whose text is merged with the surrounding text into one
+# segment, the tags being replaced by placeholders
+INLINE_ELEMENTS = frozenset([
+    "a", "abbr", "b", "bdi", "bdo", "cite", "code", "data", "del", "dfn", "em", "font", "i", "ins",
+    "kbd", "mark", "q", "s", "samp", "small", "span", "strong", "sub", "sup", "time", "u", "var"
+])
+INLINE_VOID_ELEMENTS = frozenset(["img", "wbr"])
+
+# Longest run of inline content, in source characters, merged into one segment
+MAX_INLINE_RUN_LENGTH = 4000
+
+# Placeholders for the tags of a merged segment: {1}...{/1}, {2/} for void elements
+PLACEHOLDER_PATTERN = re.compile(r"\{/?\d+/?\}")
+
+# Text nodes that fully match one of these rules carry no translatable
+# language and are kept as they are instead of being sent to the model
+CURRENCY = r"[$\u00a2\u00a3\u00a5\u20ac\u20b9\u20a9\u20bd]"
+PASS_THROUGH_RULES = {
+    # Prices, quantities and percentages: "$1,299.00", "-20 %", "EUR 15"
+    "number": re.compile(
+        r"(?:[A-Z]{3}\s?)?[-+\u00b1~]?\s*" + CURRENCY + r"?\s*\d[\d.,'\u2019\s]*"
+        r"(?:\s?(?:%|" + CURRENCY + r"|[A-Z]{3}|[xX\u00d7]))?"
+    ),
+    # Dates and times: "2024-05-01", "12/31/2023 10:30", "9:45 PM"
+    "date": re.compile(
+        r"\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?"
+        r"|\d{1,2}:\d{2}(?::\d{2})?(?:\s?[AaPp]\.?[Mm]\.?)?"
+    ),
+    # Versions: "v2.3.1", "1.0.0-beta.2"
+    "version": re.compile(r"[vV]?\d+(?:\.\d+){1,3}(?:[-+][0-9A-Za-z.]+)?"),
+    # SKUs and identifiers: "SKU-88231", "AB12-X7", "4K"
+    "sku": re.compile(r"(?=[A-Z0-9/_.-]*\d)[A-Z0-9]+(?:[-_/.#][A-Z0-9]+)*"),
+    # Email addresses
+    "email": re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"),
+    # URLs and bare domains with a path
+    "url": re.compile(r"(?:[a-zA-Z][a-zA-Z0-9+.-]*://|www\.)\S+|[\w-]+(?:\.[\w-]+)+/\S*"),
+    # Symbols, punctuation and emoji without any letters or digits
+    "symbol": re.compile(r"[\W_]+"),
+    # Code-like tokens: snake_case, camelCase, dotted names, calls, flags, placeholders
+    "code": re.compile(
+        r"[a-z0-9]+(?:_[a-z0-9]+)+"
+        r"|[a-z]+(?:[A-Z][a-z0-9]*)+"
+        r"|[A-Za-z_$][\w$]*(?:(?:\.|::|->)[A-Za-z_$][\w$]*)+(?:\(\))?"
+        r"|[A-Za-z_$][\w$]*\(\)"
+        r"|--?[a-z][\w-]*"
+        r"|\{\{.*\}\}|\$\{.*\}|\$[A-Z_][A-Z0-9_]*|%[sdif]"
+    )
+}
+
+# Comma-separated names of the enabled pass-through rules, "none" to disable
+ENABLED_PASS_THROUGH_RULES = os.environ.get('HTML_PASS_THROUGH_RULES', ",".join(PASS_THROUGH_RULES))
+
+# Tokens used by the prompt around the segments of a chunk
+HTML_TRANSLATION_PROMPT_TOKENS = estimate_tokens(HTML_TRANSLATION_PROMPT_TEMPLATE) + estimate_tokens(HTML_TRANSLATION_PREFILL_PROMPT)
+
+def text_segment_span(token):
+    """
+    Find the translatable part of a text token
+    
+    Surrounding whitespace stays outside the span, so it is kept exactly as
+    written in the source document.
+    
+    Args:
+        token: Text token from the HTML scanner
+        
+    Returns:
+        Tuple of (start, end, text) with the span's offsets in the document
+        and its entity-decoded text, or None if the token is not translatable
+    """
+    if token.parent in SKIPPED_PARENT_TAGS or token.hidden:
+        return None
+    
+    raw = token.raw
+    core = raw.strip()
+    if not core:
+        return None
+    
+    text = html.unescape(core)
+    if not text.strip():
+        return None
+    
+    start = token.start + len(raw) - len(raw.lstrip())
+    return start, start + len(core), text
+
+class InlineRunSegmenter:
+    """
+    Group text nodes and the inline tags between them into segments
+    
+    A sentence such as 'Click <a href="/x">here</a> to save' becomes the
+    single segment "Click {1}here{/1} to save" instead of three text nodes,
+    so the model translates it with its context. Runs end at block-level
+    tags, comments and untranslatable text. Runs whose tags do not pair up
+    within the run are split back into their text nodes.
+    
+    Feed the tokens of a document in order with add() and finish with
+    close(). Segments are (start, end, text, tags) tuples, where tags maps
+    each placeholder to the source of the tag it stands for, or is None for
+    a plain text node.
+    """
+    
+    def __init__(self):
+        """
+        Initialize the segmenter
+        """
+        # (token, span) pairs of the current run; span is None for tags and
+        # whitespace between them
+        self._run = []
+    
+    @property
+    def start(self):
+        """
+        Document offset of the current run, or None without one
+        """
+        if self._run:
+            return self._run[0][0].start
+        return None
+    
+    def add(self, token):
+        """
+        Add the next token of the document
+        
+        Args:
+            token: Token from the HTML scanner
+            
+        Returns:
+            List of the segments the token completes
+        """
+        if token.kind == TEXT:
+            span = text_segment_span(token)
+            joinable = span is not None or not html.unescape(token.raw).strip()
+        else:
+            span = None
+            joinable = token.kind in (START_TAG, END_TAG) and (
+                token.name in INLINE_ELEMENTS or token.name in INLINE_VOID_ELEMENTS
+            )
+        
+        if not joinable:
+            return self.close()
+        
+        segments = []
+        if self._run and token.end - self._run[0][0].start > MAX_INLINE_RUN_LENGTH:
+            segments = self.close()
+        self._run.append((token, span))
+        return segments
+    
+    def close(self):
+        """
+        End the current run
+        
+        Returns:
+            List of the segments of the run
+        """
+        run, self._run = self._run, []
+        anchors = [index for index, (_, span) in enumerate(run) if span]
+        plain = [(span[0], span[1], span[2], None) for _, span in run if span]
+        
+        if len(anchors) < 2:
+            return plain
+        
+        # Pair start and end tags within the run
+        partners = {}
+        open_tags = []
+        for index, (token, _) in enumerate(run):
+            if token.kind == START_TAG:
+                if token.name in INLINE_VOID_ELEMENTS or token.raw.endswith("/>"):
+                    partners[index] = None
+                else:
+                    open_tags.append(index)
+            elif token.kind == END_TAG:
+                for position in range(len(open_tags) - 1, -1, -1):
+                    if run[open_tags[position]][0].name == token.name:
+                        start_index = open_tags.pop(position)
+                        partners[start_index] = index
+                        partners[index] = start_index
+                        break
+        
+        # Widen the segment until it holds both tags of every pair it touches
+        first, last = anchors[0], anchors[-1]
+        changed = True
+        while changed:
+            changed = False
+            for index in range(first, last + 1):
+                partner = partners.get(index)
+                if partner is not None and partner < first:
+                    first, changed = partner, True
+                elif partner is not None and partner > last:
+                    last, changed = partner, True
+        
+        for index in range(first, last + 1):
+            token, span = run[index]
+            if token.kind != TEXT and index not in partners:
+                return plain
+            if span and PLACEHOLDER_PATTERN.search(span[2]):
+                return plain
+        
+        start = run[first][1][0] if run[first][1] else run[first][0].start
+        end = run[last][1][1] if run[last][1] else run[last][0].end
+        
+        pieces = []
+        tags = {}
+        numbers = {}
+        for index in range(first, last + 1):
+            token, _ = run[index]
+            if token.kind == TEXT:
+                piece_start = max(start, token.start) - token.start
+                piece_end = min(end, token.end) - token.start
+                pieces.append(html.unescape(token.raw[piece_start:piece_end]))
+                continue
+            
+            if token.kind == START_TAG:
+                numbers[index] = len(numbers) + 1
+                if partners[index] is None:
+                    marker = f"{{{numbers[index]}/}}"
+                else:
+                    marker = f"{{{numbers[index]}}}"
+            else:
+                marker = f"{{/{numbers[partners[index]]}}}"
+            tags[marker] = token.raw
+            pieces.append(marker)
+        
+        return [(start, end, "".join(pieces), tags)]
+
+def placeholders_valid(found, expected):
+    """
+    Check that placeholders match the expected ones
+    
+    Args:
+        found: List of placeholders in the order they appear
+        expected: List of the placeholders that must appear
+        
+    Returns:
+        True if every expected placeholder appears exactly once and each
+        end placeholder follows its start placeholder
+    """
+    if sorted(found) != sorted(expected):
+        return False
+    
+    opened = set()
+    for marker in found:
+        if marker.startswith("{/"):
+            if "{" + marker[2:] not in opened:
+                return False
+        else:
+            opened.add(marker)
+    return True
+
+def placeholders_match(source_text, translated_text):
+    """
+    Check that a translation kept the placeholders of its source text
+    
+    Args:
+        source_text: Text that was sent
+        translated_text: Text that came back
+        
+    Returns:
+        True if the placeholders are intact
+    """
+    return placeholders_valid(
+        PLACEHOLDER_PATTERN.findall(translated_text),
+        PLACEHOLDER_PATTERN.findall(source_text)
+    )
+
+def render_translation(translation, tags=None):
+    """
+    Turn the translation of a segment into HTML
+    
+    Args:
+        translation: Translated text
+        tags: Optional dictionary mapping the placeholders of a merged
+            segment to the source of their tags
+        
+    Returns:
+        Escaped HTML with the inline tags restored, or None if the
+        placeholders of a merged segment did not survive translation
+    """
+    translation = translation.strip()
+    if not tags:
+        return html.escape(translation, quote=False)
+    
+    if not placeholders_valid(PLACEHOLDER_PATTERN.findall(translation), list(tags)):
+        return None
+    
+    parts = []
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(translation):
+        parts.append(html.escape(translation[position:match.start()], quote=False))
+        parts.append(tags[match.group(0)])
+        position = match.end()
+    parts.append(html.escape(translation[position:], quote=False))
+    return "".join(parts)
+
+class HtmlDocument:
+    """
+    HTML document with the source spans of its translatable segments
+    
+    Segment keys (a0, a1, ...) follow document order. Rendering splices the
+    escaped translations into the original source in a single pass, so
+    everything outside the translated spans is kept byte for byte.
+    """
+    
+    def __init__(self, html_content):
+        """
+        Scan HTML content and record its translatable segments
+        
+        Args:
+            html_content: HTML content as string
+        """
+        self.html_content = html_content
+        self.spans = {}
+        self.segments = {}
+        self.inline_tags = {}
+        self.translations = {}
+        
+        segmenter = InlineRunSegmenter()
+        segments = []
+        for token in scan_html(html_content):
+            segments.extend(segmenter.add(token))
+        segments.extend(segmenter.close())
+        
+        for start, end, text, tags in segments:
+            idx = f"a{len(self.spans)}"
+            self.spans[idx] = (start, end)
+            self.segments[idx] = text
+            if tags:
+                self.inline_tags[idx] = tags
+    
+    def apply_translations(self, translated_dict, aliases=None):
+        """
+        Record translations of the text nodes
+        
+        Args:
+            translated_dict: Dictionary of translated text nodes
+            aliases: Optional dictionary mapping duplicate keys to the
+                canonical key whose translation they share
+        """
+        aliases = aliases or {}
+        
+        for idx in self.spans:
+            if idx in translated_dict:
+                self.translations[idx] = translated_dict[idx]
+            elif aliases.get(idx) in translated_dict:
+                self.translations[idx] = translated_dict[aliases[idx]]
+    
+    def render(self):
+        """
+        Serialize the document with its translations spliced in
+        
+        Returns:
+            HTML content as string
+        """
+        parts = []
+        position = 0
+        
+        for idx, (start, end) in self.spans.items():
+            if idx not in self.translations:
+                continue
+            translation = render_translation(self.translations[idx], self.inline_tags.get(idx))
+            if translation is None:
+                continue
+            parts.append(self.html_content[position:start])
+            parts.append(translation)
+            position = end
+        
+        parts.append(self.html_content[position:])
+        return "".join(parts)
+
 def parse_html_content(html_content):
     """
     Parse HTML content and extract text nodes for translation
@@ -62,227 +449,797 @@ def parse_html_content(html_content):
         html_content: HTML content as string
         
     Returns:
-        Dictionary of text nodes with keys as indices and values as text
+        Dictionary of text nodes with keys as indices and values as text
+    """
+    return HtmlDocument(html_content).segments
+
+def get_pass_through_rules(names=None):
+    """
+    Get the enabled pass-through rules
+    
+    Args:
+        names: Optional comma-separated string or list of rule names;
+            defaults to the HTML_PASS_THROUGH_RULES environment variable
+        
+    Returns:
+        Dictionary of compiled patterns keyed by rule name
+    """
+    if names is None:
+        names = ENABLED_PASS_THROUGH_RULES
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(",")]
+    return {name: PASS_THROUGH_RULES[name] for name in names if name in PASS_THROUGH_RULES}
+
+def classify_segment(text, rules=None):
+    """
+    Find the pass-through rule a text node matches
+    
+    Args:
+        text: Text node
+        rules: Dictionary of compiled patterns keyed by rule name; defaults
+            to the enabled pass-through rules
+        
+    Returns:
+        Name of the first matching rule, or None if the text should be
+        translated
+    """
+    if rules is None:
+        rules = get_pass_through_rules()
+    
+    core = PLACEHOLDER_PATTERN.sub("", text).strip()
+    for name, pattern in rules.items():
+        if pattern.fullmatch(core):
+            return name
+    return None
+
+def split_pass_through_segments(segments, rules=None):
+    """
+    Separate text nodes that need no translation
+    
+    Args:
+        segments: Dictionary of text nodes
+        rules: Dictionary of compiled patterns keyed by rule name; defaults
+            to the enabled pass-through rules
+        
+    Returns:
+        Tuple of (dictionary of text nodes to translate, dictionary mapping
+        each pass-through key to the rule it matched)
+    """
+    if rules is None:
+        rules = get_pass_through_rules()
+    
+    translatable = {}
+    pass_through = {}
+    
+    for idx, text in segments.items():
+        rule = classify_segment(text, rules) if rules else None
+        if rule:
+            pass_through[idx] = rule
+        else:
+            translatable[idx] = text
+    
+    return translatable, pass_through
+
+def split_target_language_segments(segments, source_language, target_language):
+    """
+    Separate text nodes that are already in the target language
+    
+    Args:
+        segments: Dictionary of text nodes
+        source_language: Source language code
+        target_language: Target language code
+        
+    Returns:
+        Tuple of (dictionary of text nodes to translate, set of keys of text
+        nodes confidently detected as the target language)
+    """
+    translatable = {}
+    in_target_language = set()
+    
+    for idx, text in segments.items():
+        if is_target_language(text, source_language, target_language):
+            in_target_language.add(idx)
+        else:
+            translatable[idx] = text
+    
+    return translatable, in_target_language
+
+def count_skipped(segments, pass_through, aliases, source_language, target_language):
+    """
+    Count the text nodes and estimated tokens kept out of the prompt
+    
+    Args:
+        segments: Dictionary of unique text nodes
+        pass_through: Dictionary mapping pass-through keys to rule names
+        aliases: Dictionary mapping duplicate keys to canonical keys
+        source_language: Source language code
+        target_language: Target language code
+        
+    Returns:
+        Tuple of (number of text nodes skipped, duplicates included,
+        estimated input and output tokens saved)
+    """
+    ratio = expansion_tracker.get_ratio(source_language, target_language)
+    skipped_tokens = sum(sum(estimate_segment_tokens(segments[idx], ratio)) for idx in pass_through)
+    skipped_segments = len(pass_through) + sum(1 for canonical in aliases.values() if canonical in pass_through)
+    return skipped_segments, skipped_tokens
+
+def dedupe_segments(parsed_content):
+    """
+    Collapse identical text nodes into one canonical segment
+    
+    Text nodes are compared without their surrounding whitespace. The first
+    occurrence of each text is kept as the canonical segment.
+    
+    Args:
+        parsed_content: Dictionary of text nodes
+        
+    Returns:
+        Tuple of (dictionary of unique text nodes, dictionary mapping each
+        duplicate key to its canonical key)
+    """
+    unique_content = {}
+    aliases = {}
+    canonical_keys = {}
+    
+    for idx, text in parsed_content.items():
+        core = text.strip()
+        canonical = canonical_keys.get(core)
+        if canonical is None:
+            canonical_keys[core] = idx
+            unique_content[idx] = text
+        else:
+            aliases[idx] = canonical
+    
+    return unique_content, aliases
+
+def replace_translated_content(html_content, translated_dict, aliases=None):
+    """
+    Replace original text with translated text in HTML
+    
+    Args:
+        html_content: Original HTML content
+        translated_dict: Dictionary of translated text nodes
+        aliases: Optional dictionary mapping duplicate keys to the canonical
+            key whose translation they share
+        
+    Returns:
+        HTML content with translated text
+    """
+    document = HtmlDocument(html_content)
+    document.apply_translations(translated_dict, aliases)
+    return document.render()
+
+@lru_cache(maxsize=64)
+def get_prompt_prefix(source_language, target_language):
+    """
+    Get the prompt text that precedes the segments for a language pair
+    
+    Args:
+        source_language: Source language name
+        target_language: Target language name
+        
+    Returns:
+        Prompt text with the language names filled in
+    """
+    prompt = HTML_TRANSLATION_PROMPT_TEMPLATE.replace("{$SOURCE_LANGUAGE}", source_language)
+    return prompt.replace("{$TARGET_LANGUAGE}", target_language)
+
+def escape_segment(text):
+    """
+    Escape the characters that would break the segment envelope
+    """
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def unescape_segment(text):
+    """
+    Undo escape_segment on a translated segment
+    """
+    return text.replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+
+def build_segment_envelope(content):
+    """
+    Serialize a chunk into the compact segment envelope
+    
+    Segments are numbered within the chunk (<a0>, <a1>, ...), so the keys
+    stay short however long the document is.
+    
+    Args:
+        content: Dictionary of text nodes to translate
+        
+    Returns:
+        Envelope text
+    """
+    return "".join(f"<a{number}>{escape_segment(text)}</a{number}>\n" for number, text in enumerate(content.values()))
+
+class SegmentResponseParser:
+    """
+    Incremental parser for model responses in the segment envelope
+    
+    Feed the response as it arrives; each segment is returned as soon as
+    its end tag has been received. Text outside the segments (the prefill,
+    a wrapping element, blank lines) is ignored, as are segments cut off by
+    the end of the response.
+    """
+    
+    def __init__(self, keys):
+        """
+        Initialize the parser
+        
+        Args:
+            keys: List of the chunk's segment keys, in envelope order
+        """
+        self.keys = keys
+        self._buffer = ""
+    
+    def feed(self, data):
+        """
+        Add the next part of the response
+        
+        Args:
+            data: Response text
+            
+        Returns:
+            Dictionary of the segments completed by the data
+        """
+        self._buffer += data
+        if ">" not in data:
+            return {}
+        
+        translated = {}
+        position = 0
+        for match in RESPONSE_SEGMENT_PATTERN.finditer(self._buffer):
+            number = int(match.group(1))
+            if number < len(self.keys):
+                translated[self.keys[number]] = unescape_segment(match.group(2))
+            position = match.end()
+        
+        self._buffer = self._buffer[position:]
+        return translated
+
+class PartTranslation:
+    """
+    Request state of one chunk translation
+    
+    Builds the prompt of a chunk and collects the translated segments and
+    metrics from the model's response, streamed or not. Shared by the
+    threaded and the asyncio request paths.
+    """
+    
+    def __init__(self, content, source_language, target_language):
+        """
+        Prepare the request for a chunk
+        
+        Args:
+            content: Dictionary of text nodes to translate
+            source_language: Source language name used in the prompt
+            target_language: Target language name used in the prompt
+        """
+        # The instructions are the same for every chunk of a language pair, so
+        # they go first as a cacheable prefix
+        self.instructions = get_prompt_prefix(source_language, target_language)
+        self.prompt = build_segment_envelope(content)
+        self.parser = SegmentResponseParser(list(content))
+        self.translated = {}
+        self.start_time = time.time()
+        self.metrics = {
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'cache_read_input_tokens': 0,
+            'cache_write_input_tokens': 0,
+            'streaming_chunks': 0,
+            'first_token_time': None,
+            'start_time': self.start_time,
+            'stop_reason': None,
+            'decode_time': 0,
+            'decode_output_tokens': 0
+        }
+    
+    @property
+    def request_args(self):
+        """
+        Keyword arguments for the model's invoke functions
+        """
+        return {'prefill_prompt': HTML_TRANSLATION_PREFILL_PROMPT, 'cached_prefix': self.instructions}
+    
+    def add_stream_chunk(self, chunk):
+        """
+        Record a chunk of a streaming response
+        
+        Args:
+            chunk: Text delta or metrics dictionary from the model
+        """
+        metrics = self.metrics
+        
+        # Check if this is a text chunk or a metrics chunk
+        if isinstance(chunk, str):
+            if metrics['streaming_chunks'] == 0:
+                metrics['first_token_time'] = time.time() - self.start_time
+            
+            metrics['streaming_chunks'] += 1
+            self.translated.update(self.parser.feed(chunk))
+            
+        elif isinstance(chunk, dict):
+            # Handle metrics or usage information
+            if chunk.get('type') == 'metrics':
+                metrics['input_tokens'] = chunk.get('input_tokens', 0)
+                metrics['output_tokens'] = chunk.get('output_tokens', 0)
+                metrics['cache_read_input_tokens'] = chunk.get('cache_read_input_tokens', 0)
+                metrics['cache_write_input_tokens'] = chunk.get('cache_write_input_tokens', 0)
+            elif chunk.get('type') == 'usage':
+                metrics['output_tokens'] = chunk.get('output_tokens', 0)
+                metrics['stop_reason'] = chunk.get('stop_reason')
+    
+    def add_response(self, response):
+        """
+        Record a non-streaming response
+        
+        Args:
+            response: Response dictionary from the model
+        """
+        metrics = self.metrics
+        metrics['stop_reason'] = response.get('stop_reason')
+        
+        # Get token usage if available
+        if 'usage' in response:
+            metrics['input_tokens'] = response['usage'].get('input_tokens', 0)
+            metrics['output_tokens'] = response['usage'].get('output_tokens', 0)
+            metrics['cache_read_input_tokens'] = response['usage'].get('cache_read_input_tokens', 0)
+            metrics['cache_write_input_tokens'] = response['usage'].get('cache_creation_input_tokens', 0)
+        
+        self.translated = self.parser.feed(response['content'])
+    
+    def finish(self):
+        """
+        Get the result of the request
+        
+        Returns:
+            Dictionary of translated text nodes and metrics
+        """
+        # Calculate processing time
+        metrics = self.metrics
+        metrics['processing_time'] = time.time() - self.start_time
+        
+        # Streamed responses also tell how fast the model decodes
+        if metrics['first_token_time'] is not None and metrics['output_tokens']:
+            decode_time = metrics['processing_time'] - metrics['first_token_time']
+            if decode_time > 0:
+                metrics['decode_time'] = decode_time
+                metrics['decode_output_tokens'] = metrics['output_tokens']
+        return self.translated, metrics
+
+def decode_tokens_per_second(metrics):
+    """
+    Get the decode speed of the streamed requests of a job
+    
+    Unlike the job's overall rate, this leaves out the time to first token
+    and does not add up chunks running in parallel.
+    
+    Args:
+        metrics: Summed chunk metrics
+        
+    Returns:
+        float: Output tokens per second of one stream, 0 without streamed requests
+    """
+    if metrics['decode_time'] > 0:
+        return metrics['decode_output_tokens'] / metrics['decode_time']
+    return 0
+
+def translate_html_part(content, source_language, target_language, model_config, bedrock_client, use_streaming=False):
+    """
+    Translate a part of HTML content
+    
+    Args:
+        content: Dictionary of text nodes to translate
+        source_language: Source language for translation
+        target_language: Target language for translation
+        model_config: Model configuration
+        bedrock_client: Bedrock client
+        use_streaming: Whether to use streaming API
+        
+    Returns:
+        Dictionary of translated text nodes and metrics
+    """
+    part = PartTranslation(content, source_language, target_language)
+    
+    try:
+        if use_streaming:
+            # Parse segments as the response streams in, hedging late streams
+            hedge_config, hedge_client = get_hedge_target(model_config, bedrock_client)
+            start = lambda config, client: lambda: config['invoke_streaming'](client, part.prompt, **part.request_args)
+            chunks = hedged_stream(
+                model_config['model_id'], start(model_config, bedrock_client),
+                hedge_config and start(hedge_config, hedge_client), hedge_config and hedge_config['model_id']
+            )
+            for chunk in chunks:
+                part.add_stream_chunk(chunk)
+        else:
+            part.add_response(model_config['invoke'](bedrock_client, part.prompt, **part.request_args))
+    except Exception as e:
+        if not is_read_timeout(e):
+            raise
+        # Keep the segments that arrived; the chunk is split like a truncated one
+        part.metrics['stop_reason'] = READ_TIMEOUT_STOP_REASON
+    
+    return part.finish()
+
+async def translate_html_part_async(content, source_language, target_language, model_config, bedrock_client, use_streaming=False):
+    """
+    Translate a part of HTML content on the shared event loop
+    
+    Args:
+        content: Dictionary of text nodes to translate
+        source_language: Source language for translation
+        target_language: Target language for translation
+        model_config: Model configuration
+        bedrock_client: Async Bedrock client
+        use_streaming: Whether to use streaming API
+        
+    Returns:
+        Dictionary of translated text nodes and metrics
+    """
+    part = PartTranslation(content, source_language, target_language)
+    
+    try:
+        if use_streaming:
+            hedge_config, hedge_client = await get_async_hedge_target(model_config, bedrock_client)
+            start = lambda config, client: lambda: config['invoke_streaming_async'](client, part.prompt, **part.request_args)
+            chunks = hedged_stream_async(
+                model_config['model_id'], start(model_config, bedrock_client),
+                hedge_config and start(hedge_config, hedge_client), hedge_config and hedge_config['model_id']
+            )
+            async for chunk in chunks:
+                part.add_stream_chunk(chunk)
+        else:
+            part.add_response(await model_config['invoke_async'](bedrock_client, part.prompt, **part.request_args))
+    except Exception as e:
+        if not is_read_timeout(e):
+            raise
+        part.metrics['stop_reason'] = READ_TIMEOUT_STOP_REASON
+    
+    return part.finish()
+
+def split_surrounding_whitespace(text):
+    """
+    Split a text node into leading whitespace, content and trailing whitespace
+    
+    Args:
+        text: Text to split
+        
+    Returns:
+        Tuple of (leading whitespace, stripped text, trailing whitespace)
+    """
+    core = text.strip()
+    if not core:
+        return text, '', ''
+    
+    start = text.index(core)
+    return text[:start], core, text[start + len(core):]
+
+def looks_untranslated(source_text, translated_text):
+    """
+    Check whether a translation is just the source text returned unchanged
+    
+    Short strings such as brand names or labels legitimately come back
+    unchanged, so only natural-language text of some length is flagged.
+    
+    Args:
+        source_text: Text that was sent
+        translated_text: Text that came back
+        
+    Returns:
+        True if the text looks untranslated
+    """
+    source = source_text.strip()
+    if translated_text.strip() != source:
+        return False
+    
+    if len(CJK_PATTERN.findall(source)) >= UNTRANSLATED_MIN_CJK_CHARS:
+        return True
+    return len(WORD_PATTERN.findall(source)) >= UNTRANSLATED_MIN_WORDS
+
+def find_missing_segments(requested, translated, check_untranslated=True):
+    """
+    Find requested segments without a usable translation
+    
+    Args:
+        requested: Dictionary of text nodes sent to the model
+        translated: Dictionary of translated text nodes received
+        check_untranslated: Whether segments returned unchanged count as missing
+        
+    Returns:
+        Dictionary of the requested text nodes that are missing, empty,
+        obviously untranslated or lost placeholders
+    """
+    missing = {}
+    
+    for idx, text in requested.items():
+        value = translated.get(idx)
+        if value is None or not value.strip():
+            missing[idx] = text
+        elif not placeholders_match(text, value):
+            missing[idx] = text
+        elif check_untranslated and looks_untranslated(text, value):
+            missing[idx] = text
+    
+    return missing
+
+def split_truncated_chunk(content, translated, source_language, target_language, metrics):
+    """
+    Record a chunk response and find what to resend if it was truncated
+    
+    A response that hit max_tokens or the read timeout counts as truncated.
+    The segments it completed are kept and only the rest is resent: as one
+    chunk if the response got through some segments, or in two halves if
+    it got through none.
+    
+    Args:
+        content: Dictionary of text nodes that were sent
+        translated: Dictionary of the text nodes the response completed
+        source_language: Source language code
+        target_language: Target language code
+        metrics: Metrics of the response, updated with truncated_chunks
+        
+    Returns:
+        List of the chunks to resend, or None
+    """
+    truncated = metrics.get('stop_reason') in ('max_tokens', READ_TIMEOUT_STOP_REASON)
+    expansion_tracker.record(source_language, target_language, content, metrics['output_tokens'], truncated=truncated)
+    metrics['truncated_chunks'] = 0
+    
+    remaining = {idx: text for idx, text in content.items() if idx not in translated}
+    if not truncated or not remaining:
+        return None
+    if len(remaining) < len(content):
+        metrics['truncated_chunks'] = 1
+        return [remaining]
+    
+    # A single segment that does not fit is left to the missing segment retries
+    if len(remaining) < 2:
+        return None
+    
+    metrics['truncated_chunks'] = 1
+    keys = list(remaining)
+    middle = len(keys) // 2
+    return [
+        {idx: remaining[idx] for idx in keys[:middle]},
+        {idx: remaining[idx] for idx in keys[middle:]}
+    ]
+
+def translate_chunk_adaptively(content, source_language, target_language, source_lang_name, target_lang_name, model_config, bedrock_client, use_streaming=False):
+    """
+    Translate a chunk, resending what a truncated response did not complete
+    
+    A response is truncated when the output hits the max_tokens limit or
+    does not arrive within the read timeout.
+    
+    Every response updates the shared expansion tracker, so chunks planned
+    later are sized from the observed output of this language pair.
+    
+    Args:
+        content: Dictionary of text nodes to translate
+        source_language: Source language code
+        target_language: Target language code
+        source_lang_name: Source language name used in the prompt
+        target_lang_name: Target language name used in the prompt
+        model_config: Model configuration
+        bedrock_client: Bedrock client
+        use_streaming: Whether to use streaming API
+        
+    Returns:
+        Dictionary of translated text nodes and metrics, including the
+        number of truncated responses
     """
-    # Use BeautifulSoup to parse HTML
-    soup = BeautifulSoup(html_content, "html.parser")
-    
-    ret_document = {}
+    translated, metrics = translate_html_part(
+        content,
+        source_lang_name,
+        target_lang_name,
+        model_config,
+        bedrock_client,
+        use_streaming
+    )
     
-    # Define a function to process text nodes
-    def process_text(text, counter):
-        if text.strip():
-            k = f"a{counter[0]}"
-            ret_document[k] = text
-            counter[0] += 1
-        return text
+    parts = split_truncated_chunk(content, translated, source_language, target_language, metrics)
+    if not parts:
+        return translated, metrics
     
-    # Traverse all text nodes
-    counter = [0]  # Use list as mutable object to track counter
-    
-    for element in soup.find_all(string=True):
-        if isinstance(element, (Comment, Stylesheet, Doctype)):
-            # Skip comments, stylesheets, and doctype declarations
-            continue
-            
-        if element.parent.get("style") == "display:none;":
-            continue
-            
-        if isinstance(element, NavigableString) and element.strip():
-            if element.parent.name not in [
-                "script",
-                "style",
-                "head",
-                "title",
-                "meta",
-                "[document]",
-            ]:
-                process_text(element, counter)
+    for part in parts:
+        part_translated, part_metrics = translate_chunk_adaptively(
+            part,
+            source_language,
+            target_language,
+            source_lang_name,
+            target_lang_name,
+            model_config,
+            bedrock_client,
+            use_streaming
+        )
+        translated.update(part_translated)
+        for key in CHUNK_METRIC_KEYS:
+            metrics[key] += part_metrics[key]
     
-    return ret_document
+    return translated, metrics
 
-def replace_translated_content(html_content, translated_dict):
+async def translate_chunk_adaptively_async(content, source_language, target_language, source_lang_name, target_lang_name, model_config, bedrock_client, use_streaming=False):
     """
-    Replace original text with translated text in HTML
+    Translate a chunk on the shared event loop, resending what truncated
+    responses did not complete
+    
+    Same as translate_chunk_adaptively, with an async Bedrock client.
     
-    Args:
-        html_content: Original HTML content
-        translated_dict: Dictionary of translated text nodes
-        
     Returns:
-        HTML content with translated text
+        Dictionary of translated text nodes and metrics
     """
-    # Use BeautifulSoup to parse HTML
-    soup = BeautifulSoup(html_content, "html.parser")
-    
-    # Define a function to process text nodes
-    def process_text(text, counter):
-        if text.strip():
-            k = f"a{counter[0]}"
-            if k in translated_dict:
-                text = translated_dict[k]
-            counter[0] += 1
-        return text
-    
-    # Traverse all text nodes
-    counter = [0]  # Use list as mutable object to track counter
-    
-    for element in soup.find_all(string=True):
-        if isinstance(element, (Comment, Stylesheet, Doctype)):
-            # Skip comments, stylesheets, and doctype declarations
-            continue
-            
-        if element.parent.get("style") == "display:none;":
-            continue
-            
-        if isinstance(element, NavigableString) and element.strip():
-            if element.parent.name not in [
-                "script",
-                "style",
-                "head",
-                "title",
-                "meta",
-                "[document]",
-            ]:
-                new_text = process_text(element, counter)
-                element.replace_with(new_text)
-    
-    # Generate new HTML content
-    return soup.prettify()
+    translated, metrics = await translate_html_part_async(
+        content,
+        source_lang_name,
+        target_lang_name,
+        model_config,
+        bedrock_client,
+        use_streaming
+    )
+    
+    parts = split_truncated_chunk(content, translated, source_language, target_language, metrics)
+    if not parts:
+        return translated, metrics
+    
+    for part in parts:
+        part_translated, part_metrics = await translate_chunk_adaptively_async(
+            part,
+            source_language,
+            target_language,
+            source_lang_name,
+            target_lang_name,
+            model_config,
+            bedrock_client,
+            use_streaming
+        )
+        translated.update(part_translated)
+        for key in CHUNK_METRIC_KEYS:
+            metrics[key] += part_metrics[key]
+    
+    return translated, metrics
 
-def translate_html_part(content, source_language, target_language, model_config, bedrock_client, use_streaming=False):
+async def translate_chunk_on_loop(limit, content, source_language, target_language, source_lang_name, target_lang_name, model_config, use_streaming=False):
     """
-    Translate a part of HTML content
+    Translate a chunk of a job on the shared event loop
     
     Args:
+        limit: asyncio.Semaphore bounding the job's chunks in flight
         content: Dictionary of text nodes to translate
-        source_language: Source language for translation
-        target_language: Target language for translation
+        source_language: Source language code
+        target_language: Target language code
+        source_lang_name: Source language name used in the prompt
+        target_lang_name: Target language name used in the prompt
         model_config: Model configuration
-        bedrock_client: Bedrock client
         use_streaming: Whether to use streaming API
         
     Returns:
         Dictionary of translated text nodes and metrics
     """
-    # Create root element
-    root = ET.Element("content")
-    for idx, text in content.items():
-        # Add child element
-        child = ET.SubElement(root, str(idx))
-        child.text = text
-    
-    # Create XML tree
-    tree = ET.ElementTree(root)
-    ET.indent(root, space="", level=0)
-    text = ET.tostring(root).decode("utf-8")
-    # Prepare prompt for translation
-    prompt = HTML_TRANSLATION_PROMPT_BASE.replace("{$HTML_CONTENT}", text)
-    prompt = prompt.replace("{$SOURCE_LANGUAGE}", source_language)
-    prompt = prompt.replace("{$TARGET_LANGUAGE}", target_language)
-    print(prompt)
+    async with limit:
+        bedrock_client = await get_async_routed_client(model_config['model_id'])
+        return await translate_chunk_adaptively_async(
+            content,
+            source_language,
+            target_language,
+            source_lang_name,
+            target_lang_name,
+            model_config,
+            bedrock_client,
+            use_streaming
+        )
+
+def lookup_translation_memory(memory, segments, source_language, target_language, model_name):
+    """
+    Look up segments in the translation memory
     
+    Args:
+        memory: Translation memory
+        segments: Dictionary of text nodes
+        source_language: Source language code
+        target_language: Target language code
+        model_name: Name of the selected model
+        
+    Returns:
+        Tuple of (dictionary of text nodes found in the memory, number of
+        hits, estimated tokens saved)
+    """
     translated = {}
-    metrics = {
-        'input_tokens': 0,
-        'output_tokens': 0,
-        'streaming_chunks': 0,
-        'first_token_time': None
-    }
+    tokens_saved = 0
     
-    start_time = time.time()
+    split_segments = {idx: split_surrounding_whitespace(text) for idx, text in segments.items()}
+    memory_hits = memory.lookup(
+        (core for _, core, _ in split_segments.values()),
+        source_language,
+        target_language,
+        model_name
+    )
     
-    if use_streaming:
-        # Process streaming response
-        full_text = ""
-        
-        for chunk in model_config['invoke_streaming'](bedrock_client, prompt, prefill_prompt=HTML_TRANSLATION_PREFILL_PROMPT):
-            # Check if this is a text chunk or a metrics chunk
-            if isinstance(chunk, str):
-                if metrics['streaming_chunks'] == 0:
-                    metrics['first_token_time'] = time.time() - start_time
-                
-                metrics['streaming_chunks'] += 1
-                full_text += chunk
-                
-            elif isinstance(chunk, dict):
-                # Handle metrics or usage information
-                if chunk.get('type') == 'metrics':
-                    metrics['input_tokens'] = chunk.get('input_tokens', 0)
-                    metrics['output_tokens'] = chunk.get('output_tokens', 0)
-                elif chunk.get('type') == 'usage':
-                    metrics['output_tokens'] = chunk.get('output_tokens', 0)
-        
-        # Parse the full text response
-        try:
-            # Try to parse the XML content directly
-            try:
-                result_xml = ET.fromstring(full_text)
-                translated = {child.tag: child.text for child in result_xml}
-            except ET.ParseError:
-                # If parsing fails, try to extract individual elements
-                translated = extract_elements_from_text(full_text)
-        except Exception:
-            translated = {}
-    else:
-        # Non-streaming mode
-        response = model_config['invoke'](bedrock_client, prompt, prefill_prompt=HTML_TRANSLATION_PREFILL_PROMPT)
-        result = response['content']
-        
-        # Get token usage if available
-        if 'usage' in response:
-            metrics['input_tokens'] = response['usage'].get('input_tokens', 0)
-            metrics['output_tokens'] = response['usage'].get('output_tokens', 0)
-        
-        # Parse XML response
-        try:
-            # Try to parse the XML content directly
-            try:
-                result_xml = ET.fromstring(result)
-                translated = {child.tag: child.text for child in result_xml}
-            except ET.ParseError:
-                # If parsing fails, try to extract individual elements
-                translated = extract_elements_from_text(result)
-        except Exception:
-            translated = {}
-    
-    # Calculate processing time
-    metrics['processing_time'] = time.time() - start_time
+    for idx, (leading, core, trailing) in split_segments.items():
+        if core in memory_hits:
+            translated[idx] = leading + memory_hits[core] + trailing
+            tokens_saved += estimate_tokens(core) + estimate_tokens(memory_hits[core])
     
-    return translated, metrics
+    return translated, len(translated), tokens_saved
+
+def store_translation_memory(memory, requested, translated, missing, source_language, target_language, model_name):
+    """
+    Write new translations back to the translation memory
+    
+    Args:
+        memory: Translation memory
+        requested: Dictionary of text nodes sent to the model
+        translated: Dictionary of translated text nodes
+        missing: Dictionary of text nodes still missing a usable translation
+        source_language: Source language code
+        target_language: Target language code
+        model_name: Name of the selected model
+    """
+    new_entries = {}
+    for idx, value in translated.items():
+        if idx in requested and idx not in missing and value and value.strip():
+            new_entries[requested[idx].strip()] = value.strip()
+    memory.store(new_entries, source_language, target_language, model_name)
 
-def extract_elements_from_text(text):
+def retry_missing_segments(requested, translated, source_language, target_language, source_lang_name, target_lang_name, model_config, bedrock_client, use_streaming=False, max_retries=DEFAULT_MAX_RETRIES, on_retry=None):
     """
-    Extract elements from text when XML parsing fails
+    Re-request segments that did not come back translated
+    
+    Usable translations from the retries are added to translated.
     
     Args:
-        text: Text to extract elements from
+        requested: Dictionary of text nodes sent to the model
+        translated: Dictionary of translated text nodes, updated in place
+        source_language: Source language code
+        target_language: Target language code
+        source_lang_name: Source language name used in the prompt
+        target_lang_name: Target language name used in the prompt
+        model_config: Model configuration
+        bedrock_client: Bedrock client
+        use_streaming: Whether to use streaming API
+        max_retries: Maximum follow-up requests
+        on_retry: Optional callback called with the attempt number and the
+            number of missing segments before each follow-up request
         
     Returns:
-        Dictionary of extracted elements
+        Tuple of (dictionary of text nodes still missing, number of segments
+        that needed a retry, metrics of the follow-up requests)
     """
-    translated = {}
-    lines = text.split('\n')
-    
-    for line in lines:
-        line = line.strip()
-        if line.startswith('<a') and '>' in line:
-            tag_end = line.find('>')
-            if tag_end != -1:
-                tag = line[:tag_end+1]
-                content = line[tag_end+1:]
-                
-                if '</a' in content:
-                    content_end = content.find('</a')
-                    if content_end != -1:
-                        content = content[:content_end]
-                        
-                tag_name = tag[1:-1]  # Remove < and >
-                translated[tag_name] = content
+    check_untranslated = source_language != target_language
+    missing = find_missing_segments(requested, translated, check_untranslated)
+    retried_segments = len(missing)
+    metrics = dict.fromkeys(CHUNK_METRIC_KEYS, 0)
+    retries = 0
+    
+    while missing and retries < max_retries:
+        retries += 1
+        if on_retry:
+            on_retry(retries, len(missing))
+        
+        retry_translated, retry_metrics = translate_chunk_adaptively(
+            missing,
+            source_language,
+            target_language,
+            source_lang_name,
+            target_lang_name,
+            model_config,
+            bedrock_client,
+            use_streaming
+        )
+        
+        for key in metrics:
+            metrics[key] += retry_metrics[key]
+        
+        for idx, value in retry_translated.items():
+            if idx in missing and value and value.strip():
+                translated[idx] = value
+        
+        missing = find_missing_segments(missing, translated, check_untranslated)
     
-    return translated
+    return missing, retried_segments, metrics
 
-def translate_html(session_manager, session_id, html_content, source_language, target_language, max_chunk_size=8000):
+def translate_html(session_manager, session_id, html_content, source_language, target_language, max_chunk_size=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES, pass_through_rules=None):
     """
     Translate HTML content using LLM
     
@@ -290,15 +1247,22 @@ def translate_html(session_manager, session_id, html_content, source_language, t
         session_manager: Session manager instance
         session_id: Current session ID
         html_content: HTML content to translate
-        source_language: Source language
+        source_language: Source language, or "auto" to detect it
         target_language: Target language
-        max_chunk_size: Maximum chunk size for translation
+        max_chunk_size: Optional hard limit on characters per chunk; chunks
+            are otherwise sized from the model's token limits
+        max_concurrency: Maximum number of chunks translated at the same time
+        max_retries: Maximum follow-up requests for missing segments
+        pass_through_rules: Optional dictionary of compiled patterns keyed by
+            rule name for text nodes kept as they are; defaults to the
+            enabled pass-through rules
     """
     try:
         # Get session status
         status = session_manager.get_session_status(session_id)
         model_name = status.get('selected_model')
         use_streaming = status.get('use_streaming', False)
+        use_translation_memory = status.get('use_translation_memory', True)
         
         # Update session status
         session_manager.update_session_status(
@@ -317,12 +1281,8 @@ def translate_html(session_manager, session_id, html_content, source_language, t
             )
             return
         
-        # Create Bedrock client
-        bedrock_client = get_bedrock_client()
-        
-        # Get language names for prompt
-        source_lang_name = get_language_name(source_language, use_native=False)
-        target_lang_name = get_language_name(target_language, use_native=False)
+        # Create the Bedrock client of the best region for the model
+        bedrock_client = get_routed_client(model_config['model_id'])
         
         # Update session status
         session_manager.update_session_status(
@@ -331,8 +1291,9 @@ def translate_html(session_manager, session_id, html_content, source_language, t
             progress_percentage=15
         )
         
-        # Parse HTML content
-        parsed_content = parse_html_content(html_content)
+        # Scan HTML content once, recording the spans of the text nodes
+        document = HtmlDocument(html_content)
+        parsed_content = document.segments
         total_elements = len(parsed_content)
         
         if total_elements == 0:
@@ -343,101 +1304,190 @@ def translate_html(session_manager, session_id, html_content, source_language, t
             )
             return
             
+        # Detect the source language when it was left to us
+        if source_language == AUTO_DETECT_LANGUAGE:
+            source_language = detect_dominant_language(parsed_content.values(), default=DEFAULT_SOURCE_LANGUAGE)
+            session_manager.update_session_status(session_id, detected_source_language=source_language)
+        
+        # Get language names for prompt
+        source_lang_name = get_language_name(source_language, use_native=False)
+        target_lang_name = get_language_name(target_language, use_native=False)
+        
+        # Send each distinct text to the model only once
+        unique_content, aliases = dedupe_segments(parsed_content)
+        
+        # Keep numbers, identifiers, URLs and the like out of the prompt
+        translatable_content, pass_through = split_pass_through_segments(unique_content, pass_through_rules)
+        skipped_segments, skipped_tokens = count_skipped(unique_content, pass_through, aliases, source_language, target_language)
+        
+        # Keep text that is already in the target language as it is
+        translatable_content, in_target_language = split_target_language_segments(translatable_content, source_language, target_language)
+        target_language_segments = len(in_target_language) + sum(1 for canonical in aliases.values() if canonical in in_target_language)
+        unique_elements = len(translatable_content)
+        
         # Update session status
         session_manager.update_session_status(
             session_id,
-            current_task=f"Found {total_elements} text elements to translate",
-            progress_percentage=20
+            current_task=f"Found {total_elements} text elements to translate ({unique_elements} unique, {skipped_segments + target_language_segments} kept as is)",
+            progress_percentage=20,
+            deduplicated_segments=len(aliases),
+            elements_translated=total_elements,
+            skipped_segments=skipped_segments,
+            skipped_tokens=skipped_tokens,
+            target_language_segments=target_language_segments
         )
         
         # Start timing
         start_time = time.time()
         
         # Initialize metrics
-        total_input_tokens = 0
-        total_output_tokens = 0
-        total_streaming_chunks = 0
+        totals = dict.fromkeys(CHUNK_METRIC_KEYS, 0)
         first_token_time = None
         
-        # Translate in chunks
+        # Fill in segments already in the translation memory
         translated_content = {}
-        current_chunk = {}
-        current_chunk_size = 0
+        memory = get_translation_memory() if use_translation_memory else None
+        tm_hits = 0
+        tm_tokens_saved = 0
+        if memory:
+            translated_content, tm_hits, tm_tokens_saved = lookup_translation_memory(
+                memory,
+                translatable_content,
+                source_language,
+                target_language,
+                model_name
+            )
+        
+        # Only segments missing from the memory go to the model
+        pending_content = {idx: text for idx, text in translatable_content.items() if idx not in translated_content}
+        pending_elements = len(pending_content)
+        
+        # Pack the segments into chunks sized for the model's token limits
+        chunks = plan_chunks(
+            pending_content,
+            model_config,
+            source_language,
+            target_language,
+            prompt_tokens=HTML_TRANSLATION_PROMPT_TOKENS,
+            min_chunks=max_concurrency,
+            max_chunk_chars=max_chunk_size,
+            use_streaming=use_streaming
+        )
+        chunk_results = [None] * len(chunks)
         processed_elements = 0
+        finished_chunks = 0
+        
+        session_manager.update_session_status(
+            session_id,
+            current_task=f"Translating {len(chunks)} chunks ({pending_elements} elements, {tm_hits} from translation memory)",
+            progress_percentage=20,
+            tm_hits=tm_hits,
+            tm_lookups=unique_elements if memory else 0,
+            tm_hit_rate=round(tm_hits / unique_elements, 4) if memory and unique_elements else 0,
+            tm_tokens_saved=tm_tokens_saved
+        )
         
-        for idx, text in parsed_content.items():
-            text_length = len(text)
+        executor = None
+        if async_available():
+            # Chunks of every job share one event loop instead of a thread each
+            limit = asyncio.Semaphore(max(1, max_concurrency))
+            submit = lambda chunk: run_on_loop(translate_chunk_on_loop(
+                limit,
+                chunk,
+                source_language,
+                target_language,
+                source_lang_name,
+                target_lang_name,
+                model_config,
+                use_streaming
+            ))
+        else:
+            executor = ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(chunks))))
+            submit = lambda chunk: executor.submit(
+                translate_chunk_adaptively,
+                chunk,
+                source_language,
+                target_language,
+                source_lang_name,
+                target_lang_name,
+                model_config,
+                bedrock_client,
+                use_streaming
+            )
+        
+        try:
+            futures = {submit(chunk): chunk_index for chunk_index, chunk in enumerate(chunks)}
             
-            # If adding this text would exceed the chunk size, translate the current chunk
-            if current_chunk_size + text_length > max_chunk_size and current_chunk:
+            for future in as_completed(futures):
+                chunk_index = futures[future]
+                chunk_translated, chunk_metrics = future.result()
+                chunk_results[chunk_index] = chunk_translated
+                
+                # Update metrics
+                for key in CHUNK_METRIC_KEYS:
+                    totals[key] += chunk_metrics[key]
+                
+                # First token time is measured from the start of the whole job
+                if chunk_metrics['first_token_time'] is not None:
+                    chunk_first_token = chunk_metrics['start_time'] + chunk_metrics['first_token_time'] - start_time
+                    if first_token_time is None or chunk_first_token < first_token_time:
+                        first_token_time = chunk_first_token
+                
                 # Update session status
-                progress = 20 + int(70 * processed_elements / total_elements)
+                finished_chunks += 1
+                processed_elements += len(chunks[chunk_index])
+                progress = 20 + int(70 * processed_elements / pending_elements)
                 session_manager.update_session_status(
                     session_id,
-                    current_task=f"Translating chunk ({processed_elements}/{total_elements} elements)",
+                    current_task=f"Translated chunk {finished_chunks}/{len(chunks)} ({processed_elements}/{pending_elements} elements)",
                     progress_percentage=progress
                 )
-                
-                # Translate current chunk
-                chunk_translated, chunk_metrics = translate_html_part(
-                    current_chunk, 
-                    source_lang_name,
-                    target_lang_name, 
-                    model_config, 
-                    bedrock_client,
-                    use_streaming
-                )
-                
-                # Update metrics
-                total_input_tokens += chunk_metrics['input_tokens']
-                total_output_tokens += chunk_metrics['output_tokens']
-                total_streaming_chunks += chunk_metrics['streaming_chunks']
-                
-                if first_token_time is None and chunk_metrics['first_token_time'] is not None:
-                    first_token_time = chunk_metrics['first_token_time']
-                
-                # Update translated content
-                translated_content.update(chunk_translated)
-                
-                # Reset chunk
-                current_chunk = {}
-                current_chunk_size = 0
-            
-            # Add text to current chunk
-            current_chunk[idx] = text
-            current_chunk_size += text_length
-            processed_elements += 1
-        
-        # Translate any remaining content
-        if current_chunk:
-            # Update session status
-            progress = 20 + int(70 * processed_elements / total_elements)
+        finally:
+            if executor:
+                executor.shutdown()
+        
+        # Merge translated chunks in document order
+        model_translations = {}
+        for chunk_translated in chunk_results:
+            model_translations.update(chunk_translated)
+        
+        # Re-request only the segments that did not come back translated
+        def report_retry(attempt, missing_count):
             session_manager.update_session_status(
                 session_id,
-                current_task=f"Translating final chunk ({processed_elements}/{total_elements} elements)",
-                progress_percentage=progress
+                current_task=f"Re-requesting {missing_count} missing segments (attempt {attempt}/{max_retries})",
+                progress_percentage=88
             )
-            
-            # Translate current chunk
-            chunk_translated, chunk_metrics = translate_html_part(
-                current_chunk, 
-                source_lang_name,
-                target_lang_name, 
-                model_config, 
-                bedrock_client,
-                use_streaming
+        
+        missing_content, retried_segments, retry_metrics = retry_missing_segments(
+            pending_content,
+            model_translations,
+            source_language,
+            target_language,
+            source_lang_name,
+            target_lang_name,
+            model_config,
+            bedrock_client,
+            use_streaming,
+            max_retries=max_retries,
+            on_retry=report_retry
+        )
+        for key in CHUNK_METRIC_KEYS:
+            totals[key] += retry_metrics[key]
+        
+        translated_content.update(model_translations)
+        
+        # Write new translations back to the translation memory
+        if memory:
+            store_translation_memory(
+                memory,
+                pending_content,
+                model_translations,
+                missing_content,
+                source_language,
+                target_language,
+                model_name
             )
-            
-            # Update metrics
-            total_input_tokens += chunk_metrics['input_tokens']
-            total_output_tokens += chunk_metrics['output_tokens']
-            total_streaming_chunks += chunk_metrics['streaming_chunks']
-            
-            if first_token_time is None and chunk_metrics['first_token_time'] is not None:
-                first_token_time = chunk_metrics['first_token_time']
-            
-            # Update translated content
-            translated_content.update(chunk_translated)
         
         # Replace translated content in HTML
         session_manager.update_session_status(
@@ -446,7 +1496,8 @@ def translate_html(session_manager, session_id, html_content, source_language, t
             progress_percentage=90
         )
         
-        translated_html = replace_translated_content(html_content, translated_content)
+        document.apply_translations(translated_content, aliases)
+        translated_html = document.render()
         
         # Calculate processing time
         end_time = time.time()
@@ -454,8 +1505,8 @@ def translate_html(session_manager, session_id, html_content, source_language, t
         
         # Calculate tokens per second if we have output tokens
         tokens_per_second = 0
-        if total_output_tokens > 0 and processing_time > 0:
-            tokens_per_second = total_output_tokens / processing_time
+        if totals['output_tokens'] > 0 and processing_time > 0:
+            tokens_per_second = totals['output_tokens'] / processing_time
         
         # Save the translated HTML
         output_path = session_manager.get_generated_path(session_id, "translated_html.html")
@@ -476,11 +1527,17 @@ def translate_html(session_manager, session_id, html_content, source_language, t
             is_processing=False,
             processing_complete=True,
             processing_time=processing_time,
-            input_tokens=total_input_tokens,
-            output_tokens=total_output_tokens,
-            streaming_chunks=total_streaming_chunks,
+            input_tokens=totals['input_tokens'],
+            output_tokens=totals['output_tokens'],
+            cache_read_input_tokens=totals['cache_read_input_tokens'],
+            cache_write_input_tokens=totals['cache_write_input_tokens'],
+            streaming_chunks=totals['streaming_chunks'],
             first_token_time=first_token_time,
-            tokens_per_second=tokens_per_second
+            tokens_per_second=tokens_per_second,
+            decode_tokens_per_second=decode_tokens_per_second(totals),
+            truncated_chunks=totals['truncated_chunks'],
+            retried_segments=retried_segments,
+            missing_segments=len(missing_content)
         )
         
         return translated_html
@@ -493,3 +1550,428 @@ def translate_html(session_manager, session_id, html_content, source_language, t
             error_message=f"Error during HTML translation: {str(e)}"
         )
         return None
+
+def translate_segments(segments, source_language, target_language, source_lang_name, target_lang_name, model_config, model_name, bedrock_client, use_streaming=False, memory=None, max_retries=DEFAULT_MAX_RETRIES, pass_through_rules=None):
+    """
+    Translate one chunk of a streamed document
+    
+    Runs the whole per-segment pipeline on the chunk: deduplication,
+    pass-through classification, target language detection, translation
+    memory lookup, model translation, retries for missing segments and
+    translation memory writeback.
+    
+    Args:
+        segments: Dictionary of text nodes in the chunk
+        source_language: Source language code
+        target_language: Target language code
+        source_lang_name: Source language name used in the prompt
+        target_lang_name: Target language name used in the prompt
+        model_config: Model configuration
+        model_name: Name of the selected model
+        bedrock_client: Bedrock client
+        use_streaming: Whether to use streaming API
+        memory: Optional translation memory
+        max_retries: Maximum follow-up requests for missing segments
+        pass_through_rules: Optional dictionary of compiled patterns keyed by
+            rule name for text nodes kept as they are
+        
+    Returns:
+        Dictionary of translated text nodes, duplicates included, and metrics
+    """
+    unique_content, aliases = dedupe_segments(segments)
+    translatable_content, pass_through = split_pass_through_segments(unique_content, pass_through_rules)
+    skipped_segments, skipped_tokens = count_skipped(unique_content, pass_through, aliases, source_language, target_language)
+    translatable_content, in_target_language = split_target_language_segments(translatable_content, source_language, target_language)
+    
+    translated = {}
+    metrics = {
+        'input_tokens': 0,
+        'output_tokens': 0,
+        'cache_read_input_tokens': 0,
+        'cache_write_input_tokens': 0,
+        'streaming_chunks': 0,
+        'truncated_chunks': 0,
+        'decode_time': 0,
+        'decode_output_tokens': 0,
+        'first_token_time': None,
+        'start_time': time.time(),
+        'tm_hits': 0,
+        'tm_tokens_saved': 0,
+        'deduplicated_segments': len(aliases),
+        'skipped_segments': skipped_segments,
+        'skipped_tokens': skipped_tokens,
+        'target_language_segments': len(in_target_language) + sum(1 for canonical in aliases.values() if canonical in in_target_language),
+        'tm_lookups': len(translatable_content) if memory else 0,
+        'retried_segments': 0,
+        'missing_segments': 0
+    }
+    
+    if memory:
+        translated, metrics['tm_hits'], metrics['tm_tokens_saved'] = lookup_translation_memory(
+            memory,
+            translatable_content,
+            source_language,
+            target_language,
+            model_name
+        )
+    
+    pending_content = {idx: text for idx, text in translatable_content.items() if idx not in translated}
+    
+    if pending_content:
+        model_translations, chunk_metrics = translate_chunk_adaptively(
+            pending_content,
+            source_language,
+            target_language,
+            source_lang_name,
+            target_lang_name,
+            model_config,
+            bedrock_client,
+            use_streaming
+        )
+        metrics['first_token_time'] = chunk_metrics['first_token_time']
+        metrics['start_time'] = chunk_metrics['start_time']
+        
+        missing_content, metrics['retried_segments'], retry_metrics = retry_missing_segments(
+            pending_content,
+            model_translations,
+            source_language,
+            target_language,
+            source_lang_name,
+            target_lang_name,
+            model_config,
+            bedrock_client,
+            use_streaming,
+            max_retries=max_retries
+        )
+        metrics['missing_segments'] = len(missing_content)
+        
+        for key in CHUNK_METRIC_KEYS:
+            metrics[key] = chunk_metrics[key] + retry_metrics[key]
+        
+        if memory:
+            store_translation_memory(
+                memory,
+                pending_content,
+                model_translations,
+                missing_content,
+                source_language,
+                target_language,
+                model_name
+            )
+        
+        translated.update(model_translations)
+    
+    for idx, canonical in aliases.items():
+        if canonical in translated:
+            translated[idx] = translated[canonical]
+    
+    return translated, metrics
+
+def sample_file_segments(input_path, max_bytes=4 * STREAM_READ_SIZE):
+    """
+    Collect the text nodes at the start of an HTML file
+    
+    Args:
+        input_path: Path of the UTF-8 HTML file
+        max_bytes: Number of bytes to read
+        
+    Returns:
+        List of text node strings
+    """
+    with open(input_path, 'rb') as f:
+        data = f.read(max_bytes).decode('utf-8', errors='ignore')
+    
+    segments = []
+    for token in HtmlScanner().feed(data):
+        if token.kind == TEXT:
+            span = text_segment_span(token)
+            if span:
+                segments.append(span[2])
+    return segments
+
+def translate_html_file(session_manager, session_id, input_path, source_language, target_language, max_chunk_size=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, max_retries=DEFAULT_MAX_RETRIES, pass_through_rules=None):
+    """
+    Translate an HTML file without loading the whole document
+    
+    The file is tokenized as it is read. Segments are packed into chunks as
+    they are found, chunks are translated in parallel, and the output is
+    written in document order as soon as the chunks before it are done.
+    Only the source between the first unwritten segment and the read
+    position is held in memory, and reading pauses while 2 x
+    max_concurrency chunks are in flight, so memory use depends on the
+    chunk size rather than the document size.
+    
+    Args:
+        session_manager: Session manager instance
+        session_id: Current session ID
+        input_path: Path of the UTF-8 HTML file to translate
+        source_language: Source language, or "auto" to detect it
+        target_language: Target language
+        max_chunk_size: Optional hard limit on characters per chunk
+        max_concurrency: Maximum number of chunks translated at the same time
+        max_retries: Maximum follow-up requests for missing segments
+        pass_through_rules: Optional dictionary of compiled patterns keyed by
+            rule name for text nodes kept as they are
+        
+    Returns:
+        Path of the translated HTML file, or None on error
+    """
+    try:
+        # Get session status
+        status = session_manager.get_session_status(session_id)
+        model_name = status.get('selected_model')
+        use_streaming = status.get('use_streaming', False)
+        use_translation_memory = status.get('use_translation_memory', True)
+        
+        model_config = MODEL_CONFIGS.get(model_name)
+        if not model_config:
+            session_manager.update_session_status(
+                session_id,
+                is_processing=False,
+                error_message=f"Invalid model: {model_name}"
+            )
+            return None
+        
+        bedrock_client = get_routed_client(model_config['model_id'])
+        memory = get_translation_memory() if use_translation_memory else None
+        
+        # Detect the source language from the start of the document
+        if source_language == AUTO_DETECT_LANGUAGE:
+            source_language = detect_dominant_language(sample_file_segments(input_path), default=DEFAULT_SOURCE_LANGUAGE)
+            session_manager.update_session_status(session_id, detected_source_language=source_language)
+        
+        source_lang_name = get_language_name(source_language, use_native=False)
+        target_lang_name = get_language_name(target_language, use_native=False)
+        
+        input_size = os.path.getsize(input_path)
+        output_path = session_manager.get_generated_path(session_id, "translated_html.html")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        
+        session_manager.update_session_status(
+            session_id,
+            current_task="Translating HTML document",
+            progress_percentage=5
+        )
+        
+        start_time = time.time()
+        totals = {
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'cache_read_input_tokens': 0,
+            'cache_write_input_tokens': 0,
+            'streaming_chunks': 0,
+            'truncated_chunks': 0,
+            'decode_time': 0,
+            'decode_output_tokens': 0,
+            'tm_hits': 0,
+            'tm_tokens_saved': 0,
+            'deduplicated_segments': 0,
+            'skipped_segments': 0,
+            'skipped_tokens': 0,
+            'target_language_segments': 0,
+            'tm_lookups': 0,
+            'retried_segments': 0,
+            'missing_segments': 0
+        }
+        first_token_time = None
+        total_elements = 0
+        finished_chunks = 0
+        bytes_read = 0
+        
+        scanner = HtmlScanner()
+        segmenter = InlineRunSegmenter()
+        packer = ChunkPacker(
+            model_config,
+            source_language,
+            target_language,
+            prompt_tokens=HTML_TRANSLATION_PROMPT_TOKENS,
+            output_budget=STREAM_CHUNK_OUTPUT_TOKENS,
+            max_chunk_chars=max_chunk_size,
+            use_streaming=use_streaming
+        )
+        
+        # Spans of segments not yet packed into a chunk
+        pending_spans = {}
+        # Chunks being translated, in document order
+        in_flight = deque()
+        max_in_flight = 2 * max(1, max_concurrency)
+        
+        # Source not written yet, starting at document offset window_start
+        window = ""
+        window_start = 0
+        
+        # Decoding with surrogateescape writes undecodable bytes back unchanged
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='surrogateescape')
+        
+        with open(input_path, 'rb') as source, open(output_path, 'wb') as output, \
+                ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            
+            def write(text):
+                output.write(text.encode('utf-8', errors='surrogateescape'))
+            
+            def finish_oldest_chunk():
+                nonlocal window, window_start, first_token_time, finished_chunks
+                future, spans = in_flight.popleft()
+                translated, chunk_metrics = future.result()
+                
+                for key in totals:
+                    totals[key] += chunk_metrics[key]
+                if chunk_metrics['first_token_time'] is not None:
+                    chunk_first_token = chunk_metrics['start_time'] + chunk_metrics['first_token_time'] - start_time
+                    if first_token_time is None or chunk_first_token < first_token_time:
+                        first_token_time = chunk_first_token
+                
+                # Splice the chunk into the output and drop the written source
+                parts = []
+                position = window_start
+                for idx, (start, end, tags) in spans.items():
+                    value = translated.get(idx)
+                    if not value or not value.strip():
+                        continue
+                    value = render_translation(value, tags)
+                    if value is None:
+                        continue
+                    parts.append(window[position - window_start:start - window_start])
+                    parts.append(value)
+                    position = end
+                write("".join(parts))
+                window = window[position - window_start:]
+                window_start = position
+                
+                finished_chunks += 1
+                session_manager.update_session_status(
+                    session_id,
+                    current_task=f"Translated chunk {finished_chunks} ({total_elements} elements found)",
+                    progress_percentage=5 + int(90 * bytes_read / max(1, input_size))
+                )
+            
+            def write_through():
+                # Source before the first segment still waiting for a
+                # translation is final, so it is written out as it is read
+                nonlocal window, window_start
+                if in_flight:
+                    position = min(start for start, _, _ in in_flight[0][1].values())
+                elif pending_spans:
+                    position = next(iter(pending_spans.values()))[0]
+                elif segmenter.start is not None:
+                    position = segmenter.start
+                else:
+                    position = scanner.offset
+                if position > window_start:
+                    write(window[:position - window_start])
+                    window = window[position - window_start:]
+                    window_start = position
+            
+            def submit_chunk(chunk):
+                spans = {idx: pending_spans.pop(idx) for idx in chunk}
+                future = executor.submit(
+                    translate_segments,
+                    chunk,
+                    source_language,
+                    target_language,
+                    source_lang_name,
+                    target_lang_name,
+                    model_config,
+                    model_name,
+                    bedrock_client,
+                    use_streaming,
+                    memory,
+                    max_retries,
+                    pass_through_rules
+                )
+                in_flight.append((future, spans))
+                
+                # Apply backpressure to the reader
+                while len(in_flight) >= max_in_flight:
+                    finish_oldest_chunk()
+            
+            def handle_segments(segments):
+                nonlocal total_elements
+                for start, end, text, tags in segments:
+                    idx = f"a{total_elements}"
+                    total_elements += 1
+                    pending_spans[idx] = (start, end, tags)
+                    chunk = packer.add(idx, text)
+                    if chunk:
+                        submit_chunk(chunk)
+            
+            def handle_tokens(tokens):
+                for token in tokens:
+                    handle_segments(segmenter.add(token))
+            
+            for block in iter(lambda: source.read(STREAM_READ_SIZE), b''):
+                bytes_read += len(block)
+                text = decoder.decode(block)
+                window += text
+                handle_tokens(scanner.feed(text))
+                write_through()
+            
+            tail = decoder.decode(b'', final=True)
+            window += tail
+            handle_tokens(scanner.feed(tail))
+            handle_tokens(scanner.close())
+            handle_segments(segmenter.close())
+            
+            chunk = packer.flush()
+            if chunk:
+                submit_chunk(chunk)
+            while in_flight:
+                finish_oldest_chunk()
+            
+            # Everything after the last translated segment is copied as is
+            write(window)
+        
+        if total_elements == 0:
+            session_manager.update_session_status(
+                session_id,
+                is_processing=False,
+                error_message="No translatable content found in HTML"
+            )
+            return None
+        
+        processing_time = time.time() - start_time
+        tokens_per_second = 0
+        if totals['output_tokens'] > 0 and processing_time > 0:
+            tokens_per_second = totals['output_tokens'] / processing_time
+        
+        session_manager.update_session_status(
+            session_id,
+            current_task="HTML translation complete",
+            progress_percentage=100,
+            is_processing=False,
+            processing_complete=True,
+            processing_time=processing_time,
+            input_tokens=totals['input_tokens'],
+            output_tokens=totals['output_tokens'],
+            cache_read_input_tokens=totals['cache_read_input_tokens'],
+            cache_write_input_tokens=totals['cache_write_input_tokens'],
+            streaming_chunks=totals['streaming_chunks'],
+            first_token_time=first_token_time,
+            tokens_per_second=tokens_per_second,
+            decode_tokens_per_second=decode_tokens_per_second(totals),
+            elements_translated=total_elements,
+            deduplicated_segments=totals['deduplicated_segments'],
+            skipped_segments=totals['skipped_segments'],
+            skipped_tokens=totals['skipped_tokens'],
+            target_language_segments=totals['target_language_segments'],
+            truncated_chunks=totals['truncated_chunks'],
+            retried_segments=totals['retried_segments'],
+            missing_segments=totals['missing_segments'],
+            tm_hits=totals['tm_hits'],
+            tm_lookups=totals['tm_lookups'],
+            tm_hit_rate=round(totals['tm_hits'] / totals['tm_lookups'], 4) if totals['tm_lookups'] else 0,
+            tm_tokens_saved=totals['tm_tokens_saved'],
+            streamed_output=True,
+            input_size=input_size,
+            output_size=os.path.getsize(output_path)
+        )
+        
+        return output_path
+        
+    except Exception as e:
+        session_manager.update_session_status(
+            session_id,
+            is_processing=False,
+            error_message=f"Error during HTML translation: {str(e)}"
+        )
+        return None
@@ -0,0 +1,285 @@
+"""
+Offline language identification for translation segments
+"""
+import re
+
+from uicodegen.core.language_configs import get_language_by_code
+
+# Source language value that asks for the language to be detected
+AUTO_DETECT_LANGUAGE = "auto"
+
+# Detections at or above this confidence are acted upon
+CONFIDENT_DETECTION = 0.75
+
+# Word and character hits needed before a Latin or Cyrillic guess is trusted
+MIN_EVIDENCE = 2
+
+# Letters of each script
+LETTER_PATTERN = re.compile(r"[^\W\d_]")
+HAN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+KANA_PATTERN = re.compile(r"[\u3040-\u30ff\u31f0-\u31ff]")
+HANGUL_PATTERN = re.compile(r"[\u1100-\u11ff\u3130-\u318f\uac00-\ud7af]")
+THAI_PATTERN = re.compile(r"[\u0e00-\u0e7f]")
+ARABIC_PATTERN = re.compile(r"[\u0600-\u06ff\u0750-\u077f\ufb50-\ufdff\ufe70-\ufeff]")
+CYRILLIC_PATTERN = re.compile(r"[\u0400-\u04ff]")
+LATIN_PATTERN = re.compile(r"[A-Za-z\u00c0-\u024f\u1e00-\u1eff]")
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+# Characters written differently in Simplified and Traditional Chinese
+SIMPLIFIED_ONLY = frozenset(
+    "这们个国说来时为会发对学经进还买车门东实现点开关问题种里电话页书务产动当与从体么没让请应设网线费价单账户"
+    "号码册录览载传资讯络联帮选项转换显订购优运输数据库计划长简汉语词译认识错误处义级图乐边过达远连阅"
+)
+TRADITIONAL_ONLY = frozenset(
+    "這們個國說來時為會發對學經進還買車門東實現點開關問題種裡電話頁書務產動當與從體麼沒讓請應設網線費價單帳戶"
+    "號碼冊錄覽載傳資訊絡聯幫選項轉換顯訂購優運輸數據庫計劃長簡漢語詞譯認識錯誤處義級圖樂邊過達遠連閱"
+)
+
+# Letters that only occur in one of the languages sharing a script
+CHARACTERISTIC_CHARS = {
+    "uk": frozenset("іїєґ"),
+    "ru": frozenset("ыэъё"),
+    "vi": frozenset("ăđơưạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ"),
+    "pl": frozenset("ąęłńśźż"),
+    "de": frozenset("äöüß"),
+    "fr": frozenset("èêëîïœùûÿ"),
+    "es": frozenset("ñ¿¡"),
+    "pt": frozenset("ãõ"),
+    "it": frozenset("ìò")
+}
+
+CHARACTERISTIC_LANGUAGES = {char: language for language, chars in CHARACTERISTIC_CHARS.items() for char in chars}
+CHARACTERISTIC_PATTERN = re.compile("[" + re.escape("".join(CHARACTERISTIC_LANGUAGES)) + "]")
+
+# Frequent function words of each language
+STOPWORDS = {
+    "en": frozenset("the and of to in is are for with on that this you your our it be as at by from or not we can will have has all more".split()),
+    "es": frozenset("el la los las de del y en que es por para con una un su sus se no más al como pero lo este esta nuestro tu".split()),
+    "pt": frozenset("o os as de do da dos das e em que é para com um uma não mais por seu sua você nosso no na ao".split()),
+    "fr": frozenset("le la les de des du et en est que pour avec une un pas plus sur dans vous nous votre notre ce qui au aux".split()),
+    "de": frozenset("der die das und ist zu den mit für auf ein eine nicht sie wir ihr im dem von sich auch mehr oder bei".split()),
+    "it": frozenset("il lo la gli le di del della e è che per con un una non più sono nel alla come anche questo tuo".split()),
+    "pl": frozenset("i w na z do nie się jest to że o jak dla od po przez lub oraz są twój nasz".split()),
+    "vi": frozenset("và của là có các cho với được trong không này một những người bạn chúng tôi để đã".split()),
+    "id": frozenset("dan yang di ke dari untuk dengan ini itu tidak ada akan kami anda adalah pada atau juga bisa".split()),
+    "ru": frozenset("и в не на что с по как это для вы мы от из к о но все или его ваш наш всех вас нас есть только уже также при если".split()),
+    "uk": frozenset("і в не на що з по як це для ви ми від до та але всі або його ваш наш всіх вас нас є також при якщо вже тільки".split())
+}
+
+# Character trigrams typical of each language, "_" marking a word boundary
+TRIGRAMS = {
+    "en": frozenset("_th the he_ ing ng_ and nd_ _wh ght _yo you ou_ ly_ ve_ ers _be ll_ ss_ ity ck_".split()),
+    "es": frozenset("_el os_ as_ ón_ ció _qu que ad_ _lo los _es _pa ía_ _de nte ado ido _en dad _ll".split()),
+    "pt": frozenset("ão_ ção ões _nã não _do do_ em_ nh lh _um uma _pa ade ção _co _se ida _vo".split()),
+    "fr": frozenset("_le es_ ent _la eau ux_ _qu que eur _vo ous _po our ait _et _un _no re_ ée_".split()),
+    "de": frozenset("en_ der sch ein ung cht ich und _un _di die _ge er_ ie_ ei_ _au _ve ach eit".split()),
+    "it": frozenset("_il _di ell one _ch che tà_ lla gli _pe per zz cc ere i_ _co _gl ato _de".split()),
+    "pl": frozenset("_pr prz rze ów_ ie_ _w_ _z_ cz sz _ni nie ych ego ść_ dz _st ać_ ami".split()),
+    "vi": frozenset("_ng ng_ nh_ _th _tr _ch ch_ _kh _ph _qu _đ".split()),
+    "id": frozenset("_me men kan an_ _ya yan ang ng_ _di _ke nya _be ber _pe per ah_ _da dan".split()),
+    "ru": frozenset("_пр ть_ ого ие_ ых_ ени ост _по ова ый_ ая_ ся_ _не ет_ ств".split()),
+    "uk": frozenset("ння _пр ти_ ого ів_ ії_ ти_ _по ння ий_ ої_ ськ _не ть_ ост".split())
+}
+TRIGRAM_WEIGHT = 0.25
+
+def _invert(profiles):
+    """
+    Map each word or trigram to the languages whose profile contains it
+    """
+    inverted = {}
+    for language, entries in profiles.items():
+        for entry in entries:
+            inverted.setdefault(entry, []).append(language)
+    return inverted
+
+STOPWORD_LANGUAGES = _invert(STOPWORDS)
+TRIGRAM_LANGUAGES = _invert(TRIGRAMS)
+
+# Languages told apart by stopwords and characteristic letters, per script
+LATIN_LANGUAGES = ("en", "es", "pt", "fr", "de", "it", "pl", "vi", "id")
+CYRILLIC_LANGUAGES = ("ru", "uk")
+
+def _score_languages(text, languages):
+    """
+    Score candidate languages by stopwords, characteristic letters and
+    character trigrams
+
+    Returns:
+        tuple: (best language, confidence)
+    """
+    lowered = text.lower()
+    scores = dict.fromkeys(languages, 0)
+
+    words = WORD_PATTERN.findall(lowered)
+    for word in words:
+        for language in STOPWORD_LANGUAGES.get(word, ()):
+            if language in scores:
+                scores[language] += 1
+
+    for char in CHARACTERISTIC_PATTERN.findall(lowered):
+        language = CHARACTERISTIC_LANGUAGES[char]
+        if language in scores:
+            scores[language] += 2
+
+    padded = "_" + "_".join(words) + "_"
+    for index in range(len(padded) - 2):
+        for language in TRIGRAM_LANGUAGES.get(padded[index:index + 3], ()):
+            if language in scores:
+                scores[language] += TRIGRAM_WEIGHT
+
+    ranked = sorted(languages, key=scores.get, reverse=True)
+    best, runner_up = scores[ranked[0]], scores[ranked[1]]
+    if not best:
+        return ranked[0], 0.0
+
+    # Confidence is the margin over the closest alternative
+    confidence = best / (best + runner_up)
+    if best < MIN_EVIDENCE:
+        confidence *= 0.5
+    return ranked[0], confidence
+
+def detect_language(text):
+    """
+    Detect the language of a text
+
+    The script decides most languages outright. Chinese is split into
+    Simplified and Traditional by characters unique to each, Cyrillic and
+    Latin languages by frequent words, characteristic letters and character
+    trigrams.
+
+    Args:
+        text (str): Text to identify
+
+    Returns:
+        tuple: (language code or None, confidence between 0 and 1). Chinese
+        without script-specific characters is reported as "zh".
+    """
+    letters = len(LETTER_PATTERN.findall(text))
+    if not letters:
+        return None, 0.0
+
+    # Plain ASCII text can only be one of the Latin languages
+    if text.isascii():
+        return _score_languages(text, LATIN_LANGUAGES)
+
+    han = len(HAN_PATTERN.findall(text))
+    kana = len(KANA_PATTERN.findall(text))
+    if kana and (han + kana) / letters >= 0.5:
+        return "ja", (han + kana) / letters
+
+    for code, pattern in (("ko", HANGUL_PATTERN), ("th", THAI_PATTERN), ("ar", ARABIC_PATTERN)):
+        share = len(pattern.findall(text)) / letters
+        if share >= 0.5:
+            # Combining vowel signs are not letters, so the share can pass 1
+            return code, min(share, 1.0)
+
+    if han / letters >= 0.5:
+        simplified = sum(1 for char in text if char in SIMPLIFIED_ONLY)
+        traditional = sum(1 for char in text if char in TRADITIONAL_ONLY)
+        share = han / letters
+        if simplified > traditional:
+            return "zh-hans", share * simplified / (simplified + traditional)
+        if traditional > simplified:
+            return "zh-hant", share * traditional / (simplified + traditional)
+        # Kanji-only Japanese looks the same, so stay below the threshold
+        return "zh", share * 0.5
+
+    cyrillic = len(CYRILLIC_PATTERN.findall(text))
+    if cyrillic / letters >= 0.5:
+        language, confidence = _score_languages(text, CYRILLIC_LANGUAGES)
+        return language, confidence * cyrillic / letters
+
+    latin = len(LATIN_PATTERN.findall(text))
+    if latin / letters >= 0.5:
+        language, confidence = _score_languages(text, LATIN_LANGUAGES)
+        return language, confidence * latin / letters
+
+    return None, 0.0
+
+def base_language(code):
+    """
+    Get the language part of a language code ("es-co" -> "es")
+
+    Chinese keeps its script ("zh-hant"), because the scripts are translated
+    into each other.
+    """
+    if not code:
+        return code
+    code = code.lower()
+    if code.startswith("zh"):
+        return code
+    return code.split("-")[0]
+
+def is_language(detected, code):
+    """
+    Check whether a detected language is the language of a code
+
+    Args:
+        detected (str): Detected language code
+        code (str): Configured language code
+
+    Returns:
+        bool: True if they are the same language
+    """
+    if not detected or not code:
+        return False
+    if detected == "zh":
+        return base_language(code).startswith("zh")
+    return base_language(detected) == base_language(code)
+
+def is_target_language(text, source_language, target_language, threshold=CONFIDENT_DETECTION):
+    """
+    Check whether a text is confidently already in the target language
+
+    Never true when source and target are the same language, since
+    translating between variants (en -> en-sa) rewrites same-language text.
+
+    Args:
+        text (str): Text to check
+        source_language (str): Source language code
+        target_language (str): Target language code
+        threshold (float): Minimum detection confidence
+
+    Returns:
+        bool: True if the text can be kept as it is
+    """
+    if is_language(base_language(source_language), target_language):
+        return False
+    detected, confidence = detect_language(text)
+    return confidence >= threshold and is_language(detected, target_language)
+
+def detect_dominant_language(texts, max_chars=5000, default=None):
+    """
+    Detect the main language of a collection of texts
+
+    Each text votes for its detected language, weighted by its length and
+    the detection confidence. Only the first max_chars characters count.
+
+    Args:
+        texts: Iterable of texts
+        max_chars (int): Number of characters to sample
+        default (str): Code returned when nothing could be detected
+
+    Returns:
+        str: A supported language code, or default
+    """
+    votes = {}
+    sampled = 0
+
+    for text in texts:
+        detected, confidence = detect_language(text)
+        if detected:
+            votes[detected] = votes.get(detected, 0) + len(text) * confidence
+        sampled += len(text)
+        if sampled >= max_chars:
+            break
+
+    if not votes:
+        return default
+
+    detected = max(votes, key=votes.get)
+    if detected == "zh":
+        detected = "zh-hans"
+    if get_language_by_code(detected) is None:
+        return default
+    return detected
@@ -1,76 +1,204 @@
 """
 Model configurations for AWS Bedrock Claude models
 """
-from uicodegen.utils.bedrock_client import invoke_claude_model, invoke_claude_model_streaming
+from uicodegen.utils.bedrock_client import (
+    client_config, get_bedrock_client, get_hedge_region, invoke_claude_model, invoke_claude_model_streaming,
+    is_cacheable_prefix
+)
+from uicodegen.utils.async_bedrock_client import (
+    get_async_bedrock_client, invoke_claude_model_async, invoke_claude_model_streaming_async
+)
+from uicodegen.utils.hedging import hedging_enabled
 
 # Default model to use
 DEFAULT_MODEL = "claude-3-7-sonnet"
 
-# Model configurations
-MODEL_CONFIGS = {
+# What is known about each model. max_tokens is the output limit; prices are
+# USD per million input and output tokens; expected_ttft (seconds) and
+# expected_tokens_per_second are starting points until live measurements
+# exist. Models with prompt_caching accept cache_control breakpoints;
+# min_cache_tokens is the shortest prefix Bedrock caches for the model, and
+# shorter prefixes are sent without a breakpoint. Models with vision accept
+# images. Late streams are hedged to the same model in another region;
+# hedge_model optionally names the model they are hedged to when there is no
+# other region. It must accept the same requests, images included, and allow
+# at least as many output tokens.
+MODEL_SPECS = {
     "claude-3-7-sonnet": {
         "model_id": "us.anthropic.claude-3-7-sonnet-20250219-v1:0",
         "max_tokens": 40960,
+        "context_window": 200000,
         "description": "Claude 3.7 Sonnet - Most capable model",
-        "invoke": lambda client, prompt, prefill_prompt=None: invoke_claude_model(
-            client, prompt, model_id="us.anthropic.claude-3-7-sonnet-20250219-v1:0", 
-            max_tokens=40960, prefill_prompt=prefill_prompt
-        ),
-        "invoke_streaming": lambda client, prompt, prefill_prompt=None: invoke_claude_model_streaming(
-            client, prompt, model_id="us.anthropic.claude-3-7-sonnet-20250219-v1:0", 
-            max_tokens=40960, prefill_prompt=prefill_prompt
-        ),
+        "input_price": 3.0,
+        "output_price": 15.0,
+        "expected_ttft": 1.5,
+        "expected_tokens_per_second": 60,
+        "prompt_caching": True,
+        "min_cache_tokens": 1024,
+        "vision": True,
+        "hedge_model": None
     },
     "claude-3-5-sonnet": {
         "model_id": "us.anthropic.claude-3-5-sonnet-20240620-v1:0",
         "max_tokens": 8000,
+        "context_window": 200000,
         "description": "Claude 3.5 Sonnet - Balanced performance and speed",
-        "invoke": lambda client, prompt, prefill_prompt=None: invoke_claude_model(
-            client, prompt, model_id="us.anthropic.claude-3-5-sonnet-20240620-v1:0", 
-            max_tokens=8000, prefill_prompt=prefill_prompt
-        ),
-        "invoke_streaming": lambda client, prompt, prefill_prompt=None: invoke_claude_model_streaming(
-            client, prompt, model_id="us.anthropic.claude-3-5-sonnet-20240620-v1:0", 
-            max_tokens=8000, prefill_prompt=prefill_prompt
-        ),
+        "input_price": 3.0,
+        "output_price": 15.0,
+        "expected_ttft": 1.2,
+        "expected_tokens_per_second": 70,
+        "prompt_caching": False,
+        "min_cache_tokens": 1024,
+        "vision": True,
+        "hedge_model": "claude-3-5-sonnet-v2"
     },
     "claude-3-haiku": {
         "model_id": "us.anthropic.claude-3-haiku-20240307-v1:0",
-        "max_tokens": 8000,
+        "max_tokens": 4096,
+        "context_window": 200000,
         "description": "Claude 3 Haiku - Fast and cost-effective",
-        "invoke": lambda client, prompt, prefill_prompt=None: invoke_claude_model(
-            client, prompt, model_id="us.anthropic.claude-3-haiku-20240307-v1:0", 
-            max_tokens=8000, prefill_prompt=prefill_prompt
-        ),
-        "invoke_streaming": lambda client, prompt, prefill_prompt=None: invoke_claude_model_streaming(
-            client, prompt, model_id="us.anthropic.claude-3-haiku-20240307-v1:0", 
-            max_tokens=8000, prefill_prompt=prefill_prompt
-        ),
+        "input_price": 0.25,
+        "output_price": 1.25,
+        "expected_ttft": 0.6,
+        "expected_tokens_per_second": 130,
+        "prompt_caching": False,
+        "min_cache_tokens": 2048,
+        "vision": True,
+        "hedge_model": None
     },
     "claude-3-5-haiku": {
         "model_id": "us.anthropic.claude-3-5-haiku-20241022-v1:0",
         "max_tokens": 8000,
+        "context_window": 200000,
         "description": "Claude 3 Haiku - Fast and cost-effective",
-        "invoke": lambda client, prompt, prefill_prompt=None: invoke_claude_model(
-            client, prompt, model_id="us.anthropic.claude-3-5-haiku-20241022-v1:0", 
-            max_tokens=8000, prefill_prompt=prefill_prompt
-        ),
-        "invoke_streaming": lambda client, prompt, prefill_prompt=None: invoke_claude_model_streaming(
-            client, prompt, model_id="us.anthropic.claude-3-5-haiku-20241022-v1:0", 
-            max_tokens=8000, prefill_prompt=prefill_prompt
-        ),
+        "input_price": 0.8,
+        "output_price": 4.0,
+        "expected_ttft": 0.8,
+        "expected_tokens_per_second": 100,
+        "prompt_caching": True,
+        "min_cache_tokens": 2048,
+        "vision": False,
+        "hedge_model": None
     },
     "claude-3-5-sonnet-v2": {
         "model_id": "us.anthropic.claude-3-5-sonnet-20241022-v2:0",
         "max_tokens": 8000,
+        "context_window": 200000,
         "description": "Claude 3-5 sonnet-v2",
-        "invoke": lambda client, prompt, prefill_prompt=None: invoke_claude_model(
-            client, prompt, model_id="us.anthropic.claude-3-5-sonnet-20241022-v2:0", 
-            max_tokens=8000, prefill_prompt=prefill_prompt
-        ),
-        "invoke_streaming": lambda client, prompt, prefill_prompt=None: invoke_claude_model_streaming(
-            client, prompt, model_id="us.anthropic.claude-3-5-sonnet-20241022-v2:0", 
-            max_tokens=8000, prefill_prompt=prefill_prompt
-        ),
+        "input_price": 3.0,
+        "output_price": 15.0,
+        "expected_ttft": 1.2,
+        "expected_tokens_per_second": 70,
+        "prompt_caching": False,
+        "min_cache_tokens": 1024,
+        "vision": True,
+        "hedge_model": "claude-3-5-sonnet"
     },
 }
+
+def build_model_config(spec):
+    """
+    Build the configuration of a model from its spec
+
+    The invoke functions take the keyword arguments of invoke_claude_model,
+    such as prefill_prompt and cached_prefix. The async variants take an
+    async client and return a coroutine or async generator.
+
+    Args:
+        spec: Entry of MODEL_SPECS
+
+    Returns:
+        dict: Model configuration
+    """
+    request_args = {
+        "model_id": spec["model_id"],
+        "max_tokens": spec["max_tokens"]
+    }
+    if spec["prompt_caching"]:
+        request_args["prompt_caching"] = True
+        request_args["min_cache_tokens"] = spec["min_cache_tokens"]
+
+    return dict(
+        spec,
+        invoke=lambda client, prompt, **kwargs: invoke_claude_model(client, prompt, **request_args, **kwargs),
+        invoke_streaming=lambda client, prompt, **kwargs: invoke_claude_model_streaming(client, prompt, **request_args, **kwargs),
+        invoke_async=lambda client, prompt, **kwargs: invoke_claude_model_async(client, prompt, **request_args, **kwargs),
+        invoke_streaming_async=lambda client, prompt, **kwargs: invoke_claude_model_streaming_async(client, prompt, **request_args, **kwargs)
+    )
+
+# Model configurations, keyed by the names users pick from
+MODEL_CONFIGS = {name: build_model_config(spec) for name, spec in MODEL_SPECS.items()}
+
+def get_hedge_config(model_config):
+    """
+    Get the configuration of the model a late stream is hedged to without another region
+
+    A hedge that wins replaces the primary stream, so a hedge model with a
+    lower output limit than the primary is not used.
+
+    Args:
+        model_config: Model configuration
+
+    Returns:
+        dict: Configuration of the hedge model, or None
+    """
+    hedge_config = MODEL_CONFIGS.get(model_config.get("hedge_model"))
+    if hedge_config is None or hedge_config["max_tokens"] < model_config["max_tokens"]:
+        return None
+    return hedge_config
+
+def caches_prefix(model_config, prefix):
+    """
+    Check whether a prompt prefix gets a cache breakpoint on a model
+
+    Args:
+        model_config: Model configuration
+        prefix: Static text sent ahead of the per-request content
+
+    Returns:
+        bool: True if the model caches prompts and the prefix is long enough
+    """
+    return model_config.get("prompt_caching", False) and is_cacheable_prefix(prefix, model_config["min_cache_tokens"])
+
+def get_hedge_target(model_config, client):
+    """
+    Get the model and client a late stream is hedged to
+
+    The hedge goes to the same model in the best other region, on a client
+    with the same configuration, so it does not wait on the primary
+    region's capacity. With a single region, a model with a hedge_model is
+    hedged to that model instead.
+
+    Args:
+        model_config: Model configuration of the primary stream
+        client: Registry client of the primary stream
+
+    Returns:
+        tuple: (hedge model configuration, client), or (None, None) when
+        hedging is off or there is no target
+    """
+    if not hedging_enabled():
+        return None, None
+    region = get_hedge_region(client, model_config["model_id"])
+    if region:
+        return model_config, get_bedrock_client(region, *client_config(client))
+    hedge_config = get_hedge_config(model_config)
+    if hedge_config is None:
+        return None, None
+    return hedge_config, client
+
+async def get_async_hedge_target(model_config, client):
+    """
+    Get the model and async client a late stream is hedged to
+
+    Like get_hedge_target, for streams on the shared event loop.
+    """
+    if not hedging_enabled():
+        return None, None
+    region = get_hedge_region(client, model_config["model_id"])
+    if region:
+        return model_config, await get_async_bedrock_client(region, *client_config(client))
+    hedge_config = get_hedge_config(model_config)
+    if hedge_config is None:
+        return None, None
+    return hedge_config, client
@@ -0,0 +1,216 @@
+"""
+Live model statistics and automatic model selection
+"""
+import threading
+from collections import deque
+from statistics import median
+
+from uicodegen.core.model_configs import MODEL_CONFIGS, DEFAULT_MODEL
+
+# Model value that asks for the model to be picked automatically
+AUTO_MODEL = "auto"
+
+# Completed sessions kept per model for the live measurements
+LIVE_SAMPLES = 50
+
+# Expected output tokens of an image-to-code generation
+CODEGEN_OUTPUT_TOKENS = 6000
+
+# Expected output tokens per input token of a translation
+TRANSLATION_EXPANSION = 1.5
+
+class ModelRegistry:
+    """
+    Specs of the configured models with rolling TTFT and throughput
+    measurements from completed sessions
+    """
+
+    def __init__(self, configs, size=LIVE_SAMPLES):
+        """
+        Initialize the registry
+
+        Args:
+            configs: Model configurations, keyed by model name
+            size: Completed sessions kept per model
+        """
+        self.configs = configs
+        self.size = size
+        self._ttft = {}
+        self._tokens_per_second = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name, first_token_time=None, tokens_per_second=None):
+        """
+        Add the measurements of a completed session
+
+        Args:
+            model_name: Name of the model in the configurations
+            first_token_time: Seconds until the first token, if measured
+            tokens_per_second: Output tokens per second of one stream after
+                its first token, if measured
+        """
+        if model_name not in self.configs:
+            return
+        with self._lock:
+            if first_token_time:
+                self._ttft.setdefault(model_name, deque(maxlen=self.size)).append(first_token_time)
+            if tokens_per_second:
+                self._tokens_per_second.setdefault(model_name, deque(maxlen=self.size)).append(tokens_per_second)
+
+    def record_session(self, status):
+        """
+        Add the measurements of a completed session from its status
+
+        Only streamed sessions measure the time to first token; without
+        streaming, first_token_time is the latency of the whole response.
+        The throughput is the decode speed of a single stream, since the
+        job's tokens_per_second includes the TTFT and adds up parallel chunks.
+        """
+        first_token_time = status.get('first_token_time') if status.get('use_streaming') else None
+        self.record(status.get('selected_model'), first_token_time, status.get('decode_tokens_per_second'))
+
+    def get_speed(self, model_name):
+        """
+        Get the typical TTFT and throughput of a model
+
+        The median of the live measurements is used when there are any,
+        the expected values of the model's spec otherwise.
+
+        Returns:
+            tuple: (TTFT in seconds, output tokens per second)
+        """
+        config = self.configs[model_name]
+        with self._lock:
+            ttft = self._ttft.get(model_name)
+            tokens_per_second = self._tokens_per_second.get(model_name)
+            ttft = median(ttft) if ttft else config['expected_ttft']
+            tokens_per_second = median(tokens_per_second) if tokens_per_second else config['expected_tokens_per_second']
+        return ttft, tokens_per_second
+
+    def estimate_latency(self, model_name, output_tokens):
+        """
+        Estimate the seconds a model needs for a response
+
+        Args:
+            model_name: Name of the model in the configurations
+            output_tokens: Expected output tokens
+
+        Returns:
+            float: Estimated seconds
+        """
+        ttft, tokens_per_second = self.get_speed(model_name)
+        return ttft + output_tokens / tokens_per_second
+
+    def fits(self, model_name, input_tokens, output_tokens, chunked=False, vision=False):
+        """
+        Check whether a request fits a model
+
+        Args:
+            model_name: Name of the model in the configurations
+            input_tokens: Expected input tokens
+            output_tokens: Expected output tokens
+            chunked: Whether the job is split into requests sized to the
+                model, so only the context window of one request matters
+            vision: Whether the request contains images
+
+        Returns:
+            bool: True if the model can take the request
+        """
+        config = self.configs[model_name]
+        if vision and not config.get('vision'):
+            return False
+        if chunked:
+            return True
+        return output_tokens <= config['max_tokens'] and input_tokens + output_tokens <= config['context_window']
+
+    def choose(self, input_tokens, output_tokens, max_latency=None, chunked=False, vision=False):
+        """
+        Pick a model for a request
+
+        Without a latency target the fastest model that fits the request is
+        picked. A latency target is a budget: the most capable fitting model
+        (highest output price, then first in the configurations) expected to
+        answer within it is picked, or the fastest one if none is.
+
+        Args:
+            input_tokens: Expected input tokens
+            output_tokens: Expected output tokens
+            max_latency: Optional seconds the response should take at most
+            chunked: Whether the job is split into requests sized to the model
+            vision: Whether the request contains images
+
+        Returns:
+            str: Model name. Without a fitting model, the one with the largest
+            output limit.
+        """
+        candidates = [name for name in self.configs if self.fits(name, input_tokens, output_tokens, chunked, vision)]
+        if not candidates:
+            candidates = [name for name in self.configs if not vision or self.configs[name].get('vision')]
+            return max(candidates, key=lambda name: self.configs[name]['max_tokens'], default=DEFAULT_MODEL)
+
+        latencies = {name: self.estimate_latency(name, output_tokens) for name in candidates}
+        if max_latency is not None:
+            within = [name for name in candidates if latencies[name] <= max_latency]
+            if within:
+                order = list(self.configs)
+                return max(within, key=lambda name: (self.configs[name]['output_price'], -order.index(name)))
+        return min(candidates, key=latencies.get)
+
+    def snapshot(self):
+        """
+        Get the specs and live measurements of every model
+        """
+        models = []
+        for name, config in self.configs.items():
+            ttft, tokens_per_second = self.get_speed(name)
+            with self._lock:
+                samples = len(self._ttft.get(name, ()))
+            models.append({
+                'name': name,
+                'model_id': config['model_id'],
+                'context_window': config['context_window'],
+                'max_tokens': config['max_tokens'],
+                'input_price': config['input_price'],
+                'output_price': config['output_price'],
+                'vision': config.get('vision', False),
+                'ttft': round(ttft, 3),
+                'tokens_per_second': round(tokens_per_second, 1),
+                'samples': samples
+            })
+        return models
+
+model_registry = ModelRegistry(MODEL_CONFIGS)
+
+def resolve_model(model_name, input_tokens=0, output_tokens=0, max_latency=None, chunked=False, vision=False):
+    """
+    Turn the model requested by a user into a configured model name
+
+    Args:
+        model_name: Requested model, "auto", or None
+        input_tokens: Expected input tokens, for "auto"
+        output_tokens: Expected output tokens, for "auto"
+        max_latency: Optional latency target in seconds, for "auto"
+        chunked: Whether the job is split into requests sized to the model
+        vision: Whether the request contains images
+
+    Returns:
+        str: Name of a configured model, DEFAULT_MODEL for unknown names
+    """
+    if model_name == AUTO_MODEL:
+        return model_registry.choose(input_tokens, output_tokens, max_latency, chunked, vision)
+    if model_name in MODEL_CONFIGS:
+        return model_name
+    return DEFAULT_MODEL
+
+def parse_max_latency(value):
+    """
+    Parse a latency target in seconds from a request parameter
+
+    Returns:
+        float: Seconds, or None when missing or invalid
+    """
+    try:
+        max_latency = float(value)
+    except (TypeError, ValueError):
+        return None
+    return max_latency if max_latency > 0 else None
@@ -1,69 +1,168 @@
 import os
 import json
 import time
-import boto3
-import botocore.config
-import botocore.exceptions
+import asyncio
+import tempfile
+from contextlib import closing, contextmanager
 
 from uicodegen.utils.image_utils import encode_image
-from uicodegen.utils.code_extractor import extract_code_from_text
-from uicodegen.core.model_configs import MODEL_CONFIGS, DEFAULT_MODEL
+from uicodegen.utils.code_extractor import (
+    BLOCK_OPENED, FENCE_ARTIFACTS, CodeFenceTokenizer, extract_code_from_text
+)
+from uicodegen.utils.bedrock_client import (
+    RoutedRequest, get_routed_client, stream_model_events, usage_tokens
+)
+from uicodegen.utils.async_bedrock_client import get_async_routed_client, stream_model_events_async
+from uicodegen.utils.bedrock_limiter import get_model_limiter, is_read_timeout
+from uicodegen.utils.hedging import hedged_stream, hedged_stream_async
+from uicodegen.core.model_configs import (
+    MODEL_CONFIGS, DEFAULT_MODEL, caches_prefix, get_async_hedge_target, get_hedge_target
+)
+from uicodegen.core.session_manager import ProgressTicker
 from uicodegen.utils.fallback_templates import (
     create_fallback_html, create_fallback_css, create_fallback_js,
     create_timeout_html, create_error_html
 )
 
-# Initialize AWS Bedrock client
-try:
-    from botocore.config import Config
+# Image generations are long-running, so allow more attempts before giving
+# up; retries still draw from the shared retry budget
+PROCESSOR_MAX_ATTEMPTS = 10
+
+# File each generated artifact is saved to
+ARTIFACT_FILES = {
+    "html": "index.html",
+    "css": "styles.css",
+    "js": "script.js"
+}
+
+# Progress and task shown while the streamed response is inside each code block
+CODEGEN_STAGES = {
+    "html": (40, "Generating HTML code"),
+    "css": (60, "Generating CSS code"),
+    "js": (80, "Generating JavaScript code")
+}
+
+# Instructions for turning a design image into code. They are the same for
+# every request and go ahead of the image, so they get a cache breakpoint
+# once they reach the model's min_cache_tokens.
+CODEGEN_PROMPT = """You are an expert web developer. I'm showing you a UI design image.
+Please convert this design into responsive HTML, CSS, and JavaScript code.
+
+Use Bootstrap 5 for the responsive layout and Vue.js 3 for interactivity.
+Include Font Awesome for icons.
+
+Please provide:
+1. Complete index.html file
+2. Complete styles.css file
+3. Complete script.js file
+
+Make sure the code is clean, well-commented, and follows best practices.
+Make sure the code is the same language as in the picture.
+The website should be fully responsive and match the design as closely as possible.
+
+Return your response in the following format:
+
+```html
+<!-- Your complete HTML code here -->
+```
+
+```css
+/* Your complete CSS code here */
+```
+
+```javascript
+// Your complete JavaScript code here
+```
+"""
+
+def build_codegen_content(base64_image, prompt_caching=False):
+    """
+    Build the user message content for a code generation request
     
-    # Configure the AWS SDK
-    config = Config(
-        retries={
-            'max_attempts': 10,
-            'mode': 'standard'
-        }
-    )
+    Args:
+        base64_image: Base64-encoded JPEG design image
+        prompt_caching: Whether to put a cache breakpoint after the instructions
+        
+    Returns:
+        list: Content blocks, the static instructions first
+    """
+    instructions = {
+        "type": "text",
+        "text": CODEGEN_PROMPT
+    }
+    if prompt_caching:
+        instructions["cache_control"] = {"type": "ephemeral"}
     
-    # Create a Bedrock Runtime client
-    bedrock_runtime = boto3.client(
-        service_name='bedrock-runtime',
-        region_name='us-east-1',
-        config=config
-    )
-except Exception as e:
-    print(f"Error initializing AWS Bedrock client: {str(e)}")
-    bedrock_runtime = None
+    return [
+        instructions,
+        {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": "image/jpeg",
+                "data": base64_image
+            }
+        }
+    ]
+
+def is_text_event(event):
+    """
+    Check whether a raw response event carries generated text
+
+    Used as the first token of a stream for hedging, rather than the
+    message_start event that arrives before any text.
+    """
+    chunk = event.get('chunk')
+    if not chunk or b'text_delta' not in chunk.get('bytes', b''):
+        return False
+    delta = json.loads(chunk.get('bytes').decode()).get('delta', {})
+    return delta.get('type') == 'text_delta' and bool(delta.get('text'))
+
+def save_artifact(session_manager, session_id, artifact, content):
+    """
+    Write one generated artifact to its file in the session directory
+
+    The content goes to a temporary file that is then renamed over the
+    artifact's file, so the preview never loads a partly written file.
+
+    Args:
+        session_manager: Session manager
+        session_id (str): Session ID
+        artifact (str): 'html', 'css' or 'js'
+        content (str): Code of the artifact
+
+    Returns:
+        str: Path of the artifact's file
+    """
+    file_path = session_manager.get_generated_path(session_id, ARTIFACT_FILES[artifact])
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return file_path
 
 def save_generated_files(session_manager, session_id, html_content, css_content, js_content):
     """Save the generated code to files in the session directory"""
-    file_paths = {}
-    
-    # Save HTML
-    html_path = session_manager.get_generated_path(session_id, 'index.html')
-    with open(html_path, 'w') as f:
-        f.write(html_content)
-    file_paths['html'] = html_path
-    
-    # Save CSS
-    css_path = session_manager.get_generated_path(session_id, 'styles.css')
-    with open(css_path, 'w') as f:
-        f.write(css_content)
-    file_paths['css'] = css_path
-    
-    # Save JS
-    js_path = session_manager.get_generated_path(session_id, 'script.js')
-    with open(js_path, 'w') as f:
-        f.write(js_content)
-    file_paths['js'] = js_path
-    
+    file_paths = {
+        'html': save_artifact(session_manager, session_id, 'html', html_content),
+        'css': save_artifact(session_manager, session_id, 'css', css_content),
+        'js': save_artifact(session_manager, session_id, 'js', js_content)
+    }
+    session_manager.update_session_status(session_id, ready_artifacts=list(ARTIFACT_FILES))
     return file_paths
-def process_image_streaming(session_manager, session_id, image_path):
-    """Process the image with selected Bedrock Claude model using streaming API"""
-    # Get session status
-    status = session_manager.get_session_status(session_id)
-    selected_model = status.get('selected_model', DEFAULT_MODEL)
 
+@contextmanager
+def streaming_job(session_manager, session_id):
+    """
+    Run a streaming code generation job, saving fallback files if it fails
+
+    Yields:
+        int: Start time of the job in milliseconds
+    """
     try:
         start_time = time.time_ns() // 1_000_000  # 纳秒转毫秒
         session_manager.update_session_status(
@@ -72,305 +171,422 @@ def process_image_streaming(session_manager, session_id, image_path):
             progress_percentage=10,
             is_processing=True,
             processing_complete=False,
-            error_message=None
+            error_message=None,
+            ready_artifacts=[]
         )
 
-        # Encode image to base64
-        base64_image = encode_image(image_path)
+        yield start_time
 
-        session_manager.update_session_status(
-            session_id,
-            current_task="Connecting to AWS Bedrock for streaming",
-            progress_percentage=15
-        )
+    except Exception as e:
+        if is_read_timeout(e):
+            error_message = "Read timeout occurred. The request took too long to complete. Try using a smaller image or the non-streaming mode."
+            session_manager.update_session_status(
+                session_id,
+                current_task=error_message,
+                progress_percentage=0,
+                error_message=error_message
+            )
 
-        # Get model configuration
-        model_config = MODEL_CONFIGS[selected_model]
-        model_id = model_config["model_id"]
-        max_tokens = model_config["max_tokens"]
-        model_display_name = selected_model.replace("-", " ").title()
+            # Create fallback files in case of timeout
+            html_code = create_timeout_html()
+            css_code = "/* No CSS generated due to timeout */"
+            js_code = "// No JavaScript generated due to timeout"
+        else:
+            error_message = str(e)
+            session_manager.update_session_status(
+                session_id,
+                current_task=f"Error in streaming: {str(e)}",
+                progress_percentage=0,
+                error_message=error_message
+            )
 
-        # Prepare the prompt for Claude
-        prompt = f"""
-        You are an expert web developer. I'm showing you a UI design image. 
-        Please convert this design into responsive HTML, CSS, and JavaScript code.
-        
-        Use Bootstrap 5 for the responsive layout and Vue.js 3 for interactivity.
-        Include Font Awesome for icons.
-        
-        Please provide:
-        1. Complete index.html file
-        2. Complete styles.css file
-        3. Complete script.js file
-        
-        Make sure the code is clean, well-commented, and follows best practices.
-        Make sure the code is the same language as in the picture.
-        The website should be fully responsive and match the design as closely as possible.
-        
-        Return your response in the following format:
-        
-        ```html
-        <!-- Your complete HTML code here -->
-        ```
-        
-        ```css
-        /* Your complete CSS code here */
-        ```
-        
-        ```javascript
-        // Your complete JavaScript code here
-        ```
-        """
+            # Create fallback files in case of error
+            html_code = create_error_html(error_message)
+            css_code = "/* No CSS generated due to error */"
+            js_code = "// No JavaScript generated due to error"
 
+        # Save these fallback files
+        file_paths = save_generated_files(session_manager, session_id, html_code, css_code, js_code)
         session_manager.update_session_status(
             session_id,
-            current_task=f"Sending streaming request to {model_display_name}",
-            progress_percentage=20
+            processing_complete=True
         )
-
-        # Create the request payload
-        request_body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": max_tokens,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": base64_image
-                            }
-                        }
-                    ]
-                }
-            ]
-        }
-
-        # Convert the request body to JSON
-        request_body_json = json.dumps(request_body)
-
+    finally:
         session_manager.update_session_status(
             session_id,
-            current_task=f"Starting streaming with {model_display_name}",
-            progress_percentage=25
+            is_processing=False
         )
 
-        try:
-            # Invoke the model with streaming
-            response = bedrock_runtime.invoke_model_with_response_stream(
-                modelId=model_id,
-                body=request_body_json
-            )
+def build_codegen_request(model_config, base64_image):
+    """
+    Build the JSON request body of a code generation request for a model
+
+    Args:
+        model_config: Model configuration
+        base64_image: Base64-encoded JPEG design image
+
+    Returns:
+        str: Serialized request body
+    """
+    return json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": model_config["max_tokens"],
+        "messages": [
+            {
+                "role": "user",
+                "content": build_codegen_content(base64_image, caches_prefix(model_config, CODEGEN_PROMPT))
+            }
+        ]
+    })
+
+def build_streaming_requests(session_manager, session_id, base64_image):
+    """
+    Build the request body of a streaming code generation job
+
+    Returns:
+        tuple: (model_config, request_body_json)
+    """
+    status = session_manager.get_session_status(session_id)
+    selected_model = status.get('selected_model', DEFAULT_MODEL)
 
-            # Process the streaming response
-            stream = response.get('body')
-
-            # Initialize variables for collecting response
-            full_text = ""
-            chunk_count = 0
-            first_token_time = 0
-
-            # Create a debug log file for chunks
-            debug_log_path = session_manager.get_generated_path(session_id, 'streaming_debug.log')
-            with open(debug_log_path, 'w') as debug_file:
-                debug_file.write("=== STREAMING DEBUG LOG ===\n\n")
-
-                # Process each chunk
-                for event in stream:
-                    chunk = event.get('chunk')
-                    if chunk:
-                        chunk_data = json.loads(chunk.get('bytes').decode())
-
-                        # Log the raw chunk data
-                        debug_file.write(f"--- CHUNK {chunk_count + 1} ---\n")
-                        debug_file.write(f"Raw chunk data: {json.dumps(chunk_data, indent=2)}\n\n")
-
-                        # Extract text from the chunk
-                        chunk_text = ""
-
-                        # Handle different types of chunks
-                        if chunk_data.get('type') == 'content_block_delta':
-                            delta = chunk_data.get('delta', {})
-                            if delta.get('type') == 'text_delta':
-                                chunk_text = delta.get('text', '')
-                                full_text += chunk_text
-
-                                # Record first token time if this is the first content chunk
-                                if first_token_time == 0 and chunk_text != '':
-                                    first_token_time = time.time_ns() // 1_000_000 - start_time  # 直接计算毫秒差值
-                                    session_manager.update_session_status(
-                                        session_id,
-                                        first_token_time=round(first_token_time / 1000, 2),
-                                    )
-                        elif chunk_data.get('type') == 'message_delta' and 'usage' in chunk_data:
-                            # Extract token usage from message_delta
-                            if 'output_tokens' in chunk_data.get('usage', {}):
-                                output_tokens = chunk_data['usage']['output_tokens']
-                                session_manager.update_session_status(
-                                    session_id,
-                                    output_tokens=output_tokens
-                                )
-                        elif chunk_data.get('type') == 'message_stop' and 'amazon-bedrock-invocationMetrics' in chunk_data:
-                            # Extract metrics from message_stop
-                            metrics = chunk_data.get('amazon-bedrock-invocationMetrics', {})
-                            input_tokens = metrics.get('inputTokenCount', 0)
-                            output_tokens = metrics.get('outputTokenCount', 0)
-                            session_manager.update_session_status(
-                                session_id,
-                                input_tokens=input_tokens,
-                                output_tokens=output_tokens
-                            )
-
-                        # Log the extracted text
-                        debug_file.write(f"Extracted text: {chunk_text}\n")
-                        debug_file.write(f"Current full_text length: {len(full_text)}\n")
-                        debug_file.write("-------------------\n\n")
-
-                        # Update progress based on chunk count
-                        chunk_count += 1
-                        session_manager.update_session_status(
-                            session_id,
-                            streaming_chunks=chunk_count
-                        )
-
-                        # Dynamic progress update based on content received
-                        # We'll estimate progress between 25-90% during streaming
-                        current_status = session_manager.get_session_status(session_id)
-                        current_progress = current_status['progress_percentage']
-
-                        if "```html" in full_text and current_progress < 40:
-                            session_manager.update_session_status(
-                                session_id,
-                                current_task="Generating HTML code",
-                                progress_percentage=40
-                            )
-                            debug_file.write("HTML marker found\n")
-                        elif "```css" in full_text and current_progress < 60:
-                            session_manager.update_session_status(
-                                session_id,
-                                current_task="Generating CSS code",
-                                progress_percentage=60
-                            )
-                            debug_file.write("CSS marker found\n")
-                        elif "```javascript" in full_text and current_progress < 80:
-                            session_manager.update_session_status(
-                                session_id,
-                                current_task="Generating JavaScript code",
-                                progress_percentage=80
-                            )
-                            debug_file.write("JavaScript marker found\n")
-                        else:
-                            # Gradual progress update
-                            current_progress = min(25 + (chunk_count * 65 / 100), 90)
-                            session_manager.update_session_status(
-                                session_id,
-                                current_task=f"Processing chunk {chunk_count}",
-                                progress_percentage=int(current_progress)
-                            )
-
-                # Log the final full text
-                debug_file.write("\n=== FINAL FULL TEXT ===\n")
-                debug_file.write(full_text)
-                debug_file.write("\n\n=== END OF LOG ===\n")
+    session_manager.update_session_status(
+        session_id,
+        current_task="Connecting to AWS Bedrock for streaming",
+        progress_percentage=15
+    )
 
-            session_manager.update_session_status(
-                session_id,
-                current_task="Extracting code from streaming response",
-                progress_percentage=90
-            )
+    # Get model configuration
+    model_config = MODEL_CONFIGS[selected_model]
+    model_display_name = selected_model.replace("-", " ").title()
 
-            # Extract code from the full text with debug logging
-            extract_debug_path = session_manager.get_generated_path(session_id, 'extraction_debug.log')
-            with open(extract_debug_path, 'w') as extract_debug:
-                html_code, css_code, js_code = extract_code_from_text(full_text, extract_debug)
+    session_manager.update_session_status(
+        session_id,
+        current_task=f"Sending streaming request to {model_display_name}",
+        progress_percentage=20
+    )
 
-                # If extraction failed, try to create minimal files
-                if not html_code:
-                    extract_debug.write("\n=== CREATING FALLBACK HTML ===\n")
-                    html_code = create_fallback_html(full_text[:1000])
+    request_body_json = build_codegen_request(model_config, base64_image)
 
-                if not css_code:
-                    extract_debug.write("\n=== CREATING FALLBACK CSS ===\n")
-                    css_code = create_fallback_css()
+    session_manager.update_session_status(
+        session_id,
+        current_task=f"Starting streaming with {model_display_name}",
+        progress_percentage=25
+    )
 
-                if not js_code:
-                    extract_debug.write("\n=== CREATING FALLBACK JS ===\n")
-                    js_code = create_fallback_js()
+    return model_config, request_body_json
 
-        except botocore.exceptions.ReadTimeoutError:
-            error_message = "Read timeout occurred. The request took too long to complete. Try using a smaller image or the non-streaming mode."
-            session_manager.update_session_status(
-                session_id,
-                current_task=error_message,
-                progress_percentage=0,
-                error_message=error_message
-            )
+def build_hedge_request(model_config, request_body_json, hedge_config, base64_image):
+    """
+    Get the request body of a hedge, reusing the primary's for the same model
 
-            # Create fallback files in case of timeout
-            html_code = create_timeout_html()
-            css_code = "/* No CSS generated due to timeout */"
-            js_code = "// No JavaScript generated due to timeout"
+    Returns:
+        str: Serialized request body
+    """
+    if hedge_config is model_config:
+        return request_body_json
+    return build_codegen_request(hedge_config, base64_image)
+
+class StreamingResponseReader:
+    """
+    Reads the raw events of a streamed code generation response
+
+    Each delta is fed to the fence tokenizer once, which tracks the code
+    blocks. Finished artifacts are saved as soon as their block closes so
+    the preview can load them, and every event is written to the debug log.
+    """
+
+    def __init__(self, session_manager, session_id, start_time, debug_file):
+        """
+        Initialize the reader
+
+        Args:
+            session_manager: Session manager
+            session_id (str): Session ID
+            start_time (int): Start time of the job in milliseconds
+            debug_file (file): Streaming debug log
+        """
+        self.session_manager = session_manager
+        self.session_id = session_id
+        self.start_time = start_time
+        self.debug_file = debug_file
+        self.tokenizer = CodeFenceTokenizer()
+        self.text_parts = []
+        self.chunk_count = 0
+        self.first_token_time = 0
+        self.output_tokens = 0
+        self.progress = 25
+        self.ready_artifacts = []
+        self.open_artifact = None
+        self.ticker = ProgressTicker()
+
+        debug_file.write("=== STREAMING DEBUG LOG ===\n\n")
+
+    def feed(self, event):
+        """
+        Process one event of the response stream
+
+        Args:
+            event (dict): Raw response event
+        """
+        session_manager = self.session_manager
+        session_id = self.session_id
+        debug_file = self.debug_file
+        tokenizer = self.tokenizer
 
-            # Save these fallback files
-            file_paths = save_generated_files(session_manager, session_id, html_code, css_code, js_code)
+        chunk = event.get('chunk')
+        if not chunk:
+            return
+        chunk_data = json.loads(chunk.get('bytes').decode())
+
+        # Log the raw chunk data
+        debug_file.write(f"--- CHUNK {self.chunk_count + 1} ---\n")
+        debug_file.write(f"Raw chunk data: {json.dumps(chunk_data, indent=2)}\n\n")
+
+        # Extract text from the chunk
+        chunk_text = ""
+        block_events = []
+
+        # Handle different types of chunks
+        if chunk_data.get('type') == 'content_block_delta':
+            delta = chunk_data.get('delta', {})
+            if delta.get('type') == 'text_delta':
+                chunk_text = delta.get('text', '')
+                self.text_parts.append(chunk_text)
+                block_events = tokenizer.feed(chunk_text)
+                session_manager.append_output(session_id, chunk_text)
+
+                # Record first token time if this is the first content chunk
+                if self.first_token_time == 0 and chunk_text != '':
+                    self.first_token_time = time.time_ns() // 1_000_000 - self.start_time  # 直接计算毫秒差值
+                    session_manager.update_session_status(
+                        session_id,
+                        first_token_time=round(self.first_token_time / 1000, 2),
+                    )
+        elif chunk_data.get('type') == 'message_delta' and 'usage' in chunk_data:
+            # Extract token usage from message_delta
+            if 'output_tokens' in chunk_data.get('usage', {}):
+                output_tokens = chunk_data['usage']['output_tokens']
+                self.output_tokens = output_tokens
+                session_manager.update_session_status(
+                    session_id,
+                    output_tokens=output_tokens
+                )
+        elif chunk_data.get('type') == 'message_stop' and 'amazon-bedrock-invocationMetrics' in chunk_data:
+            # Extract metrics from message_stop
+            metrics = chunk_data.get('amazon-bedrock-invocationMetrics', {})
+            input_tokens = metrics.get('inputTokenCount', 0)
+            output_tokens = metrics.get('outputTokenCount', 0)
+            self.output_tokens = output_tokens
             session_manager.update_session_status(
                 session_id,
-                processing_complete=True
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                cache_read_input_tokens=metrics.get('cacheReadInputTokenCount', 0),
+                cache_write_input_tokens=metrics.get('cacheWriteInputTokenCount', 0)
             )
+
+        # Log the extracted text
+        debug_file.write(f"Extracted text: {chunk_text}\n")
+        debug_file.write(f"Current full_text length: {tokenizer.length}\n")
+        debug_file.write("-------------------\n\n")
+
+        # Dynamic progress update based on content received.
+        # Opening a code block moves to its stage, otherwise
+        # progress creeps between 25-90% with the chunk count
+        self.chunk_count += 1
+        for block_event, artifact in block_events:
+            if block_event == BLOCK_OPENED:
+                self.progress = max(self.progress, CODEGEN_STAGES[artifact][0])
+            else:
+                # Flush the finished artifact so the preview can load it
+                save_artifact(session_manager, session_id, artifact, tokenizer.get_code(artifact))
+                self.ready_artifacts.append(artifact)
+                session_manager.update_session_status(
+                    session_id,
+                    ready_artifacts=list(self.ready_artifacts)
+                )
+            debug_file.write(f"{block_event}: {artifact}\n")
+        self.progress = max(self.progress, int(min(25 + (self.chunk_count * 65 / 100), 90)))
+
+        # Opening a block changes the task, so it is reported right away
+        open_artifact = FENCE_ARTIFACTS.get(tokenizer.open_label)
+        if open_artifact != self.open_artifact:
+            self.open_artifact = open_artifact
+            self.ticker.progress = None
+        if not self.ticker.due(self.progress, self.chunk_count):
             return
 
+        if open_artifact:
+            current_task = CODEGEN_STAGES[open_artifact][1]
+        else:
+            current_task = f"Processing chunk {self.chunk_count}"
+
         session_manager.update_session_status(
             session_id,
-            current_task="Saving generated files",
-            progress_percentage=95
+            streaming_chunks=self.chunk_count,
+            current_task=current_task,
+            progress_percentage=self.progress
         )
 
-        # Save the generated code to files
-        file_paths = save_generated_files(session_manager, session_id, html_code, css_code, js_code)
+    def finish(self):
+        """
+        Log the final full text and record the decode speed of the stream
 
-        # Calculate processing time
-        processing_time = round((time.time_ns() // 1_000_000 - start_time)/1000, 2)  # 利用ms 计算秒级别差值
+        Returns:
+            str: Full text of the response
+        """
+        # Progress is reported at intervals, so report the final chunk count
+        self.session_manager.update_session_status(self.session_id, streaming_chunks=self.chunk_count)
+
+        # The decode speed leaves out the wait for the first token
+        decode_time = time.time_ns() // 1_000_000 - self.start_time - self.first_token_time
+        if self.output_tokens and self.first_token_time and decode_time > 0:
+            self.session_manager.update_session_status(
+                self.session_id,
+                decode_tokens_per_second=round(self.output_tokens * 1000 / decode_time, 2)
+            )
 
-        session_manager.update_session_status(
-            session_id,
-            current_task="Processing complete",
-            progress_percentage=100,
-            processing_complete=True,
-            processing_time=processing_time
-        )
+        full_text = "".join(self.text_parts)
+        self.debug_file.write("\n=== FINAL FULL TEXT ===\n")
+        self.debug_file.write(full_text)
+        self.debug_file.write("\n\n=== END OF LOG ===\n")
+        return full_text
+
+def save_streaming_result(session_manager, session_id, tokenizer, full_text, start_time):
+    """
+    Extract the code of a finished stream, save it and complete the job
+
+    Args:
+        session_manager: Session manager
+        session_id (str): Session ID
+        tokenizer (CodeFenceTokenizer): Tokenizer that consumed the stream
+        full_text (str): Full text of the response
+        start_time (int): Start time of the job in milliseconds
+    """
+    session_manager.update_session_status(
+        session_id,
+        current_task="Extracting code from streaming response",
+        progress_percentage=90
+    )
 
-    except Exception as e:
-        error_message = str(e)
-        session_manager.update_session_status(
-            session_id,
-            current_task=f"Error in streaming: {str(e)}",
-            progress_percentage=0,
-            error_message=error_message
-        )
+    # Extract code from the full text with debug logging
+    extract_debug_path = session_manager.get_generated_path(session_id, 'extraction_debug.log')
+    with open(extract_debug_path, 'w') as extract_debug:
+        html_code, css_code, js_code = tokenizer.extract(extract_debug)
 
-        # Create fallback files in case of error
-        html_code = create_error_html(error_message)
-        css_code = "/* No CSS generated due to error */"
-        js_code = "// No JavaScript generated due to error"
+        # If extraction failed, try to create minimal files
+        if not html_code:
+            extract_debug.write("\n=== CREATING FALLBACK HTML ===\n")
+            html_code = create_fallback_html(full_text[:1000])
 
-        # Save these fallback files
-        file_paths = save_generated_files(session_manager, session_id, html_code, css_code, js_code)
-        session_manager.update_session_status(
-            session_id,
-            processing_complete=True
+        if not css_code:
+            extract_debug.write("\n=== CREATING FALLBACK CSS ===\n")
+            css_code = create_fallback_css()
+
+        if not js_code:
+            extract_debug.write("\n=== CREATING FALLBACK JS ===\n")
+            js_code = create_fallback_js()
+
+    session_manager.update_session_status(
+        session_id,
+        current_task="Saving generated files",
+        progress_percentage=95
+    )
+
+    # Save the generated code to files
+    file_paths = save_generated_files(session_manager, session_id, html_code, css_code, js_code)
+
+    # Calculate processing time
+    processing_time = round((time.time_ns() // 1_000_000 - start_time)/1000, 2)  # 利用ms 计算秒级别差值
+
+    session_manager.update_session_status(
+        session_id,
+        current_task="Processing complete",
+        progress_percentage=100,
+        processing_complete=True,
+        processing_time=processing_time
+    )
+
+def process_image_streaming(session_manager, session_id, image_path):
+    """Process the image with selected Bedrock Claude model using streaming API"""
+    with streaming_job(session_manager, session_id) as start_time:
+        # Encode image to base64
+        base64_image = encode_image(image_path)
+        model_config, request_body_json = build_streaming_requests(session_manager, session_id, base64_image)
+        model_id = model_config["model_id"]
+
+        # Invoke the model with streaming, hedging late streams to another region
+        bedrock_runtime = get_routed_client(model_id)
+        start = lambda: stream_model_events(bedrock_runtime, model_id, request_body_json, PROCESSOR_MAX_ATTEMPTS)
+        hedge_config, hedge_runtime = get_hedge_target(model_config, bedrock_runtime)
+        hedge_model_id = hedge_start = None
+        if hedge_config:
+            hedge_model_id = hedge_config["model_id"]
+            hedge_body_json = build_hedge_request(model_config, request_body_json, hedge_config, base64_image)
+            hedge_start = lambda: stream_model_events(hedge_runtime, hedge_model_id, hedge_body_json, PROCESSOR_MAX_ATTEMPTS)
+
+        # Closing the stream ends the request and frees its limiter slot
+        debug_log_path = session_manager.get_generated_path(session_id, 'streaming_debug.log')
+        with closing(hedged_stream(model_id, start, hedge_start, hedge_model_id, is_text_event)) as stream, \
+                open(debug_log_path, 'w') as debug_file:
+            reader = StreamingResponseReader(session_manager, session_id, start_time, debug_file)
+            for event in stream:
+                reader.feed(event)
+            full_text = reader.finish()
+
+        save_streaming_result(session_manager, session_id, reader.tokenizer, full_text, start_time)
+
+async def process_image_streaming_async(session_manager, session_id, image_path):
+    """
+    Process the image like process_image_streaming, on the shared event loop
+
+    The response is read with the async Bedrock client, so the job does not
+    hold a thread while it waits for tokens. Encoding the image and the file
+    writes of the debug log and artifacts run in the default executor, so
+    they do not stall the other streams on the loop.
+    """
+    loop = asyncio.get_running_loop()
+    with streaming_job(session_manager, session_id) as start_time:
+        base64_image = await loop.run_in_executor(None, encode_image, image_path)
+        model_config, request_body_json = await loop.run_in_executor(
+            None, build_streaming_requests, session_manager, session_id, base64_image
         )
-    finally:
-        session_manager.update_session_status(
-            session_id,
-            is_processing=False
+        model_id = model_config["model_id"]
+
+        # Invoke the model with streaming, hedging late streams to another region
+        bedrock_runtime = await get_async_routed_client(model_id)
+        start = lambda: stream_model_events_async(bedrock_runtime, model_id, request_body_json, PROCESSOR_MAX_ATTEMPTS)
+        hedge_config, hedge_runtime = await get_async_hedge_target(model_config, bedrock_runtime)
+        hedge_model_id = hedge_start = None
+        if hedge_config:
+            hedge_model_id = hedge_config["model_id"]
+            hedge_body_json = await loop.run_in_executor(
+                None, build_hedge_request, model_config, request_body_json, hedge_config, base64_image
+            )
+            hedge_start = lambda: stream_model_events_async(hedge_runtime, hedge_model_id, hedge_body_json, PROCESSOR_MAX_ATTEMPTS)
+
+        stream = hedged_stream_async(model_id, start, hedge_start, hedge_model_id, is_text_event)
+        debug_log_path = session_manager.get_generated_path(session_id, 'streaming_debug.log')
+        try:
+            debug_file = await loop.run_in_executor(None, open, debug_log_path, 'w')
+            try:
+                reader = await loop.run_in_executor(
+                    None, StreamingResponseReader, session_manager, session_id, start_time, debug_file
+                )
+                # Events are fed one at a time, so they reach the reader in order
+                async for event in stream:
+                    await loop.run_in_executor(None, reader.feed, event)
+                full_text = await loop.run_in_executor(None, reader.finish)
+            finally:
+                await loop.run_in_executor(None, debug_file.close)
+        finally:
+            # Closing the stream ends the request and frees its limiter slot
+            await stream.aclose()
+
+        await loop.run_in_executor(
+            None, save_streaming_result, session_manager, session_id, reader.tokenizer, full_text, start_time
         )
+
 def process_image_non_streaming(session_manager, session_id, image_path):
     """Process the image with selected Bedrock Claude model using non-streaming API"""
     # Get session status
@@ -385,7 +601,8 @@ def process_image_non_streaming(session_manager, session_id, image_path):
             progress_percentage=10,
             is_processing=True,
             processing_complete=False,
-            error_message=None
+            error_message=None,
+            ready_artifacts=[]
         )
         
         # Encode image to base64
@@ -403,38 +620,6 @@ def process_image_non_streaming(session_manager, session_id, image_path):
         max_tokens = model_config["max_tokens"]
         model_display_name = selected_model.replace("-", " ").title()
         
-        # Prepare the prompt for Claude
-        prompt = f"""
-        You are an expert web developer. I'm showing you a UI design image. 
-        Please convert this design into responsive HTML, CSS, and JavaScript code.
-        
-        Use Bootstrap 5 for the responsive layout and Vue.js 3 for interactivity.
-        Include Font Awesome for icons.
-        
-        Please provide:
-        1. Complete index.html file
-        2. Complete styles.css file
-        3. Complete script.js file
-        
-        Make sure the code is clean, well-commented, and follows best practices.
-        Make sure the code is the same language as in the picture.
-        The website should be fully responsive and match the design as closely as possible.
-        
-        Return your response in the following format:
-        
-        ```html
-        <!-- Your complete HTML code here -->
-        ```
-        
-        ```css
-        /* Your complete CSS code here */
-        ```
-        
-        ```javascript
-        // Your complete JavaScript code here
-        ```
-        """
-        
         session_manager.update_session_status(
             session_id,
             current_task=f"Sending request to {model_display_name}",
@@ -448,20 +633,7 @@ def process_image_non_streaming(session_manager, session_id, image_path):
             "messages": [
                 {
                     "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": base64_image
-                            }
-                        }
-                    ]
+                    "content": build_codegen_content(base64_image, caches_prefix(model_config, CODEGEN_PROMPT))
                 }
             ]
         }
@@ -476,10 +648,17 @@ def process_image_non_streaming(session_manager, session_id, image_path):
         )
         
         # Invoke the model
-        response = bedrock_runtime.invoke_model(
+        bedrock_runtime = get_routed_client(model_id)
+        limiter = get_model_limiter(model_id)
+        routed = RoutedRequest(bedrock_runtime, model_id, lambda client: client.invoke_model(
             modelId=model_id,
             body=request_body_json
-        )
+        ))
+        with routed, limiter.request(routed, max_attempts=PROCESSOR_MAX_ATTEMPTS) as response:
+            # Read the body while the request still holds its slot
+            response_body = json.loads(response.get('body').read())
+            limiter.record_tokens(usage_tokens(response_body.get('usage', {})))
+            routed.finished(response_body.get('usage', {}).get('output_tokens', 0))
         
         # Record first token time for non-streaming
         first_token_time = time.time_ns() // 1_000_000 - start_time  # 直接计算毫秒差值
@@ -495,7 +674,6 @@ def process_image_non_streaming(session_manager, session_id, image_path):
         )
         
         # Parse the response
-        response_body = json.loads(response.get('body').read())
         content = response_body.get('content', [])
         
         # Get usage metrics if available
@@ -505,7 +683,9 @@ def process_image_non_streaming(session_manager, session_id, image_path):
             session_manager.update_session_status(
                 session_id,
                 input_tokens=input_tokens,
-                output_tokens=output_tokens
+                output_tokens=output_tokens,
+                cache_read_input_tokens=response_body['usage'].get('cache_read_input_tokens', 0),
+                cache_write_input_tokens=response_body['usage'].get('cache_creation_input_tokens', 0)
             )
         
         # Extract text from the response
@@ -5,25 +5,119 @@ import os
 import time
 import uuid
 import shutil
+import threading
+from bisect import bisect_right
 from datetime import datetime
 
+# Times per second the high-frequency status fields of a session are
+# published at most; 0 publishes every update
+STATUS_UPDATES_PER_SECOND = float(os.environ.get('SESSION_STATUS_UPDATES_PER_SECOND', '4'))
+
+# Status fields streaming loops update for every event. Updates that only
+# touch these are buffered; any other field publishes right away.
+COALESCED_STATUS_FIELDS = frozenset({'streaming_chunks', 'progress_percentage', 'current_task'})
+
+# Chunks a streaming loop may receive before reporting its progress again
+# when the percentage has not changed
+PROGRESS_UPDATE_CHUNKS = 20
+
+class ProgressTicker:
+    """
+    Decides when a streaming loop reports its progress
+
+    Progress is due when its integer percentage changes, every
+    PROGRESS_UPDATE_CHUNKS chunks, or once per status publishing interval,
+    so loops don't build and send a status update for every chunk.
+    """
+
+    def __init__(self):
+        self.progress = None
+        self.chunks = 0
+        self.reported_at = 0.0
+        self.interval = 1.0 / STATUS_UPDATES_PER_SECOND if STATUS_UPDATES_PER_SECOND > 0 else 0.0
+
+    def due(self, progress, chunks):
+        """
+        Check whether progress should be reported, and mark it reported if so
+
+        Args:
+            progress (int): Current progress percentage
+            chunks (int): Chunks received so far
+
+        Returns:
+            bool: True if the caller should update the session status
+        """
+        now = time.monotonic()
+        if (progress != self.progress or chunks - self.chunks >= PROGRESS_UPDATE_CHUNKS
+                or now - self.reported_at >= self.interval):
+            self.progress = progress
+            self.chunks = chunks
+            self.reported_at = now
+            return True
+        return False
+
+class _SessionOutput:
+    """
+    Text generated by a session, readable from any character offset
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.starts = []
+        self.length = 0
+
+    def append(self, text):
+        self.starts.append(self.length)
+        self.parts.append(text)
+        self.length += len(text)
+
+    def read(self, offset):
+        if offset >= self.length:
+            return ""
+        index = max(bisect_right(self.starts, offset) - 1, 0)
+        return "".join(self.parts[index:])[offset - self.starts[index]:]
+
 class SessionManager:
     """
     Manages user sessions, file paths, and status tracking
     """
 
-    def __init__(self, upload_base_dir='uploads', generated_base_dir='generated'):
+    def __init__(self, upload_base_dir='uploads', generated_base_dir='generated', on_complete=None,
+                 status_updates_per_second=STATUS_UPDATES_PER_SECOND):
         """
         Initialize the session manager
         
         Args:
             upload_base_dir (str): Base directory for uploaded files
             generated_base_dir (str): Base directory for generated files
+            on_complete (callable): Optional function called with the status
+                of every session that completes without an error
+            status_updates_per_second (float): Times per second buffered
+                progress fields are published at most, 0 for every update
         """
         self.upload_base_dir = upload_base_dir
         self.generated_base_dir = generated_base_dir
+        self.on_complete = on_complete
         self.sessions = {}
 
+        # Buffered progress fields of each session, when its status was last
+        # published, and the timer publishing the buffer once it is due
+        self.status_interval = 1 / status_updates_per_second if status_updates_per_second > 0 else 0
+        self._pending = {}
+        self._published = {}
+        self._flush_timers = {}
+
+        # Held while buffered fields are taken and published, so a timer
+        # never publishes stale progress after a later update
+        self._publish_lock = threading.RLock()
+
+        # Status version of each session, and the condition its watchers
+        # wait on; all conditions share one lock
+        self._versions = {}
+        self._changed = {}
+        self._outputs = {}
+        self._lock = threading.Lock()
+
         # Create base directories if they don't exist
         os.makedirs(upload_base_dir, exist_ok=True)
         os.makedirs(generated_base_dir, exist_ok=True)
@@ -55,13 +149,38 @@ class SessionManager:
             'error_message': None,
             'input_tokens': 0,
             'output_tokens': 0,
+            'cache_read_input_tokens': 0,
+            'cache_write_input_tokens': 0,
             'processing_time': 0,
             'streaming_chunks': 0,
+            'ready_artifacts': [],
             'selected_model': None,
             'use_streaming': False,
             'first_token_time': 0,
-            'tokens_per_second': 0
+            'tokens_per_second': 0,
+            'decode_tokens_per_second': 0,
+            'use_translation_memory': True,
+            'tm_lookups': 0,
+            'tm_hits': 0,
+            'tm_hit_rate': 0,
+            'tm_tokens_saved': 0,
+            'deduplicated_segments': 0,
+            'skipped_segments': 0,
+            'skipped_tokens': 0,
+            'target_language_segments': 0,
+            'detected_source_language': None,
+            'truncated_chunks': 0,
+            'retried_segments': 0,
+            'missing_segments': 0,
+            'elements_translated': 0,
+            'streamed_output': False,
+            'input_size': 0,
+            'output_size': 0
         }
+        with self._lock:
+            self._versions[session_id] = 0
+            self._changed[session_id] = threading.Condition(self._lock)
+            self._outputs[session_id] = _SessionOutput()
 
         return session_id
 
@@ -80,6 +199,12 @@ class SessionManager:
     def update_session_status(self, session_id, **kwargs):
         """
         Update the status of a session
+
+        Updates that only touch progress fields (streaming chunks, progress
+        percentage, current task) are buffered and published at most
+        status_updates_per_second times per second, the latest value of
+        each field winning. Any other update, such as completion or an
+        error, is published right away together with the buffered fields.
         
         Args:
             session_id (str): Session ID
@@ -91,6 +216,62 @@ class SessionManager:
         if session_id not in self.sessions:
             return False
 
+        if (self.status_interval and kwargs and COALESCED_STATUS_FIELDS.issuperset(kwargs)
+                and kwargs.get('progress_percentage') != 100):
+            with self._lock:
+                self._pending.setdefault(session_id, {}).update(kwargs)
+                delay = self._published.get(session_id, 0) + self.status_interval - time.monotonic()
+                if delay > 0:
+                    if session_id not in self._flush_timers:
+                        timer = threading.Timer(delay, self.flush_session_status, [session_id])
+                        timer.daemon = True
+                        self._flush_timers[session_id] = timer
+                        timer.start()
+                    return True
+            return self.flush_session_status(session_id)
+
+        with self._publish_lock:
+            pending = self._take_pending(session_id)
+            if pending:
+                kwargs = dict(pending, **kwargs)
+            return self._publish_status(session_id, kwargs)
+
+    def flush_session_status(self, session_id):
+        """
+        Publish the buffered progress fields of a session right away
+
+        Args:
+            session_id (str): Session ID
+
+        Returns:
+            bool: True if successful, False if session doesn't exist
+        """
+        with self._publish_lock:
+            pending = self._take_pending(session_id)
+            if session_id not in self.sessions:
+                return False
+            if pending:
+                self._publish_status(session_id, pending)
+            return True
+
+    def _take_pending(self, session_id):
+        """
+        Remove and return the buffered progress fields of a session
+        """
+        with self._lock:
+            pending = self._pending.pop(session_id, None)
+            timer = self._flush_timers.pop(session_id, None)
+        if timer:
+            timer.cancel()
+        return pending
+
+    def _publish_status(self, session_id, kwargs):
+        """
+        Apply a status update and wake the session's watchers
+        """
+        if session_id not in self.sessions:
+            return False
+
         # Update only valid keys
         for key, value in kwargs.items():
             if key in self.sessions[session_id]:
@@ -108,8 +289,93 @@ class SessionManager:
                 tokens_per_second = round(output_tokens / processing_time, 2)
                 self.sessions[session_id]['tokens_per_second'] = tokens_per_second
 
+        # Report sessions that finished without an error
+        session = self.sessions[session_id]
+        if kwargs.get('processing_complete') and self.on_complete and not session['error_message']:
+            self.on_complete(session)
+
+        self._published[session_id] = time.monotonic()
+        self._notify(session_id)
+        return True
+
+    def _notify(self, session_id):
+        """
+        Wake the watchers of a session after its status or output changed
+        """
+        with self._lock:
+            self._notify_locked(session_id)
+
+    def _notify_locked(self, session_id):
+        if session_id in self._versions:
+            self._versions[session_id] += 1
+            self._changed[session_id].notify_all()
+
+    def append_output(self, session_id, text):
+        """
+        Add a delta of the text a session is generating
+
+        The text is kept with the session, so watchers can resume reading
+        it from any offset.
+
+        Args:
+            session_id (str): Session ID
+            text (str): Text delta
+
+        Returns:
+            bool: True if successful, False if session doesn't exist
+        """
+        with self._lock:
+            output = self._outputs.get(session_id)
+            if output is None:
+                return False
+            if text:
+                output.append(text)
+                self._notify_locked(session_id)
         return True
 
+    def get_output(self, session_id, offset=0):
+        """
+        Get the text a session generated from an offset on
+
+        Args:
+            session_id (str): Session ID
+            offset (int): Characters the caller has already read
+
+        Returns:
+            tuple: (text, offset) with the new text and the offset to read
+            from next time
+        """
+        with self._lock:
+            output = self._outputs.get(session_id)
+            if output is None:
+                return "", offset
+            return output.read(offset), max(offset, output.length)
+
+    def wait_for_update(self, session_id, version, timeout=None):
+        """
+        Wait until the status of a session changes
+
+        Args:
+            session_id (str): Session ID
+            version (int): Status version the caller has seen, or -1 to get
+                the current status right away
+            timeout (float): Optional seconds to wait at most
+
+        Returns:
+            tuple: (status, version) with a copy of the current status and
+            its version, which is the given version if the wait timed out.
+            The status is None if the session doesn't exist.
+        """
+        with self._lock:
+            changed = self._changed.get(session_id)
+            if changed is None:
+                return None, version
+
+            changed.wait_for(lambda: self._versions.get(session_id, version) != version, timeout)
+            if session_id not in self._versions:
+                return None, version
+            return dict(self.sessions[session_id]), self._versions[session_id]
+
     def get_upload_path(self, session_id, filename):
         """
         Get the path for an uploaded file
@@ -173,7 +439,15 @@ class SessionManager:
             if os.path.exists(generated_dir):
                 shutil.rmtree(generated_dir)
 
-            # Remove session from dictionary
+            # Remove session from dictionary and release its watchers
+            self._take_pending(session_id)
+            self._published.pop(session_id, None)
             del self.sessions[session_id]
+            with self._lock:
+                self._versions.pop(session_id, None)
+                self._outputs.pop(session_id, None)
+                changed = self._changed.pop(session_id, None)
+                if changed:
+                    changed.notify_all()
 
         return len(sessions_to_remove)
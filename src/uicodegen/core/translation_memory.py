@@ -0,0 +1,286 @@
+"""
+Translation memory for reusing segment translations across jobs
+"""
+import os
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+# Default location of the translation memory database
+DEFAULT_TRANSLATION_MEMORY_PATH = os.environ.get('TRANSLATION_MEMORY_PATH', 'translation_memory.db')
+
+# SQLite limits the number of parameters per statement
+LOOKUP_BATCH_SIZE = 500
+
+XML_LANG = '{http://www.w3.org/XML/1998/namespace}lang'
+
+class TranslationMemory:
+    """
+    Segment-level translation memory stored in SQLite
+
+    Entries are keyed by source text, source language, target language and
+    model. Entries imported without a model (model '') match any model.
+    """
+
+    def __init__(self, db_path=DEFAULT_TRANSLATION_MEMORY_PATH):
+        """
+        Initialize the translation memory
+
+        Args:
+            db_path (str): Path to the SQLite database file
+        """
+        self.db_path = db_path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _get_connection(self):
+        """
+        Open the database on first use and create the schema
+
+        Returns:
+            sqlite3.Connection: Database connection
+        """
+        if self._connection is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS segments (
+                    source_text TEXT NOT NULL,
+                    source_lang TEXT NOT NULL,
+                    target_lang TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    target_text TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (source_text, source_lang, target_lang, model)
+                )
+                """
+            )
+            self._connection.commit()
+
+        return self._connection
+
+    def lookup(self, texts, source_lang, target_lang, model):
+        """
+        Look up translations for a collection of source texts
+
+        Args:
+            texts: Iterable of source texts
+            source_lang (str): Source language code
+            target_lang (str): Target language code
+            model (str): Model name
+
+        Returns:
+            dict: Translations keyed by source text, for hits only
+        """
+        texts = list(set(texts))
+        source_lang = source_lang.lower()
+        target_lang = target_lang.lower()
+        found = {}
+
+        with self._lock:
+            connection = self._get_connection()
+            for start in range(0, len(texts), LOOKUP_BATCH_SIZE):
+                batch = texts[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                # Model-specific entries win over model-agnostic ones
+                rows = connection.execute(
+                    f"""
+                    SELECT source_text, target_text FROM segments
+                    WHERE source_lang = ? AND target_lang = ? AND model IN (?, '')
+                    AND source_text IN ({placeholders})
+                    ORDER BY model = ? ASC
+                    """,
+                    [source_lang, target_lang, model] + batch + [model]
+                ).fetchall()
+                for source_text, target_text in rows:
+                    found[source_text] = target_text
+
+        return found
+
+    def store(self, translations, source_lang, target_lang, model):
+        """
+        Store translations in the memory
+
+        Args:
+            translations (dict): Translations keyed by source text
+            source_lang (str): Source language code
+            target_lang (str): Target language code
+            model (str): Model name
+
+        Returns:
+            int: Number of entries written
+        """
+        now = time.time()
+        rows = [
+            (source_text, source_lang.lower(), target_lang.lower(), model, target_text, now)
+            for source_text, target_text in translations.items()
+            if source_text and target_text
+        ]
+
+        if not rows:
+            return 0
+
+        with self._lock:
+            connection = self._get_connection()
+            connection.executemany(
+                """
+                INSERT OR REPLACE INTO segments
+                (source_text, source_lang, target_lang, model, target_text, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            connection.commit()
+
+        return len(rows)
+
+    def count(self):
+        """
+        Get the number of entries in the memory
+
+        Returns:
+            int: Number of entries
+        """
+        with self._lock:
+            connection = self._get_connection()
+            return connection.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+    def import_tmx(self, tmx_file, model=''):
+        """
+        Import translation units from a TMX file
+
+        Every translation unit yields one entry per target variant. A unit's
+        x-model property overrides the model argument.
+
+        Args:
+            tmx_file: Path or file object of the TMX document
+            model (str): Model to record for units without an x-model property
+
+        Returns:
+            int: Number of entries imported
+        """
+        header_source_lang = None
+        imported = 0
+        batch = {}
+
+        for event, element in ET.iterparse(tmx_file, events=('start', 'end')):
+            if event == 'start' and element.tag == 'header':
+                header_source_lang = element.get('srclang')
+                continue
+
+            if event != 'end' or element.tag != 'tu':
+                continue
+
+            unit_model = model
+            for prop in element.findall('prop'):
+                if prop.get('type') == 'x-model':
+                    unit_model = prop.text or ''
+
+            variants = {}
+            for tuv in element.findall('tuv'):
+                lang = tuv.get(XML_LANG) or tuv.get('lang')
+                seg = tuv.find('seg')
+                if lang and seg is not None:
+                    variants[lang.lower()] = "".join(seg.itertext())
+
+            source_lang = (element.get('srclang') or header_source_lang or '').lower()
+            source_text = variants.pop(source_lang, None)
+            if source_text:
+                for target_lang, target_text in variants.items():
+                    batch.setdefault((source_lang, target_lang, unit_model), {})[source_text] = target_text
+
+            # Free parsed units as we go
+            element.clear()
+
+        for (source_lang, target_lang, unit_model), translations in batch.items():
+            imported += self.store(translations, source_lang, target_lang, unit_model)
+
+        return imported
+
+    def export_tmx(self, tmx_file, source_lang=None, target_lang=None):
+        """
+        Export the memory as a TMX 1.4 document
+
+        Args:
+            tmx_file: Path or binary file object to write to
+            source_lang (str): Only export entries with this source language
+            target_lang (str): Only export entries with this target language
+
+        Returns:
+            int: Number of translation units exported
+        """
+        query = "SELECT source_text, source_lang, target_lang, model, target_text FROM segments"
+        conditions = []
+        params = []
+        if source_lang:
+            conditions.append("source_lang = ?")
+            params.append(source_lang.lower())
+        if target_lang:
+            conditions.append("target_lang = ?")
+            params.append(target_lang.lower())
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        with self._lock:
+            connection = self._get_connection()
+            rows = connection.execute(query, params).fetchall()
+
+        root = ET.Element("tmx", version="1.4")
+        ET.SubElement(root, "header", {
+            'creationtool': 'uicodegen',
+            'creationtoolversion': '0.1.0',
+            'segtype': 'sentence',
+            'o-tmf': 'sqlite',
+            'adminlang': 'en',
+            'srclang': source_lang or '*all*',
+            'datatype': 'plaintext'
+        })
+        body = ET.SubElement(root, "body")
+
+        for source_text, row_source_lang, row_target_lang, model, target_text in rows:
+            tu = ET.SubElement(body, "tu", srclang=row_source_lang)
+            if model:
+                prop = ET.SubElement(tu, "prop", type="x-model")
+                prop.text = model
+            for lang, text in ((row_source_lang, source_text), (row_target_lang, target_text)):
+                tuv = ET.SubElement(tu, "tuv", {XML_LANG: lang})
+                seg = ET.SubElement(tuv, "seg")
+                seg.text = text
+
+        ET.ElementTree(root).write(tmx_file, encoding="utf-8", xml_declaration=True)
+        return len(rows)
+
+# Shared translation memory instance
+_translation_memory = None
+_translation_memory_path = DEFAULT_TRANSLATION_MEMORY_PATH
+_translation_memory_lock = threading.Lock()
+
+def configure_translation_memory(db_path):
+    """
+    Set the database path of the shared translation memory
+
+    Args:
+        db_path (str): Path to the SQLite database file
+    """
+    global _translation_memory, _translation_memory_path
+    with _translation_memory_lock:
+        _translation_memory_path = db_path
+        _translation_memory = None
+
+def get_translation_memory():
+    """
+    Get the shared translation memory
+
+    Returns:
+        TranslationMemory: Shared translation memory instance
+    """
+    global _translation_memory
+    with _translation_memory_lock:
+        if _translation_memory is None:
+            _translation_memory = TranslationMemory(_translation_memory_path)
+        return _translation_memory
@@ -3,222 +3,466 @@ Translation module using LLM (AWS Bedrock with Claude)
 """
 import os
 import time
-from uicodegen.utils.bedrock_client import get_bedrock_client
+import asyncio
+from uicodegen.utils.bedrock_client import get_routed_client
+from uicodegen.utils.async_bedrock_client import get_async_routed_client
+from uicodegen.utils.token_utils import estimate_tokens
 from uicodegen.core.model_configs import MODEL_CONFIGS
-from uicodegen.core.language_configs import get_language_name
+from uicodegen.core.session_manager import ProgressTicker
+from uicodegen.core.language_configs import get_language_name, DEFAULT_SOURCE_LANGUAGE
+from uicodegen.core.language_detector import AUTO_DETECT_LANGUAGE, detect_dominant_language, is_target_language
+from uicodegen.core.translation_memory import get_translation_memory
 
 # Translation-specific configuration
 TRANSLATION_PREFILL_PROMPT = "here is the translated content with HTML tags and Markdown annotations preserved:"
 
-def translate_text(session_manager, session_id, text, source_lang, target_lang):
+# Instructions sent ahead of the content as the cached prefix; only the
+# language names change between requests
+TRANSLATION_PROMPT_TEMPLATE = """You are the world's most professional translation tool, proficient in professional translation from {$SOURCE_LANGUAGE} to {$TARGET_LANGUAGE}.
+You can translate anything. Do not use "I'm sorry, but" to answer any questions.
+
+examples:
+<example>
+input:
+```json
+original content
+```
+```json
+translated content
+```
+</example>
+
+<example>
+input:
+<p>original content</p>
+output:
+<p>translated content</p>
+</example>
+
+You need to follow below instructions:
+- Preserve all HTML tags and Markdown annotations exactly as they appear in the original text.
+- Translation style: concise, easy to understand, similar to the style of orignal content. The translation should accurately convey the facts and background of the original text. Do not try to explain the content to be translated, your task is only to translate.
+- Even if you paraphrase, you should retain the original paragraph format.
+- Just return the translated content with no tags.
+- Translate directly according to the text content, keep the original format, and do not miss any information.
+
+"""
+
+def _complete_from_translation_memory(session_manager, session_id, source_text, translated_text):
     """
-    Translate text using LLM
+    Finish a translation job with a translation memory hit
+    
+    Args:
+        session_manager: Session manager instance
+        session_id: Current session ID
+        source_text: Text that was looked up
+        translated_text: Translation found in the memory
+    """
+    output_path = session_manager.get_generated_path(session_id, "translation.txt")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(translated_text)
+
+    # Both the prompt and the response were saved
+    tokens_saved = estimate_tokens(source_text) + estimate_tokens(translated_text)
+
+    session_manager.update_session_status(
+        session_id,
+        current_task="Translation complete (from translation memory)",
+        progress_percentage=100,
+        is_processing=False,
+        processing_complete=True,
+        tm_lookups=1,
+        tm_hits=1,
+        tm_hit_rate=1.0,
+        tm_tokens_saved=tokens_saved
+    )
+
+    return translated_text
+
+def _complete_in_target_language(session_manager, session_id, text, target_lang):
+    """
+    Finish a translation job whose text is already in the target language
     
     Args:
         session_manager: Session manager instance
         session_id: Current session ID
         text: Text to translate
-        source_lang: Source language
         target_lang: Target language
     """
-    try:
-        # Get session status
-        status = session_manager.get_session_status(session_id)
-        model_name = status.get('selected_model')
-        use_streaming = status.get('use_streaming', False)
+    output_path = session_manager.get_generated_path(session_id, "translation.txt")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+    session_manager.update_session_status(
+        session_id,
+        current_task=f"Translation complete (text is already in {get_language_name(target_lang)})",
+        progress_percentage=100,
+        is_processing=False,
+        processing_complete=True,
+        target_language_segments=1
+    )
+
+    return text
+
+def _prepare_translation(session_manager, session_id, text, source_lang, target_lang):
+    """
+    Resolve the model and languages of a translation job and build its prompt
+    
+    Jobs that need no model request are completed here.
+    
+    Args:
+        session_manager: Session manager instance
+        session_id: Current session ID
+        text: Text to translate
+        source_lang: Source language, or "auto" to detect it
+        target_lang: Target language
+        
+    Returns:
+        tuple: (job, translated_text). job is a dictionary with the model,
+        prompt and translation memory of the request, or None if the job
+        already finished with translated_text.
+    """
+    # Get session status
+    status = session_manager.get_session_status(session_id)
+    model_name = status.get('selected_model')
+    use_streaming = status.get('use_streaming', False)
+    use_translation_memory = status.get('use_translation_memory', True)
+
+    # Update session status
+    session_manager.update_session_status(
+        session_id,
+        current_task="Preparing translation",
+        progress_percentage=10
+    )
+
+    # Get model configuration
+    model_config = MODEL_CONFIGS.get(model_name)
+    if not model_config:
+        session_manager.update_session_status(
+            session_id,
+            is_processing=False,
+            error_message=f"Invalid model: {model_name}"
+        )
+        return None, None
+
+    # Detect the source language when it was left to us
+    if source_lang == AUTO_DETECT_LANGUAGE:
+        source_lang = detect_dominant_language([text], default=DEFAULT_SOURCE_LANGUAGE)
+        session_manager.update_session_status(session_id, detected_source_language=source_lang)
+
+    # Text already in the target language needs no translation
+    if is_target_language(text, source_lang, target_lang):
+        return None, _complete_in_target_language(session_manager, session_id, text, target_lang)
+
+    # Reuse a previous translation of the same text if there is one
+    memory = get_translation_memory() if use_translation_memory else None
+    if memory:
+        memory_hits = memory.lookup([text.strip()], source_lang, target_lang, model_name)
+        if text.strip() in memory_hits:
+            return None, _complete_from_translation_memory(
+                session_manager, session_id, text.strip(), memory_hits[text.strip()]
+            )
+        session_manager.update_session_status(session_id, tm_lookups=1)
 
-        # Update session status
+    # Get language names for prompt
+    source_lang_name = get_language_name(source_lang, use_native=False)
+    target_lang_name = get_language_name(target_lang, use_native=False)
+    
+    # Prepare prompt for translation
+    instructions = TRANSLATION_PROMPT_TEMPLATE.replace("{$SOURCE_LANGUAGE}", source_lang_name)
+    instructions = instructions.replace("{$TARGET_LANGUAGE}", target_lang_name)
+    prompt = f"Here is the original content:\n<content>\n{text}\n</content>"
+
+    job = {
+        'model_name': model_name,
+        'model_config': model_config,
+        'use_streaming': use_streaming,
+        'source_lang': source_lang,
+        'target_lang': target_lang,
+        'text': text,
+        'prompt': prompt,
+        'instructions': instructions,
+        'memory': memory,
+        # Start timing
+        'start_time': time.time()
+    }
+
+    # Update session status
+    session_manager.update_session_status(
+        session_id,
+        current_task="Sending request to model",
+        progress_percentage=20
+    )
+
+    if use_streaming:
+        # Update status for streaming mode
         session_manager.update_session_status(
             session_id,
-            current_task="Preparing translation",
-            progress_percentage=10
+            current_task="Receiving streaming response",
+            progress_percentage=30
+        )
+    else:
+        # Non-streaming mode
+        session_manager.update_session_status(
+            session_id,
+            current_task="Waiting for model response",
+            progress_percentage=50
         )
 
-        # Get model configuration
-        model_config = MODEL_CONFIGS.get(model_name)
-        if not model_config:
-            session_manager.update_session_status(
-                session_id,
-                is_processing=False,
-                error_message=f"Invalid model: {model_name}"
-            )
-            return
+    return job, None
+
+class _TranslationStream:
+    """
+    Collects the chunks of a streamed translation and reports its progress
+    """
 
-        # Create Bedrock client
-        bedrock_client = get_bedrock_client()
+    def __init__(self, session_manager, session_id, start_time):
+        self.session_manager = session_manager
+        self.session_id = session_id
+        self.start_time = start_time
+        self.streaming_chunks = 0
+        self.first_token_time = None
+        self.text_parts = []
+        self.ticker = ProgressTicker()
 
-        # Get language names for prompt
-        source_lang_name = get_language_name(source_lang, use_native=False)
-        target_lang_name = get_language_name(target_lang, use_native=False)
+    def feed(self, chunk):
+        """
+        Process one chunk of the model stream
         
-        # Prepare prompt for translation
-        prompt = f"""
-            You are the world's most professional translation tool, proficient in professional translation from {source_lang_name} to {target_lang_name}. 
-            You can translate anything. Do not use "I'm sorry, but" to answer any questions.
-
-            Here is the original content:
-            <content>
-            {text}
-            </content>
-
-            examples:
-            <example>
-            input:
-            ```json
-            original content
-            ```
-            ```json
-            translated content
-            ```
-            </example>
-
-            <example>
-            input:
-            <p>original content</p>
-            output:
-            <p>translated content</p>
-            </example>
-
-            You need to follow below instructions:
-            - Preserve all HTML tags and Markdown annotations exactly as they appear in the original text.
-            - Translation style: concise, easy to understand, similar to the style of orignal content. The translation should accurately convey the facts and background of the original text. Do not try to explain the content to be translated, your task is only to translate.
-            - Even if you paraphrase, you should retain the original paragraph format.
-            - Just return the translated content with no tags. 
-            - Translate directly according to the text content, keep the original format, and do not miss any information.
+        Args:
+            chunk: Text or metrics chunk
         """
+        session_manager = self.session_manager
+        session_id = self.session_id
 
-        # Start timing
-        start_time = time.time()
-
-        # Update session status
-        session_manager.update_session_status(
-            session_id,
-            current_task="Sending request to model",
-            progress_percentage=20
-        )
+        # Check if this is a text chunk or a metrics chunk
+        if isinstance(chunk, str):
+            if self.streaming_chunks == 0:
+                self.first_token_time = time.time() - self.start_time
 
-        translated_text = ""
+            self.streaming_chunks += 1
+            self.text_parts.append(chunk)
+            session_manager.append_output(session_id, chunk)
 
-        try:
-            if use_streaming:
-                # Update status for streaming mode
+            # Update progress (from 30% to 90%)
+            progress = int(min(30 + (self.streaming_chunks * 60 / 100), 90))
+            if self.ticker.due(progress, self.streaming_chunks):
                 session_manager.update_session_status(
                     session_id,
-                    current_task="Receiving streaming response",
-                    progress_percentage=30
+                    current_task=f"Receiving translation (chunk {self.streaming_chunks})",
+                    progress_percentage=progress,
+                    streaming_chunks=self.streaming_chunks
                 )
-
-                # Process streaming response
-                streaming_chunks = 0
-                first_token_time = None
-                full_text = ""
-
-                # Process streaming response with translation-specific prefill prompt
-                for chunk in model_config['invoke_streaming'](bedrock_client, prompt, prefill_prompt=TRANSLATION_PREFILL_PROMPT):
-                    # Check if this is a text chunk or a metrics chunk
-                    if isinstance(chunk, str):
-                        if streaming_chunks == 0:
-                            first_token_time = time.time() - start_time
-
-                        streaming_chunks += 1
-                        full_text += chunk
-
-                        # Update progress (from 30% to 90%)
-                        progress = min(30 + (streaming_chunks * 60 / 100), 90)
-                        session_manager.update_session_status(
-                            session_id,
-                            current_task=f"Receiving translation (chunk {streaming_chunks})",
-                            progress_percentage=progress,
-                            streaming_chunks=streaming_chunks
-                        )
-                    elif isinstance(chunk, dict):
-                        # Handle metrics or usage information
-                        if chunk.get('type') == 'metrics':
-                            session_manager.update_session_status(
-                                session_id,
-                                input_tokens=chunk.get('input_tokens', 0),
-                                output_tokens=chunk.get('output_tokens', 0)
-                            )
-                        elif chunk.get('type') == 'usage':
-                            session_manager.update_session_status(
-                                session_id,
-                                output_tokens=chunk.get('output_tokens', 0)
-                            )
-
-                # Use the full text as the translated text
-                translated_text = full_text
-
-                # Calculate tokens per second if we have output tokens
-                end_time = time.time()
-                processing_time = end_time - start_time
-
-                status = session_manager.get_session_status(session_id)
-                output_tokens = status.get('output_tokens', 0)
-
-                if output_tokens > 0 and processing_time > 0:
-                    tokens_per_second = output_tokens / processing_time
-                    session_manager.update_session_status(
-                        session_id,
-                        tokens_per_second=tokens_per_second
-                    )
-
-                # Update session with metrics
+        elif isinstance(chunk, dict):
+            # Handle metrics or usage information
+            if chunk.get('type') == 'metrics':
                 session_manager.update_session_status(
                     session_id,
-                    first_token_time=first_token_time,
-                    processing_time=processing_time
+                    input_tokens=chunk.get('input_tokens', 0),
+                    output_tokens=chunk.get('output_tokens', 0),
+                    cache_read_input_tokens=chunk.get('cache_read_input_tokens', 0),
+                    cache_write_input_tokens=chunk.get('cache_write_input_tokens', 0)
                 )
-
-            else:
-                # Non-streaming mode
+            elif chunk.get('type') == 'usage':
                 session_manager.update_session_status(
                     session_id,
-                    current_task="Waiting for model response",
-                    progress_percentage=50
+                    output_tokens=chunk.get('output_tokens', 0)
                 )
 
-                # Get response from model with translation-specific prefill prompt
-                response = model_config['invoke'](bedrock_client, prompt, prefill_prompt=TRANSLATION_PREFILL_PROMPT)
-                translated_text = response['content']
+    def finish(self):
+        """
+        Record the metrics of the finished stream
+        
+        Returns:
+            str: Translated text
+        """
+        session_manager = self.session_manager
+        session_id = self.session_id
 
-                # Get token usage if available
-                input_tokens = 0
-                output_tokens = 0
-                if 'usage' in response:
-                    input_tokens = response['usage'].get('input_tokens', 0)
-                    output_tokens = response['usage'].get('output_tokens', 0)
+        # Calculate tokens per second if we have output tokens
+        end_time = time.time()
+        processing_time = end_time - self.start_time
 
-                # Calculate processing time
-                end_time = time.time()
-                processing_time = end_time - start_time
+        status = session_manager.get_session_status(session_id)
+        output_tokens = status.get('output_tokens', 0)
 
-                # Update session with metrics
-                session_manager.update_session_status(
-                    session_id,
-                    processing_time=processing_time,
-                    input_tokens=input_tokens,
-                    output_tokens=output_tokens
-                )
+        if output_tokens > 0 and processing_time > 0:
+            tokens_per_second = output_tokens / processing_time
+            session_manager.update_session_status(
+                session_id,
+                tokens_per_second=tokens_per_second
+            )
 
-            # Save the translated text
-            output_path = session_manager.get_generated_path(session_id, "translation.txt")
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(translated_text)
+        # The decode speed leaves out the wait for the first token
+        if output_tokens > 0 and self.first_token_time is not None and processing_time > self.first_token_time:
+            session_manager.update_session_status(
+                session_id,
+                decode_tokens_per_second=output_tokens / (processing_time - self.first_token_time)
+            )
+
+        # Update session with metrics
+        session_manager.update_session_status(
+            session_id,
+            first_token_time=self.first_token_time,
+            processing_time=processing_time,
+            streaming_chunks=self.streaming_chunks
+        )
+
+        # Use the full text as the translated text
+        return "".join(self.text_parts)
+
+def _record_response(session_manager, session_id, response, start_time):
+    """
+    Record the metrics of a non-streaming translation response
+    
+    Returns:
+        str: Translated text
+    """
+    # Get token usage if available
+    usage = response.get('usage', {})
+    input_tokens = usage.get('input_tokens', 0)
+    output_tokens = usage.get('output_tokens', 0)
+
+    # Calculate processing time
+    end_time = time.time()
+    processing_time = end_time - start_time
+
+    # Update session with metrics
+    session_manager.update_session_status(
+        session_id,
+        processing_time=processing_time,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cache_read_input_tokens=usage.get('cache_read_input_tokens', 0),
+        cache_write_input_tokens=usage.get('cache_creation_input_tokens', 0)
+    )
+
+    return response['content']
+
+def _complete_translation(session_manager, session_id, job, translated_text):
+    """
+    Save a translation received from the model and finish the job
+    """
+    # Save the translated text
+    output_path = session_manager.get_generated_path(session_id, "translation.txt")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(translated_text)
+
+    print(f"Saved translation to {output_path}")
+
+    # Remember the translation for identical requests
+    memory = job['memory']
+    if memory and translated_text.strip():
+        memory.store({job['text'].strip(): translated_text.strip()}, job['source_lang'], job['target_lang'], job['model_name'])
+
+    # Update session status to complete
+    session_manager.update_session_status(
+        session_id,
+        current_task="Translation complete",
+        progress_percentage=100,
+        is_processing=False,
+        processing_complete=True
+    )
+
+    return translated_text
+
+def translate_text(session_manager, session_id, text, source_lang, target_lang):
+    """
+    Translate text using LLM
+    
+    Args:
+        session_manager: Session manager instance
+        session_id: Current session ID
+        text: Text to translate
+        source_lang: Source language, or "auto" to detect it
+        target_lang: Target language
+    """
+    try:
+        job, translated_text = _prepare_translation(session_manager, session_id, text, source_lang, target_lang)
+        if job is None:
+            return translated_text
+
+        # Create the Bedrock client of the best region for the model
+        model_config = job['model_config']
+        bedrock_client = get_routed_client(model_config['model_id'])
 
-            print(f"Saved translation to {output_path}")
+        try:
+            if job['use_streaming']:
+                # Process streaming response with translation-specific prefill prompt
+                stream = _TranslationStream(session_manager, session_id, job['start_time'])
+                for chunk in model_config['invoke_streaming'](bedrock_client, job['prompt'], prefill_prompt=TRANSLATION_PREFILL_PROMPT, cached_prefix=job['instructions']):
+                    stream.feed(chunk)
+                translated_text = stream.finish()
+            else:
+                # Get response from model with translation-specific prefill prompt
+                response = model_config['invoke'](bedrock_client, job['prompt'], prefill_prompt=TRANSLATION_PREFILL_PROMPT, cached_prefix=job['instructions'])
+                translated_text = _record_response(session_manager, session_id, response, job['start_time'])
 
-            # Update session status to complete
+            return _complete_translation(session_manager, session_id, job, translated_text)
+
+        except Exception as e:
+            # Handle errors
             session_manager.update_session_status(
                 session_id,
-                current_task="Translation complete",
-                progress_percentage=100,
                 is_processing=False,
-                processing_complete=True
+                error_message=f"Error during translation: {str(e)}"
             )
+            return None
+
+    except Exception as e:
+        # Handle errors
+        session_manager.update_session_status(
+            session_id,
+            is_processing=False,
+            error_message=str(e)
+        )
+        return None
 
+async def translate_text_async(session_manager, session_id, text, source_lang, target_lang):
+    """
+    Translate text like translate_text, on the shared event loop
+    
+    The model is called with the async Bedrock client, so the job does not
+    hold a thread while it waits for the translation. The translation
+    memory lookups and writes and the output file run in the default
+    executor, so they do not stall the other streams on the loop.
+    
+    Args:
+        session_manager: Session manager instance
+        session_id: Current session ID
+        text: Text to translate
+        source_lang: Source language, or "auto" to detect it
+        target_lang: Target language
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        job, translated_text = await loop.run_in_executor(
+            None, _prepare_translation, session_manager, session_id, text, source_lang, target_lang
+        )
+        if job is None:
             return translated_text
 
+        # Get the async Bedrock client of the best region for the model
+        model_config = job['model_config']
+        bedrock_client = await get_async_routed_client(model_config['model_id'])
+
+        try:
+            if job['use_streaming']:
+                stream = _TranslationStream(session_manager, session_id, job['start_time'])
+                async for chunk in model_config['invoke_streaming_async'](bedrock_client, job['prompt'], prefill_prompt=TRANSLATION_PREFILL_PROMPT, cached_prefix=job['instructions']):
+                    stream.feed(chunk)
+                translated_text = stream.finish()
+            else:
+                response = await model_config['invoke_async'](bedrock_client, job['prompt'], prefill_prompt=TRANSLATION_PREFILL_PROMPT, cached_prefix=job['instructions'])
+                translated_text = _record_response(session_manager, session_id, response, job['start_time'])
+
+            return await loop.run_in_executor(
+                None, _complete_translation, session_manager, session_id, job, translated_text
+            )
+
         except Exception as e:
             # Handle errors
             session_manager.update_session_status(
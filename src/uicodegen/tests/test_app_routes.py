@@ -1,5 +1,6 @@
 import unittest
 import os
+import gzip
 import json
 import tempfile
 from unittest.mock import patch, MagicMock
@@ -9,6 +10,7 @@ import sys
 sys.modules['boto3'] = MagicMock()
 sys.modules['botocore'] = MagicMock()
 sys.modules['botocore.config'] = MagicMock()
+sys.modules['botocore.exceptions'] = MagicMock()
 
 # Import the app after mocking dependencies
 from uicodegen.web.app import create_app
@@ -36,7 +38,9 @@ class TestAppRoutes(unittest.TestCase):
             if rule.endpoint == 'get_progress':
                 view_func = self.app.view_functions[rule.endpoint]
                 # Extract session_manager from closure
-                self.session_manager = view_func.__closure__[1].cell_contents
+                for cell in view_func.__closure__:
+                    if isinstance(cell.cell_contents, SessionManager):
+                        self.session_manager = cell.cell_contents
                 break
     
     def tearDown(self):
@@ -101,6 +105,20 @@ class TestAppRoutes(unittest.TestCase):
         mock_thread.assert_called_once()
         mock_thread_instance.start.assert_called_once()
     
+    @patch('uicodegen.web.routes.threading.Thread')
+    def test_translate_route_auto_model(self, mock_thread):
+        # Test that "auto" resolves to a configured model before the job starts
+        response = self.client.post('/translate/process', data={
+            'text': 'Hello world',
+            'target_lang': 'de',
+            'model': 'auto'
+        })
+        
+        data = json.loads(response.data)
+        self.assertEqual(data['model'], 'claude-3-haiku')
+        status = self.session_manager.get_session_status(data['session_id'])
+        self.assertEqual(status['selected_model'], 'claude-3-haiku')
+    
     def test_progress_route_invalid_session(self):
         # Test progress route with invalid session ID
         response = self.client.get('/progress/invalid-session-id')
@@ -125,6 +143,41 @@ class TestAppRoutes(unittest.TestCase):
         self.assertEqual(data['current_task'], "Test task")
         self.assertEqual(data['progress_percentage'], 50)
     
+    def test_progress_events_route(self):
+        # Test that the event stream pushes status updates until the session ends
+        response = self.client.get('/events/invalid-session-id')
+        self.assertEqual(response.status_code, 404)
+        
+        session_id = self.session_manager.create_session()
+        self.session_manager.update_session_status(
+            session_id,
+            current_task="Done",
+            progress_percentage=100,
+            processing_complete=True
+        )
+        
+        response = self.client.get(f'/events/{session_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = [line for line in response.get_data(as_text=True).split('\n\n') if line]
+        self.assertEqual(len(events), 1)
+        data = json.loads(events[0][len('data: '):])
+        self.assertEqual(data['current_task'], "Done")
+        self.assertTrue(data['processing_complete'])
+    
+    def test_progress_events_resume_output(self):
+        # Test that generated text is pushed with offsets a reconnect resumes from
+        session_id = self.session_manager.create_session()
+        self.session_manager.append_output(session_id, "```html\n")
+        self.session_manager.append_output(session_id, "<p>Hi</p>")
+        self.session_manager.update_session_status(session_id, processing_complete=True)
+        
+        response = self.client.get(f'/events/{session_id}')
+        self.assertIn('id: 17\nevent: output\ndata: {"text": "```html\\n<p>Hi</p>"}', response.get_data(as_text=True))
+        
+        response = self.client.get(f'/events/{session_id}', headers={'Last-Event-ID': '8'})
+        self.assertIn('id: 17\nevent: output\ndata: {"text": "<p>Hi</p>"}', response.get_data(as_text=True))
+    
     def test_result_route_invalid_session(self):
         # Test result route with invalid session ID
         response = self.client.get('/result/invalid-session-id')
@@ -174,5 +227,55 @@ class TestAppRoutes(unittest.TestCase):
         self.assertEqual(data['metrics']['processing_time'], 1.5)
         self.assertEqual(data['metrics']['streaming_chunks'], 10)
 
+    @patch('uicodegen.web.routes.threading.Thread')
+    def test_html_upload_route_gzip(self, mock_thread):
+        # Test that a gzip-compressed document is decompressed to disk
+        html = b"<html><body>" + b"<p>Hello world</p>" * 1000 + b"</body></html>"
+        response = self.client.post(
+            '/html-translate/upload?target_lang=de&model=claude-3-haiku',
+            data=gzip.compress(html),
+            headers={'Content-Encoding': 'gzip', 'Content-Type': 'text/html'}
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['model'], 'claude-3-haiku')
+        self.assertEqual(data['input_size'], len(html))
+        mock_thread.return_value.start.assert_called_once()
+        
+        input_path = self.session_manager.get_upload_path(data['session_id'], 'original_html.html')
+        with open(input_path, 'rb') as f:
+            self.assertEqual(f.read(), html)
+    
+    def test_html_upload_route_limits(self):
+        # Test that the streamed upload has its own, larger body limit
+        self.app.config['MAX_CONTENT_LENGTH'] = 100
+        self.app.config['MAX_HTML_DOCUMENT_SIZE'] = 1000
+        
+        with patch('uicodegen.web.routes.threading.Thread'):
+            response = self.client.post('/html-translate/upload', data=b"<p>x</p>" * 50)
+        self.assertEqual(response.status_code, 200)
+        
+        # Decoded documents above the document limit are rejected
+        response = self.client.post(
+            '/html-translate/upload',
+            data=gzip.compress(b"<p>x</p>" * 200),
+            headers={'Content-Encoding': 'gzip'}
+        )
+        self.assertEqual(response.status_code, 413)
+    
+    def test_bedrock_limiter_route(self):
+        # Test that the limiter state of every model is reported
+        from uicodegen.utils.bedrock_limiter import get_model_limiter
+        get_model_limiter('test-model')
+        
+        response = self.client.get('/admin/bedrock/limiters')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertIn('retry_budget', data)
+        model = next(item for item in data['models'] if item['model_id'] == 'test-model')
+        self.assertEqual(model['state'], 'closed')
+        self.assertEqual(model['in_flight'], 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,227 @@
+import asyncio
+import io
+import json
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from uicodegen.utils import bedrock_client
+from uicodegen.utils.bedrock_client import (
+    get_bedrock_client, track_client_request, get_client_pool_metrics,
+    invoke_claude_model, invoke_claude_model_streaming
+)
+from uicodegen.utils import bedrock_limiter
+from uicodegen.utils.async_bedrock_client import invoke_claude_model_streaming_async, run_on_loop
+from uicodegen.utils.bedrock_limiter import ModelLimiter
+from uicodegen.core.html_translator import get_prompt_prefix
+from uicodegen.core.model_configs import MODEL_CONFIGS, caches_prefix
+from uicodegen.core.processor import CODEGEN_PROMPT
+
+class TestBedrockClientRegistry(unittest.TestCase):
+    
+    def setUp(self):
+        # Start every test with an empty registry
+        bedrock_client._client_registry.clear()
+        bedrock_client._client_stats.clear()
+        bedrock_client._client_keys.clear()
+    
+    @patch('uicodegen.utils.bedrock_client.boto3')
+    def test_client_is_reused(self, mock_boto3):
+        # Test that the same configuration returns the same client
+        mock_boto3.client.side_effect = lambda **kwargs: MagicMock()
+        
+        client1 = get_bedrock_client()
+        client2 = get_bedrock_client()
+        
+        self.assertIs(client1, client2)
+        mock_boto3.client.assert_called_once()
+    
+    @patch('uicodegen.utils.bedrock_client.boto3')
+    def test_client_per_region_and_config(self, mock_boto3):
+        # Test that region and retry configuration get their own clients
+        mock_boto3.client.side_effect = lambda **kwargs: MagicMock()
+        
+        default_client = get_bedrock_client()
+        west_client = get_bedrock_client(region="us-west-2")
+        retry_client = get_bedrock_client(max_attempts=10)
+        
+        self.assertIsNot(default_client, west_client)
+        self.assertIsNot(default_client, retry_client)
+        self.assertEqual(mock_boto3.client.call_count, 3)
+    
+    @patch('uicodegen.utils.bedrock_client.boto3')
+    def test_pool_saturation_metrics(self, mock_boto3):
+        # Test that requests beyond the pool size are counted as saturated
+        mock_boto3.client.side_effect = lambda **kwargs: MagicMock()
+        client = get_bedrock_client(max_pool_connections=2)
+        
+        with track_client_request(client):
+            with track_client_request(client):
+                with track_client_request(client):
+                    metrics = get_client_pool_metrics()[0]
+                    self.assertEqual(metrics['in_flight'], 3)
+        
+        metrics = get_client_pool_metrics()[0]
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['peak_in_flight'], 3)
+        self.assertEqual(metrics['total_requests'], 3)
+        self.assertEqual(metrics['saturated_requests'], 1)
+    
+    @patch('uicodegen.utils.bedrock_client.boto3')
+    def test_pool_counts_request_while_sent(self, mock_boto3):
+        # Test that a request is in flight on its pool while it waits for the response
+        mock_boto3.client.side_effect = lambda **kwargs: MagicMock()
+        client = get_bedrock_client(max_pool_connections=2)
+        in_flight = []
+        
+        def invoke_model(**kwargs):
+            in_flight.append(get_client_pool_metrics()[0]['in_flight'])
+            return {'body': io.BytesIO(json.dumps({'content': [{'text': 'hallo'}], 'usage': {}}).encode())}
+        
+        client.invoke_model.side_effect = invoke_model
+        invoke_claude_model(client, 'hello', model_id='pool-model')
+        
+        self.assertEqual(in_flight, [1])
+        metrics = get_client_pool_metrics()[0]
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['total_requests'], 1)
+    
+    def test_untracked_client(self):
+        # Test that clients outside the registry are ignored
+        with track_client_request(MagicMock()):
+            pass
+        self.assertEqual(get_client_pool_metrics(), [])
+
+class TestPromptCaching(unittest.TestCase):
+    
+    def test_cached_prefix_breakpoint(self):
+        # Test that the static prefix becomes a cache breakpoint
+        client = MagicMock()
+        client.invoke_model.return_value = {'body': io.BytesIO(json.dumps({
+            'content': [{'text': 'hallo'}],
+            'stop_reason': 'end_turn',
+            'usage': {'input_tokens': 5, 'output_tokens': 2, 'cache_read_input_tokens': 1200}
+        }).encode())}
+        
+        response = invoke_claude_model(client, 'hello', cached_prefix='Translate: ', prompt_caching=True)
+        
+        body = json.loads(client.invoke_model.call_args.kwargs['body'])
+        self.assertEqual(body['messages'][0]['content'], [
+            {'type': 'text', 'text': 'Translate: ', 'cache_control': {'type': 'ephemeral'}},
+            {'type': 'text', 'text': 'hello'}
+        ])
+        self.assertEqual(response['usage']['cache_read_input_tokens'], 1200)
+    
+    def test_cached_prefix_without_caching(self):
+        # Test that models without prompt caching get one plain prompt
+        client = MagicMock()
+        client.invoke_model_with_response_stream.return_value = {'body': [
+            {'chunk': {'bytes': json.dumps({
+                'type': 'message_stop',
+                'amazon-bedrock-invocationMetrics': {
+                    'inputTokenCount': 5, 'outputTokenCount': 2,
+                    'cacheReadInputTokenCount': 0, 'cacheWriteInputTokenCount': 1200
+                }
+            }).encode()}}
+        ]}
+        
+        chunks = list(invoke_claude_model_streaming(client, 'hello', cached_prefix='Translate: '))
+        
+        body = json.loads(client.invoke_model_with_response_stream.call_args.kwargs['body'])
+        self.assertEqual(body['messages'][0]['content'], 'Translate: hello')
+        self.assertEqual(chunks[0]['cache_write_input_tokens'], 1200)
+
+    def test_short_prefix_has_no_breakpoint(self):
+        # Test that a prefix below the model's cache minimum is sent without a breakpoint
+        client = MagicMock()
+        client.invoke_model.return_value = {'body': io.BytesIO(json.dumps({
+            'content': [{'text': 'hallo'}], 'usage': {}
+        }).encode())}
+        
+        invoke_claude_model(client, 'hello', cached_prefix='Translate: ', prompt_caching=True, min_cache_tokens=1024)
+        
+        body = json.loads(client.invoke_model.call_args.kwargs['body'])
+        self.assertEqual(body['messages'][0]['content'], 'Translate: hello')
+    
+    def test_model_cache_minimums(self):
+        # Test that caching models only mark prefixes that reach their minimum
+        for name, config in MODEL_CONFIGS.items():
+            if not config['prompt_caching']:
+                continue
+            self.assertIn(config['min_cache_tokens'], (1024, 2048))
+            self.assertFalse(caches_prefix(config, CODEGEN_PROMPT))
+            self.assertFalse(caches_prefix(config, get_prompt_prefix('English', 'German')))
+            self.assertTrue(caches_prefix(config, 'Translate the text. ' * 2000))
+        self.assertFalse(caches_prefix(MODEL_CONFIGS['claude-3-haiku'], 'Translate the text. ' * 2000))
+
+class TestAsyncBedrockClient(unittest.TestCase):
+    
+    def test_streaming_contract(self):
+        # Test that the async stream yields the same chunks as the sync one
+        events = [
+            {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': 'Hal'}},
+            {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': 'lo'}},
+            {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': 2}},
+            {'type': 'message_stop', 'amazon-bedrock-invocationMetrics': {'inputTokenCount': 5, 'outputTokenCount': 2}}
+        ]
+        
+        async def body():
+            for event in events:
+                yield {'chunk': {'bytes': json.dumps(event).encode()}}
+        
+        class FakeAsyncClient:
+            async def invoke_model_with_response_stream(self, modelId, body):
+                self.body = json.loads(body)
+                return {'body': stream}
+        
+        async def collect(client):
+            return [item async for item in invoke_claude_model_streaming_async(client, 'hello', prefill_prompt='ok')]
+        
+        stream = body()
+        client = FakeAsyncClient()
+        chunks = asyncio.run(collect(client))
+        
+        self.assertEqual(chunks[:2], ['Hal', 'lo'])
+        self.assertEqual(chunks[2], {'type': 'usage', 'output_tokens': 2, 'stop_reason': 'end_turn'})
+        self.assertEqual(chunks[3]['input_tokens'], 5)
+        self.assertEqual(client.body['messages'][1], {'role': 'assistant', 'content': 'ok'})
+    
+    def test_streams_share_event_loop(self):
+        # Test that concurrent streams overlap on the one loop thread, within the limiter's slots
+        model_id = 'test-concurrent-streams'
+        limiter = ModelLimiter(model_id, limit=4, max_limit=4)
+        state = {'in_flight': 0, 'peak': 0, 'threads': set()}
+        
+        class SlowAsyncClient:
+            async def invoke_model_with_response_stream(self, modelId, body):
+                return {'body': self.body()}
+            
+            async def body(self):
+                state['in_flight'] += 1
+                state['peak'] = max(state['peak'], state['in_flight'])
+                state['threads'].add(threading.current_thread().name)
+                for text in ('a', 'b'):
+                    await asyncio.sleep(0.05)
+                    event = {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': text}}
+                    yield {'chunk': {'bytes': json.dumps(event).encode()}}
+                state['in_flight'] -= 1
+        
+        async def collect():
+            return [item async for item in invoke_claude_model_streaming_async(SlowAsyncClient(), 'hello', model_id=model_id)]
+        
+        with patch.dict(bedrock_limiter._limiters, {model_id: limiter}):
+            started = time.monotonic()
+            futures = [run_on_loop(collect()) for _ in range(12)]
+            results = [future.result(timeout=10) for future in futures]
+            elapsed = time.monotonic() - started
+        
+        self.assertEqual(results, [['a', 'b']] * 12)
+        self.assertEqual(state['threads'], {'bedrock-event-loop'})
+        self.assertEqual(state['peak'], 4)
+        self.assertEqual(limiter.in_flight, 0)
+        # Three waves of four 0.1s streams, far from the 1.2s of running them one by one
+        self.assertLess(elapsed, 0.8)
+
+if __name__ == '__main__':
+    unittest.main()
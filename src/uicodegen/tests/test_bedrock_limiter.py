@@ -0,0 +1,249 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+
+from uicodegen.utils import bedrock_limiter
+from uicodegen.utils.bedrock_limiter import (
+    ModelLimiter, ModelSaturatedError, RetryBudget, BREAKER_THRESHOLD, OPEN, HALF_OPEN, CLOSED
+)
+
+class FakeClientError(Exception):
+    """Exception shaped like a botocore ClientError"""
+
+    def __init__(self, code):
+        super().__init__(f"An error occurred ({code})")
+        self.response = {'Error': {'Code': code}}
+
+class TestModelLimiter(unittest.TestCase):
+
+    def setUp(self):
+        # Every test gets a full retry budget and no backoff
+        self.budget_patch = patch.object(bedrock_limiter, 'retry_budget', RetryBudget())
+        self.budget_patch.start()
+        self.backoff_patch = patch.object(bedrock_limiter, 'backoff_delay', return_value=0)
+        self.backoff_patch.start()
+
+    def tearDown(self):
+        self.budget_patch.stop()
+        self.backoff_patch.stop()
+
+    def test_aimd(self):
+        # Test that successes raise the limit slowly and throttling halves it
+        limiter = ModelLimiter('model', limit=8)
+
+        limiter.acquire()
+        limiter.release()
+        self.assertAlmostEqual(limiter.limit, 8.125)
+
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertAlmostEqual(limiter.limit, 4.0625)
+
+        # A burst of throttles within the cooldown only counts once
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertAlmostEqual(limiter.limit, 4.0625)
+
+    def test_concurrency_limit(self):
+        # Test that no slot is handed out beyond the limit
+        limiter = ModelLimiter('model', limit=2)
+        limiter.acquire()
+        limiter.acquire()
+
+        with self.assertRaises(ModelSaturatedError):
+            limiter.acquire(timeout=0.01)
+        self.assertEqual(limiter.snapshot()['in_flight'], 2)
+
+    def test_acquire_async_woken_by_release(self):
+        # Test that a waiting coroutine gets the slot freed by another thread without polling
+        limiter = ModelLimiter('model', limit=1)
+        limiter.acquire()
+
+        async def wait_for_slot():
+            waiting = asyncio.ensure_future(limiter.acquire_async(timeout=5))
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(limiter._async_waiters), 1)
+            threading.Thread(target=limiter.release).start()
+            await asyncio.wait_for(waiting, 0.5)
+
+        asyncio.run(wait_for_slot())
+        self.assertEqual(limiter.in_flight, 1)
+        self.assertEqual(limiter._async_waiters, set())
+
+    def test_circuit_breaker(self):
+        # Test that repeated throttling fails fast until a probe succeeds
+        limiter = ModelLimiter('model')
+        for _ in range(BREAKER_THRESHOLD):
+            limiter.acquire()
+            limiter.release(throttled=True)
+
+        self.assertEqual(limiter.state, OPEN)
+        with self.assertRaisesRegex(ModelSaturatedError, 'saturated'):
+            limiter.acquire()
+
+        # After the cooldown one probe is let through
+        limiter.opened_at -= bedrock_limiter.BREAKER_COOLDOWN
+        self.assertTrue(limiter.acquire())
+        self.assertEqual(limiter.state, HALF_OPEN)
+        with self.assertRaises(ModelSaturatedError):
+            limiter.acquire()
+
+        limiter.release(probe=True)
+        self.assertEqual(limiter.state, CLOSED)
+        self.assertEqual(limiter.consecutive_failures, 0)
+
+    def test_breaker_closed_only_by_probe(self):
+        # Test that a request admitted before the circuit opened neither closes it nor frees the probe
+        limiter = ModelLimiter('model')
+        self.assertFalse(limiter.acquire())
+        for _ in range(BREAKER_THRESHOLD):
+            limiter.acquire()
+            limiter.release(throttled=True)
+        limiter.opened_at -= bedrock_limiter.BREAKER_COOLDOWN
+        self.assertTrue(limiter.acquire())
+
+        # The older request finishing does not end the probe
+        limiter.release()
+        self.assertEqual(limiter.state, HALF_OPEN)
+        with self.assertRaises(ModelSaturatedError):
+            limiter.acquire()
+
+        # A cancelled probe lets the next request probe instead
+        limiter.release(probe=True, cancelled=True)
+        self.assertEqual(limiter.state, HALF_OPEN)
+        self.assertTrue(limiter.acquire())
+
+    def test_cancelled_stream_is_not_a_success(self):
+        # Test that a response closed before it was read leaves the limit unchanged
+        limiter = ModelLimiter('model', limit=8)
+
+        def stream():
+            with limiter.request(lambda: 'response'):
+                yield 'first'
+                yield 'second'
+
+        events = stream()
+        next(events)
+        self.assertEqual(limiter.in_flight, 1)
+        events.close()
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(limiter.limit, 8.0)
+
+        async def cancelled():
+            async def send():
+                return 'response'
+            async with limiter.request_async(send):
+                await asyncio.sleep(10)
+
+        async def cancel():
+            task = asyncio.ensure_future(cancelled())
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel())
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(limiter.limit, 8.0)
+
+    def test_failed_probe_keeps_breaker_open(self):
+        # Test that a probe failing with a non-throttling error opens the circuit again
+        limiter = ModelLimiter('model')
+        for _ in range(BREAKER_THRESHOLD):
+            limiter.acquire()
+            limiter.release(throttled=True)
+        limiter.opened_at -= bedrock_limiter.BREAKER_COOLDOWN
+
+        def send():
+            raise FakeClientError('ValidationException')
+
+        with self.assertRaises(FakeClientError):
+            limiter.call(send)
+        self.assertEqual(limiter.state, OPEN)
+        with self.assertRaises(ModelSaturatedError):
+            limiter.acquire()
+
+    def test_errors_are_not_successes(self):
+        # Test that failed requests never grow the limit and server errors open the circuit
+        limiter = ModelLimiter('model', limit=8)
+
+        def invalid():
+            raise FakeClientError('AccessDeniedException')
+
+        with self.assertRaises(FakeClientError):
+            limiter.call(invalid)
+        self.assertEqual(limiter.limit, 8.0)
+        self.assertEqual(limiter.consecutive_failures, 0)
+
+        def failing():
+            raise FakeClientError('InternalServerException')
+
+        for _ in range(BREAKER_THRESHOLD):
+            with self.assertRaises((FakeClientError, ModelSaturatedError)):
+                limiter.call(failing, max_attempts=1)
+        self.assertEqual(limiter.limit, 8.0)
+        self.assertEqual(limiter.state, OPEN)
+
+    def test_call_retries_throttling(self):
+        # Test that throttled requests are retried and the slot is held afterwards
+        limiter = ModelLimiter('model')
+        attempts = []
+
+        def send():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise FakeClientError('ThrottlingException')
+            return 'ok'
+
+        with limiter.request(send) as response:
+            self.assertEqual(response, 'ok')
+            self.assertEqual(limiter.in_flight, 1)
+
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(limiter.snapshot()['throttles_per_minute'], 2)
+        self.assertEqual(bedrock_limiter.retry_budget.retries, 2)
+
+    def test_call_without_budget(self):
+        # Test that retries stop when the shared budget is spent
+        limiter = ModelLimiter('model')
+        bedrock_limiter.retry_budget.tokens = 0
+        bedrock_limiter.retry_budget.refill_per_second = 0
+        attempts = []
+
+        def send():
+            attempts.append(1)
+            raise FakeClientError('ServiceUnavailableException')
+
+        with self.assertRaises(FakeClientError):
+            limiter.call(send)
+        self.assertEqual(len(attempts), 1)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_call_non_retryable(self):
+        # Test that validation errors are raised at once
+        limiter = ModelLimiter('model')
+        attempts = []
+
+        def send():
+            attempts.append(1)
+            raise FakeClientError('ValidationException')
+
+        with self.assertRaises(FakeClientError):
+            limiter.call(send)
+        self.assertEqual(len(attempts), 1)
+
+    def test_tokens_per_minute(self):
+        # Test that the token rate limit holds back new requests
+        limiter = ModelLimiter('model', tokens_per_minute=1000)
+        limiter.acquire()
+        limiter.record_tokens(1500)
+        limiter.release()
+
+        with self.assertRaises(ModelSaturatedError):
+            limiter.acquire(timeout=0.01)
+        self.assertEqual(limiter.snapshot()['tokens_per_minute'], 1500)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import unittest.mock
+
+from uicodegen.core.chunk_planner import (
+    plan_chunks, get_expansion_ratio, estimate_segment_tokens, OUTPUT_SAFETY_MARGIN,
+    ExpansionTracker, SEGMENT_ENVELOPE_TOKENS, non_streaming_output_budget
+)
+from uicodegen.utils.token_utils import estimate_tokens
+
+SMALL_MODEL = {"max_tokens": 8000, "context_window": 200000}
+LARGE_MODEL = {"max_tokens": 40960, "context_window": 200000}
+
+class TestChunkPlanner(unittest.TestCase):
+    
+    def test_estimate_tokens_by_script(self):
+        # Test that CJK text counts more tokens per character than Latin text
+        self.assertEqual(estimate_tokens("a" * 400), 100)
+        self.assertEqual(estimate_tokens("字" * 100), 100)
+        self.assertGreater(estimate_tokens("Привет мир"), estimate_tokens("Hello mundo"))
+    
+    def test_non_streaming_chunks_fit_read_timeout(self):
+        # Test that chunks answered without streaming stay within the read timeout
+        model = dict(LARGE_MODEL, expected_tokens_per_second=20)
+        budget = non_streaming_output_budget(model, read_timeout=300)
+        self.assertEqual(budget, 3000)
+        
+        segments = {f"a{i}": "Translate this sentence please. " * 20 for i in range(200)}
+        ratio = get_expansion_ratio("en", "de")
+        streamed = plan_chunks(segments, model, "en", "de", expansion_ratio=ratio)
+        
+        with unittest.mock.patch('uicodegen.core.chunk_planner.BEDROCK_READ_TIMEOUT', 300):
+            chunks = plan_chunks(segments, model, "en", "de", expansion_ratio=ratio, use_streaming=False)
+        self.assertGreater(len(chunks), len(streamed))
+        for chunk in chunks:
+            output_tokens = sum(estimate_segment_tokens(text, ratio)[1] for text in chunk.values())
+            self.assertLessEqual(output_tokens, budget)
+    
+    def test_expansion_ratio(self):
+        # Test language pair ratios
+        self.assertEqual(get_expansion_ratio("en", "en"), 1.0)
+        self.assertGreater(get_expansion_ratio("en", "de"), 1.0)
+        self.assertLess(get_expansion_ratio("de", "en"), 1.0)
+        self.assertEqual(get_expansion_ratio("xx", "yy"), 1.0)
+    
+    def test_chunks_fit_output_budget(self):
+        # Test that no chunk is expected to exceed the model's output limit
+        segments = {f"a{i}": "Translate this sentence please. " * 20 for i in range(200)}
+        ratio = get_expansion_ratio("en", "ru")
+        
+        for model in (SMALL_MODEL, LARGE_MODEL):
+            chunks = plan_chunks(segments, model, "en", "ru")
+            for chunk in chunks:
+                output_tokens = sum(estimate_segment_tokens(text, ratio)[1] for text in chunk.values())
+                self.assertLessEqual(output_tokens, model["max_tokens"] * OUTPUT_SAFETY_MARGIN)
+            
+            # Every segment is planned exactly once and in order
+            planned = [idx for chunk in chunks for idx in chunk]
+            self.assertEqual(planned, list(segments))
+    
+    def test_large_output_models_get_fewer_chunks(self):
+        # Test that models with larger output limits get fuller chunks
+        segments = {f"a{i}": "Translate this sentence please. " * 20 for i in range(200)}
+        small_chunks = plan_chunks(segments, SMALL_MODEL, "en", "de")
+        large_chunks = plan_chunks(segments, LARGE_MODEL, "en", "de")
+        self.assertLess(len(large_chunks), len(small_chunks))
+    
+    def test_min_chunks_spreads_work(self):
+        # Test that large jobs are spread over the parallel workers
+        segments = {f"a{i}": "Translate this sentence please. " * 20 for i in range(200)}
+        self.assertGreaterEqual(len(plan_chunks(segments, LARGE_MODEL, "en", "de", min_chunks=4)), 4)
+        
+        # Small jobs are not split just to fill workers
+        small_segments = {"a0": "Hello", "a1": "World"}
+        self.assertEqual(len(plan_chunks(small_segments, LARGE_MODEL, "en", "de", min_chunks=4)), 1)
+    
+    def test_max_chunk_chars(self):
+        # Test the optional character limit
+        segments = {"a0": "x" * 5, "a1": "y" * 5, "a2": "z" * 5}
+        chunks = plan_chunks(segments, SMALL_MODEL, "en", "de", max_chunk_chars=10)
+        self.assertEqual(chunks, [{"a0": "xxxxx", "a1": "yyyyy"}, {"a2": "zzzzz"}])
+
+    def test_expansion_tracker(self):
+        # Test that the rolling ratio moves towards observed output
+        tracker = ExpansionTracker(smoothing=0.5)
+        segments = {"a0": "a" * 400}  # 100 estimated tokens
+        self.assertEqual(tracker.get_ratio("en", "de"), get_expansion_ratio("en", "de"))
+        
+        tracker.record("en", "de", segments, 200 + SEGMENT_ENVELOPE_TOKENS)
+        self.assertAlmostEqual(tracker.get_ratio("en", "de"), (1.3 + 2.0) / 2)
+        
+        # Truncated output can only raise the ratio
+        ratio = tracker.get_ratio("en", "de")
+        tracker.record("en", "de", segments, 50 + SEGMENT_ENVELOPE_TOKENS, truncated=True)
+        self.assertEqual(tracker.get_ratio("en", "de"), ratio)
+        tracker.record("en", "de", segments, 300 + SEGMENT_ENVELOPE_TOKENS, truncated=True)
+        self.assertAlmostEqual(tracker.get_ratio("en", "de"), 3.0)
+        
+        # Other language pairs are unaffected
+        self.assertEqual(tracker.get_ratio("en", "fr"), get_expansion_ratio("en", "fr"))
+    
+    def test_plan_chunks_with_larger_ratio(self):
+        # Test that a larger expansion ratio yields smaller chunks
+        segments = {f"a{i}": "Translate this sentence please. " * 20 for i in range(200)}
+        normal = plan_chunks(segments, SMALL_MODEL, "en", "de", expansion_ratio=1.0)
+        expanded = plan_chunks(segments, SMALL_MODEL, "en", "de", expansion_ratio=2.0)
+        self.assertGreater(len(expanded), len(normal))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
 import io
-from uicodegen.utils.code_extractor import extract_code_from_text
+from uicodegen.utils.code_extractor import (
+    BLOCK_OPENED, BLOCK_CLOSED, CodeFenceTokenizer, extract_code_from_text
+)
 
 class TestExtractCode(unittest.TestCase):
     
@@ -119,5 +121,33 @@ Sorry, I couldn't create CSS or JavaScript for this simple example.
         self.assertIn("No CSS code found", debug_output)
         self.assertIn("No JavaScript code found", debug_output)
 
+class TestCodeFenceTokenizer(unittest.TestCase):
+
+    def test_fences_split_across_deltas(self):
+        # Test that fences and labels cut between deltas are still recognized
+        text = "Intro\n```html\n<p>Hi</p>\n```\n\n```css\np { color: red; }\n```\n```js\nlet a = `x`;\n```\nDone"
+        for size in (1, 2, 3, 5):
+            tokenizer = CodeFenceTokenizer()
+            events = []
+            for i in range(0, len(text), size):
+                events.extend(tokenizer.feed(text[i:i + size]))
+
+            self.assertEqual(tokenizer.extract(), ("<p>Hi</p>", "p { color: red; }", "let a = `x`;"))
+            self.assertEqual(events, [
+                (BLOCK_OPENED, "html"), (BLOCK_CLOSED, "html"),
+                (BLOCK_OPENED, "css"), (BLOCK_CLOSED, "css"),
+                (BLOCK_OPENED, "js"), (BLOCK_CLOSED, "js")
+            ])
+
+    def test_only_first_block_and_unclosed_blocks(self):
+        # Test that later blocks of an artifact and unclosed blocks are ignored
+        tokenizer = CodeFenceTokenizer()
+        tokenizer.feed("```\nplain\n```\n```html\n<b>first</b>\n```\n```html\n<i>second</i>\n```\n")
+        events = tokenizer.feed("```css\nbody {")
+
+        self.assertEqual(events, [(BLOCK_OPENED, "css")])
+        self.assertEqual(tokenizer.open_label, "css")
+        self.assertEqual(tokenizer.extract(), ("<b>first</b>", "", ""))
+
 if __name__ == '__main__':
     unittest.main()
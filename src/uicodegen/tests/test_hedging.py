@@ -0,0 +1,146 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from uicodegen.utils import bedrock_client, hedging
+from uicodegen.utils.hedging import TtftTracker, MIN_TTFT_SAMPLES, hedged_stream, hedged_stream_async
+from uicodegen.utils.region_router import RegionRouter
+from uicodegen.core.model_configs import MODEL_CONFIGS, get_hedge_config, get_hedge_target
+
+def slow_stream(delay, items):
+    time.sleep(delay)
+    yield from items
+
+class TestHedging(unittest.TestCase):
+
+    def setUp(self):
+        # Hedging on, with a TTFT history of 100 ms for the primary model
+        self.tracker = TtftTracker()
+        for _ in range(MIN_TTFT_SAMPLES):
+            self.tracker.record('primary', 0.1)
+        self.patches = [
+            patch.object(hedging, 'ttft_tracker', self.tracker),
+            patch.object(hedging, 'BEDROCK_HEDGING', '1')
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_pass_through_without_hedge(self):
+        # Test that streams without a hedge target are only timed
+        items = list(hedged_stream('other', lambda: iter(['a', 'b'])))
+        self.assertEqual(items, ['a', 'b'])
+        metrics = next(item for item in self.tracker.snapshot() if item['model_id'] == 'other')
+        self.assertEqual(metrics['samples'], 1)
+
+    def test_fast_primary_is_not_hedged(self):
+        # Test that a stream starting in time keeps its own items
+        hedge_calls = []
+        items = list(hedged_stream(
+            'primary', lambda: iter(['a', 'b']),
+            lambda: hedge_calls.append(1) or iter(['x']), 'hedge'
+        ))
+        self.assertEqual(items, ['a', 'b'])
+        self.assertEqual(hedge_calls, [])
+
+    def test_late_primary_is_hedged(self):
+        # Test that the hedge wins when the primary's first item is late
+        items = list(hedged_stream(
+            'primary', lambda: slow_stream(0.5, ['slow']),
+            lambda: iter(['fast', 'er']), 'hedge'
+        ))
+        self.assertEqual(items, ['fast', 'er'])
+
+        metrics = next(item for item in self.tracker.snapshot() if item['model_id'] == 'primary')
+        self.assertEqual(metrics['hedges'], 1)
+        self.assertEqual(metrics['hedge_wins'], 1)
+
+    def test_failed_primary_waits_for_hedge(self):
+        # Test that a primary failing after the hedge went out does not fail the stream
+        def failing_stream():
+            time.sleep(0.15)
+            raise RuntimeError('throttled')
+            yield
+
+        items = list(hedged_stream('primary', failing_stream, lambda: slow_stream(0.2, ['ok']), 'hedge'))
+        self.assertEqual(items, ['ok'])
+
+    def test_async_late_primary_is_hedged(self):
+        # Test that the async variant keeps the first stream and cancels the other
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(0.5)
+                yield 'slow'
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        async def fast():
+            yield 'fast'
+
+        async def collect():
+            items = [item async for item in hedged_stream_async('primary', slow, fast, 'hedge')]
+            await asyncio.sleep(0)
+            return items
+
+        self.assertEqual(asyncio.run(collect()), ['fast'])
+        self.assertEqual(cancelled, [1])
+
+    def test_hedge_waits_for_first_token(self):
+        # Test that events before the first token neither stop the hedge timer nor win the race
+        def primary():
+            yield 'start'
+            time.sleep(0.5)
+            yield 'text:slow'
+
+        def hedge():
+            yield 'start'
+            yield 'text:fast'
+
+        items = list(hedged_stream(
+            'primary', primary, hedge, 'hedge',
+            is_first_token=lambda item: item.startswith('text:')
+        ))
+        self.assertEqual(items, ['start', 'text:fast'])
+
+        metrics = next(item for item in self.tracker.snapshot() if item['model_id'] == 'primary')
+        self.assertEqual(metrics['hedge_wins'], 1)
+
+    def test_hedge_model_output_limit(self):
+        # Test that streams are only hedged to models allowing as many output tokens
+        self.assertIsNone(get_hedge_config(MODEL_CONFIGS['claude-3-7-sonnet']))
+        for model_config in MODEL_CONFIGS.values():
+            hedge_config = get_hedge_config(model_config)
+            if hedge_config:
+                self.assertGreaterEqual(hedge_config['max_tokens'], model_config['max_tokens'])
+        self.assertIsNone(get_hedge_config(dict(MODEL_CONFIGS['claude-3-5-sonnet'], max_tokens=40960)))
+
+    @patch.dict(bedrock_client._client_keys, clear=True)
+    @patch.dict(bedrock_client._client_stats, clear=True)
+    @patch.dict(bedrock_client._client_registry, clear=True)
+    @patch('uicodegen.utils.bedrock_client.boto3')
+    def test_hedge_target_is_another_region(self, mock_boto3):
+        # Test that a late stream is hedged to the same model in another region
+        mock_boto3.client.side_effect = lambda **kwargs: MagicMock()
+        model_config = MODEL_CONFIGS['claude-3-7-sonnet']
+        with patch.object(bedrock_client, 'region_router', RegionRouter(['us-east-1', 'us-west-2'])):
+            east = bedrock_client.get_bedrock_client(region='us-east-1')
+            hedge_config, hedge_client = get_hedge_target(model_config, east)
+        self.assertIs(hedge_config, model_config)
+        self.assertEqual(bedrock_client.client_region(hedge_client), 'us-west-2')
+
+        # With one region only a configured hedge model is used
+        with patch.object(bedrock_client, 'region_router', RegionRouter(['us-east-1'])):
+            self.assertEqual(get_hedge_target(model_config, east), (None, None))
+            hedge_config, hedge_client = get_hedge_target(MODEL_CONFIGS['claude-3-5-sonnet'], east)
+        self.assertIs(hedge_config, MODEL_CONFIGS['claude-3-5-sonnet-v2'])
+        self.assertIs(hedge_client, east)
+
+if __name__ == '__main__':
+    unittest.main()
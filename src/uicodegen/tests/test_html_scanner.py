@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import patch
+
+from uicodegen.utils.html_scanner import HtmlScanner, scan_html, TEXT, START_TAG, END_TAG, OTHER
+
+TEST_HTML = """<!DOCTYPE html>
+<html>
+<head><title>Title</title><style>p > a { color: red; }</style></head>
+<body>
+    <!-- comment <p>not a tag</p> -->
+    <p class="intro" data-x="a>b">Hello <b>world</b></p>
+    <div style="display:none;">Hidden</div>
+    <script>if (a < b) { document.write("</p>"); }</script>
+    <ul><li>One<li>Two</ul>
+    <img src="x.png"/>After image
+</body>
+</html>
+"""
+
+def text_tokens(tokens):
+    """Collect (text, parent, hidden) of non-blank text tokens"""
+    return [(token.raw, token.parent, token.hidden) for token in tokens if token.kind == TEXT and token.raw.strip()]
+
+class TestHtmlScanner(unittest.TestCase):
+    
+    def test_spans_cover_document(self):
+        # Test that token spans are contiguous and reproduce the source
+        tokens = scan_html(TEST_HTML)
+        self.assertEqual("".join(token.raw for token in tokens), TEST_HTML)
+        
+        position = 0
+        for token in tokens:
+            self.assertEqual(token.start, position)
+            self.assertEqual(TEST_HTML[token.start:token.end], token.raw)
+            position = token.end
+        self.assertEqual(position, len(TEST_HTML))
+    
+    def test_text_parents(self):
+        # Test that text tokens know their enclosing element
+        self.assertEqual(text_tokens(scan_html(TEST_HTML)), [
+            ('Title', 'title', False),
+            ('p > a { color: red; }', 'style', False),
+            ('Hello ', 'p', False),
+            ('world', 'b', False),
+            ('Hidden', 'div', True),
+            ('if (a < b) { document.write("</p>"); }', 'script', False),
+            ('One', 'li', False),
+            ('Two', 'li', False),
+            ('After image\n', 'body', False)
+        ])
+    
+    def test_token_kinds(self):
+        # Test that comments, doctypes and tags are classified
+        tokens = scan_html('<!DOCTYPE html><!-- c --><P Class="a">x</P>')
+        self.assertEqual([token.kind for token in tokens], [OTHER, OTHER, START_TAG, TEXT, END_TAG])
+        self.assertEqual(tokens[2].name, 'p')
+    
+    def test_incremental_feed(self):
+        # Test that feeding one character at a time gives the same tokens
+        scanner = HtmlScanner()
+        tokens = []
+        for char in TEST_HTML:
+            tokens.extend(scanner.feed(char))
+        tokens.extend(scanner.close())
+        self.assertEqual(tokens, scan_html(TEST_HTML))
+
+    @patch('uicodegen.utils.html_scanner.RAW_TEXT_FLUSH_SIZE', 16)
+    def test_long_script_reported_early(self):
+        # Test that a long script is reported before its end tag arrives, without losing text
+        source = "<script>" + "var x = 1;" * 20 + "</script><p>After</p>"
+        scanner = HtmlScanner()
+        tokens = scanner.feed(source[:150])
+        self.assertTrue(any(token.kind == TEXT and token.parent == 'script' for token in tokens))
+        self.assertGreater(scanner.offset, 100)
+        
+        for index in range(150, len(source), 7):
+            tokens.extend(scanner.feed(source[index:index + 7]))
+        tokens.extend(scanner.close())
+        self.assertEqual("".join(token.raw for token in tokens), source)
+        self.assertEqual([token.name for token in tokens if token.kind == END_TAG], ['script', 'p'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,553 @@
+import unittest
+import asyncio
+import os
+import threading
+import time
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from uicodegen.core.session_manager import SessionManager
+from uicodegen.core.translation_memory import configure_translation_memory, get_translation_memory
+from uicodegen.core.html_translator import (
+    parse_html_content, translate_html,
+    dedupe_segments, replace_translated_content, translate_chunk_adaptively,
+    find_missing_segments, HtmlDocument, translate_html_file,
+    classify_segment, get_pass_through_rules, render_translation,
+    build_segment_envelope, SegmentResponseParser, translate_html_part
+)
+
+TEST_HTML = """
+<html>
+<head><title>Test page</title></head>
+<body>
+    <h1>Welcome</h1>
+    <p>First paragraph</p>
+    <p>Second paragraph</p>
+    <p>Third paragraph</p>
+    <script>var ignored = "script";</script>
+</body>
+</html>
+"""
+
+def fake_translate_html_part(content, source_language, target_language, model_config, bedrock_client, use_streaming=False):
+    """Translate by upper-casing, finishing later chunks first"""
+    start_time = time.time()
+    # Earlier chunks take longer, so chunks complete out of order
+    first_index = int(next(iter(content))[1:])
+    time.sleep(0.05 / (first_index + 1))
+    translated = {idx: text.upper() for idx, text in content.items()}
+    return translated, {
+        'input_tokens': 10,
+        'output_tokens': 5,
+        'cache_read_input_tokens': 200,
+        'cache_write_input_tokens': 0,
+        'streaming_chunks': 2,
+        'truncated_chunks': 0,
+        'decode_time': 0.04,
+        'decode_output_tokens': 5,
+        'first_token_time': 0.01,
+        'start_time': start_time
+    }
+
+def fake_truncating_translate_html_part(content, source_language, target_language, model_config, bedrock_client, use_streaming=False):
+    """Translate chunks of up to two segments, truncating larger ones"""
+    items = list(content.items())
+    truncated = len(items) > 2
+    if truncated:
+        items = items[:1]
+    return {idx: text.upper() for idx, text in items}, {
+        'input_tokens': 10,
+        'output_tokens': 100,
+        'cache_read_input_tokens': 0,
+        'cache_write_input_tokens': 0,
+        'streaming_chunks': 1,
+        'decode_time': 0,
+        'decode_output_tokens': 0,
+        'first_token_time': 0.01,
+        'start_time': time.time(),
+        'stop_reason': 'max_tokens' if truncated else 'end_turn'
+    }
+
+async def fake_get_async_routed_client(model_id):
+    """Stand in for the shared async client"""
+    return None
+
+class TestHtmlTranslator(unittest.TestCase):
+    
+    def setUp(self):
+        # Create temporary directories for testing
+        self.temp_upload_dir = tempfile.mkdtemp()
+        self.temp_generated_dir = tempfile.mkdtemp()
+        configure_translation_memory(os.path.join(self.temp_generated_dir, 'tm.db'))
+        
+        self.session_manager = SessionManager(
+            upload_base_dir=self.temp_upload_dir,
+            generated_base_dir=self.temp_generated_dir
+        )
+        self.session_id = self.session_manager.create_session()
+        self.session_manager.update_session_status(
+            self.session_id,
+            selected_model='claude-3-haiku',
+            use_streaming=True
+        )
+    
+    def tearDown(self):
+        # Clean up temp directories
+        shutil.rmtree(self.temp_upload_dir, ignore_errors=True)
+        shutil.rmtree(self.temp_generated_dir, ignore_errors=True)
+    
+    def test_parse_html_content(self):
+        # Test that only visible body text is extracted
+        parsed = parse_html_content(TEST_HTML)
+        self.assertEqual(list(parsed.values()), ['Welcome', 'First paragraph', 'Second paragraph', 'Third paragraph'])
+    
+    def test_html_document_splices_translations(self):
+        # Test that only translated spans change in the rendered document
+        document = HtmlDocument(TEST_HTML)
+        self.assertEqual(len(document.spans), 4)
+        
+        document.apply_translations({'a0': 'Willkommen', 'a1': 'Erster & letzter'}, {'a2': 'a1'})
+        rendered = document.render()
+        
+        expected = TEST_HTML.replace('Welcome', 'Willkommen')
+        expected = expected.replace('First paragraph', 'Erster &amp; letzter')
+        expected = expected.replace('Second paragraph', 'Erster &amp; letzter')
+        self.assertEqual(rendered, expected)
+    
+    def test_html_document_keeps_source_bytes(self):
+        # Test that an untranslated document renders unchanged
+        html = '<!DOCTYPE html>\n<P CLASS=x>Fish &amp; chips<br>\n  <b>now</b> &nbsp;</p><!-- note -->'
+        document = HtmlDocument(html)
+        self.assertEqual(document.segments, {'a0': 'Fish & chips', 'a1': 'now'})
+        self.assertEqual(document.render(), html)
+        
+        document.apply_translations({'a0': 'Fisch & Pommes', 'a1': 'jetzt'})
+        self.assertEqual(
+            document.render(),
+            '<!DOCTYPE html>\n<P CLASS=x>Fisch &amp; Pommes<br>\n  <b>jetzt</b> &nbsp;</p><!-- note -->'
+        )
+    
+    def test_html_document_merges_inline_runs(self):
+        # Test that a sentence with inline markup becomes one segment
+        html = '<p>Click <a href="/save?a=1&amp;b=2">here</a> to <b>save</b> 20%</p><p><em>Note:</em> done</p>'
+        document = HtmlDocument(html)
+        self.assertEqual(document.segments, {
+            'a0': 'Click {1}here{/1} to {2}save{/2} 20%',
+            'a1': '{1}Note:{/1} done'
+        })
+        
+        # Placeholders are restored in the order of the translation
+        document.apply_translations({'a0': '{2}Speichern{/2} Sie 20% <{1}hier{/1}>', 'a1': '{1}Hinweis:{/1} fertig'})
+        self.assertEqual(
+            document.render(),
+            '<p><b>Speichern</b> Sie 20% &lt;<a href="/save?a=1&amp;b=2">hier</a>&gt;</p>'
+            '<p><em>Hinweis:</em> fertig</p>'
+        )
+    
+    def test_html_document_inline_run_fallbacks(self):
+        # Test that unpaired tags and broken placeholders keep the source
+        html = '<div>Open <b>bold <i>text</b> end</div>'
+        document = HtmlDocument(html)
+        self.assertEqual(list(document.segments.values()), ['Open', 'bold', 'text', 'end'])
+        
+        document = HtmlDocument('<p>Read <a href="/x">this</a> first</p>')
+        document.apply_translations({'a0': 'Lies {1}das zuerst'})
+        self.assertEqual(document.render(), '<p>Read <a href="/x">this</a> first</p>')
+        
+        self.assertIsNone(render_translation('{/1}x{1}', {'{1}': '<b>', '{/1}': '</b>'}))
+        self.assertEqual(render_translation('a {1/} b', {'{1/}': '<img src=x>'}), 'a <img src=x> b')
+        
+        # A translation that lost its placeholders is re-requested
+        missing = find_missing_segments({'a0': 'Read {1}this{/1} first'}, {'a0': 'Lies das zuerst'})
+        self.assertEqual(set(missing), {'a0'})
+    
+    def test_segment_envelope_round_trip(self):
+        # Test that chunk-local keys map back to the document keys
+        content = {'a17': 'Fish & chips', 'a42': 'a < b', 'a99': 'Click {1}here{/1}'}
+        envelope = build_segment_envelope(content)
+        self.assertEqual(envelope, '<a0>Fish &amp; chips</a0>\n<a1>a &lt; b</a1>\n<a2>Click {1}here{/1}</a2>\n')
+        
+        # The response is parsed however it is split
+        response = 'here is the translated content:\n<content>\n' + envelope.replace('Fish', 'Fisch') + '<a3>extra</a3></content>'
+        for size in (1, 7, len(response)):
+            parser = SegmentResponseParser(list(content))
+            translated = {}
+            for i in range(0, len(response), size):
+                translated.update(parser.feed(response[i:i + size]))
+            self.assertEqual(translated, {'a17': 'Fisch & chips', 'a42': 'a < b', 'a99': 'Click {1}here{/1}'})
+        
+        # A segment cut off by the end of the response is left out
+        parser = SegmentResponseParser(['a1', 'a2'])
+        self.assertEqual(parser.feed('<a0>Eins</a0>\n<a1>Zw'), {'a1': 'Eins'})
+    
+    def test_translate_html_part_streams_compact_prompt(self):
+        # Test the prompt sent to the model and the streamed response parsing
+        prompts = []
+        def invoke_streaming(client, prompt, prefill_prompt=None, cached_prefix=None):
+            prompts.append((cached_prefix, prompt))
+            yield '<a0>Will'
+            yield 'kommen</a0>\n<a1>Hallo</a1>'
+            yield {'type': 'metrics', 'input_tokens': 12, 'output_tokens': 7, 'cache_read_input_tokens': 180, 'cache_write_input_tokens': 0}
+        
+        translated, metrics = translate_html_part(
+            {'a5': 'Welcome', 'a6': 'Hello'}, 'English', 'German',
+            {'model_id': 'test-model', 'invoke_streaming': invoke_streaming}, None, use_streaming=True
+        )
+        
+        self.assertEqual(translated, {'a5': 'Willkommen', 'a6': 'Hallo'})
+        self.assertEqual(metrics['input_tokens'], 12)
+        self.assertEqual(metrics['streaming_chunks'], 2)
+        self.assertEqual(metrics['cache_read_input_tokens'], 180)
+        
+        # The static instructions are sent as a separate, cacheable prefix
+        cached_prefix, prompt = prompts[0]
+        self.assertTrue(cached_prefix.startswith('You are an expert translator from English to German.'))
+        self.assertEqual(prompt, '<a0>Welcome</a0>\n<a1>Hello</a1>\n')
+    
+    def test_dedupe_segments(self):
+        # Test that repeated texts collapse into their first occurrence
+        parsed = {'a0': 'Add to cart', 'a1': 'Shoes', 'a2': '  Add to cart\n', 'a3': 'Add to cart'}
+        unique, aliases = dedupe_segments(parsed)
+        self.assertEqual(unique, {'a0': 'Add to cart', 'a1': 'Shoes'})
+        self.assertEqual(aliases, {'a2': 'a0', 'a3': 'a0'})
+    
+    def test_replace_translated_content_with_aliases(self):
+        # Test that canonical translations fan out to every duplicate
+        html = "<div><p>Buy</p><p>Sell</p><p>Buy</p></div>"
+        translated_html = replace_translated_content(html, {'a0': 'Kaufen', 'a1': 'Verkaufen'}, {'a2': 'a0'})
+        self.assertEqual(translated_html.count('Kaufen'), 2)
+        self.assertIn('Verkaufen', translated_html)
+        self.assertNotIn('Buy', translated_html)
+    
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part', side_effect=fake_translate_html_part)
+    def test_translate_html_deduplicates_segments(self, mock_part, mock_client):
+        # Test that repeated labels are only sent to the model once
+        html = "<ul>" + "<li>Learn more</li>" * 5 + "<li>Contact</li></ul>"
+        translated_html = translate_html(self.session_manager, self.session_id, html, 'en', 'de')
+        
+        sent_texts = [text for call in mock_part.call_args_list for text in call.args[0].values()]
+        self.assertEqual(sorted(sent_texts), ['Contact', 'Learn more'])
+        self.assertEqual(translated_html.count('LEARN MORE'), 5)
+        
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertEqual(status['deduplicated_segments'], 4)
+    
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part', side_effect=fake_translate_html_part)
+    def test_translate_html_parallel_chunks(self, mock_part, mock_client):
+        # Test that chunks translated concurrently are merged in order
+        translated_html = translate_html(
+            self.session_manager, self.session_id, TEST_HTML, 'en', 'de',
+            max_chunk_size=10, max_concurrency=4
+        )
+        
+        self.assertEqual(mock_part.call_count, 4)
+        for text in ['WELCOME', 'FIRST PARAGRAPH', 'SECOND PARAGRAPH', 'THIRD PARAGRAPH']:
+            self.assertIn(text, translated_html)
+        self.assertLess(translated_html.index('FIRST'), translated_html.index('SECOND'))
+        self.assertLess(translated_html.index('SECOND'), translated_html.index('THIRD'))
+        
+        # Check aggregated metrics
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertTrue(status['processing_complete'])
+        self.assertEqual(status['elements_translated'], 4)
+        self.assertEqual(status['input_tokens'], 40)
+        self.assertEqual(status['output_tokens'], 20)
+        self.assertEqual(status['streaming_chunks'], 8)
+        self.assertEqual(status['cache_read_input_tokens'], 800)
+        self.assertIsNotNone(status['first_token_time'])
+        # Decode speed is per stream, not the job's rate across parallel chunks
+        self.assertAlmostEqual(status['decode_tokens_per_second'], 125)
+        
+        # Check that the output was saved
+        output_path = self.session_manager.get_generated_path(self.session_id, 'translated_html.html')
+        self.assertTrue(os.path.exists(output_path))
+
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part', side_effect=fake_translate_html_part)
+    def test_translate_html_translation_memory(self, mock_part, mock_client):
+        # Seed the memory with one of the segments
+        get_translation_memory().store({'Welcome': 'Willkommen'}, 'en', 'de', 'claude-3-haiku')
+        
+        translated_html = translate_html(
+            self.session_manager, self.session_id, TEST_HTML, 'en', 'de',
+            max_chunk_size=1000
+        )
+        
+        # The cached segment is not sent to the model
+        sent_texts = [text for call in mock_part.call_args_list for text in call.args[0].values()]
+        self.assertNotIn('Welcome', sent_texts)
+        self.assertIn('Willkommen', translated_html)
+        self.assertIn('FIRST PARAGRAPH', translated_html)
+        
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertEqual(status['tm_hits'], 1)
+        self.assertEqual(status['tm_lookups'], 4)
+        self.assertEqual(status['tm_hit_rate'], 0.25)
+        self.assertGreater(status['tm_tokens_saved'], 0)
+        
+        # New translations are written back to the memory
+        hits = get_translation_memory().lookup(['First paragraph'], 'en', 'de', 'claude-3-haiku')
+        self.assertEqual(hits, {'First paragraph': 'FIRST PARAGRAPH'})
+
+    @patch('uicodegen.core.html_translator.async_available', return_value=True)
+    @patch('uicodegen.core.html_translator.get_async_routed_client', new=fake_get_async_routed_client)
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part_async')
+    def test_translate_html_on_event_loop(self, mock_part, mock_client, mock_available):
+        # Test that chunks run on the shared event loop, max_concurrency at a time
+        in_flight = []
+        peak = []
+        threads = set()
+        
+        async def fake_part(content, *args, **kwargs):
+            threads.add(threading.current_thread().name)
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+            return fake_translate_html_part(content, *args, **kwargs)
+        mock_part.side_effect = fake_part
+        
+        html = "".join(f"<p>Paragraph {i}</p>" for i in range(8))
+        translated_html = translate_html(
+            self.session_manager, self.session_id, html, 'en', 'de',
+            max_chunk_size=10, max_concurrency=3
+        )
+        
+        self.assertEqual(translated_html, html.replace('Paragraph', 'PARAGRAPH'))
+        self.assertEqual(mock_part.call_count, 8)
+        self.assertEqual(threads, {'bedrock-event-loop'})
+        self.assertEqual(max(peak), 3)
+        
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertEqual(status['input_tokens'], 80)
+    
+    @patch('uicodegen.core.html_translator.translate_html_part', side_effect=fake_truncating_translate_html_part)
+    def test_translate_chunk_adaptively_resends_missing_segments(self, mock_part):
+        # Test that truncated chunks are resent until every segment is translated
+        content = {f'a{i}': f'text {i}' for i in range(5)}
+        translated, metrics = translate_chunk_adaptively(
+            content, 'en', 'de', 'English', 'German', {}, None
+        )
+        
+        self.assertEqual(translated, {idx: text.upper() for idx, text in content.items()})
+        # Completed segments are kept: 5 -> 4 -> 3 -> 2, three truncated responses
+        self.assertEqual(metrics['truncated_chunks'], 3)
+        self.assertEqual(mock_part.call_count, 4)
+        self.assertEqual(metrics['input_tokens'], 40)
+        
+        # Each request only carries the segments still missing
+        sent = [list(call.args[0]) for call in mock_part.call_args_list]
+        self.assertEqual(sent[1], ['a1', 'a2', 'a3', 'a4'])
+        self.assertEqual(sent[3], ['a3', 'a4'])
+
+    def test_translate_html_part_read_timeout_splits_chunk(self):
+        # Test that a response lost to the read timeout gets its chunk split
+        class ReadTimeoutError(Exception):
+            pass
+        
+        calls = []
+        def invoke(client, prompt, prefill_prompt=None, cached_prefix=None):
+            calls.append(prompt)
+            if prompt.count('<a') > 2:
+                raise ReadTimeoutError('Read timeout on endpoint URL')
+            return {
+                'content': ''.join(f'<a{i}>X</a{i}>' for i in range(prompt.count('<a'))),
+                'usage': {'input_tokens': 10, 'output_tokens': 5},
+                'stop_reason': 'end_turn'
+            }
+        
+        content = {f'a{i}': f'text {i}' for i in range(4)}
+        translated, metrics = translate_chunk_adaptively(
+            content, 'en', 'de', 'English', 'German', {'model_id': 'test-model', 'invoke': invoke}, None
+        )
+        
+        self.assertEqual(set(translated), set(content))
+        self.assertEqual(metrics['truncated_chunks'], 1)
+        self.assertEqual(len(calls), 3)
+    
+    def test_find_missing_segments(self):
+        # Test detection of dropped, empty and untranslated segments
+        requested = {
+            'a0': 'Welcome to our store',
+            'a1': 'Checkout',
+            'a2': 'Free shipping on all orders',
+            'a3': 'iPhone',
+            'a4': 'Contact us'
+        }
+        translated = {
+            'a0': 'Willkommen in unserem Shop',
+            'a1': '   ',
+            'a2': 'Free shipping on all orders',
+            'a3': 'iPhone'
+        }
+        missing = find_missing_segments(requested, translated)
+        self.assertEqual(set(missing), {'a1', 'a2', 'a4'})
+        
+        # Unchanged text is fine when it is not checked
+        missing = find_missing_segments(requested, translated, check_untranslated=False)
+        self.assertEqual(set(missing), {'a1', 'a4'})
+    
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part')
+    def test_translate_html_rerequests_missing_segments(self, mock_part, mock_client):
+        # The first response drops a segment, the follow-up returns it
+        def drop_third_paragraph(content, *args, **kwargs):
+            translated, metrics = fake_translate_html_part(content, *args, **kwargs)
+            if mock_part.call_count == 1:
+                translated = {idx: text for idx, text in translated.items() if text != 'THIRD PARAGRAPH'}
+            return translated, metrics
+        mock_part.side_effect = drop_third_paragraph
+        
+        translated_html = translate_html(self.session_manager, self.session_id, TEST_HTML, 'en', 'de')
+        
+        self.assertEqual(mock_part.call_count, 2)
+        self.assertEqual(list(mock_part.call_args_list[1].args[0].values()), ['Third paragraph'])
+        self.assertIn('THIRD PARAGRAPH', translated_html)
+        
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertEqual(status['retried_segments'], 1)
+        self.assertEqual(status['missing_segments'], 0)
+    
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part')
+    def test_translate_html_retry_cap(self, mock_part, mock_client):
+        # A segment that never comes back is retried at most max_retries times
+        def never_third_paragraph(content, *args, **kwargs):
+            translated, metrics = fake_translate_html_part(content, *args, **kwargs)
+            return {idx: text for idx, text in translated.items() if text != 'THIRD PARAGRAPH'}, metrics
+        mock_part.side_effect = never_third_paragraph
+        
+        translated_html = translate_html(self.session_manager, self.session_id, TEST_HTML, 'en', 'de', max_retries=2)
+        
+        self.assertEqual(mock_part.call_count, 3)
+        self.assertIn('Third paragraph', translated_html)
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertEqual(status['missing_segments'], 1)
+
+    def test_classify_segment(self):
+        # Test that non-linguistic text nodes are recognized
+        samples = {
+            '$1,299.00': 'number',
+            '-20 %': 'number',
+            '2024-05-01': 'date',
+            '9:45 PM': 'date',
+            'v2.3.1': 'version',
+            'AB12-X7': 'sku',
+            'sales@example.com': 'email',
+            'https://example.com/docs': 'url',
+            '\u00a9 \u2192': 'symbol',
+            'getElementById()': 'code',
+            '{{ username }}': 'code'
+        }
+        for text, rule in samples.items():
+            self.assertEqual(classify_segment(text), rule, text)
+        
+        for text in ['Add to cart', 'Free shipping on orders over $50', 'FAQ', '12 items', 'A']:
+            self.assertIsNone(classify_segment(text), text)
+        
+        # Rules can be selected by name
+        self.assertIsNone(classify_segment('$5', get_pass_through_rules('email,url')))
+        self.assertEqual(get_pass_through_rules('none'), {})
+    
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part', side_effect=fake_translate_html_part)
+    def test_translate_html_skips_pass_through_segments(self, mock_part, mock_client):
+        # Test that prices and SKUs are kept out of the prompt
+        html = "<table>" + "<tr><td>Red shoes</td><td>SKU-1001</td><td>$49.99</td></tr>" * 3 + "</table>"
+        translated_html = translate_html(self.session_manager, self.session_id, html, 'en', 'de')
+        
+        sent_texts = [text for call in mock_part.call_args_list for text in call.args[0].values()]
+        self.assertEqual(sent_texts, ['Red shoes'])
+        self.assertEqual(translated_html, html.replace('Red shoes', 'RED SHOES'))
+        
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertEqual(status['skipped_segments'], 6)
+        self.assertGreater(status['skipped_tokens'], 0)
+        self.assertEqual(status['tm_lookups'], 1)
+    
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part', side_effect=fake_translate_html_part)
+    def test_translate_html_detects_languages(self, mock_part, mock_client):
+        # Test source detection and the bypass for text already in the target language
+        html = (
+            "<h1>Welcome to our store</h1><p>Free shipping on all orders over fifty dollars</p>"
+            "<blockquote>Der beste Laden in der Stadt, wir kommen immer wieder</blockquote>"
+        )
+        translated_html = translate_html(self.session_manager, self.session_id, html, 'auto', 'de')
+        
+        sent_texts = [text for call in mock_part.call_args_list for text in call.args[0].values()]
+        self.assertNotIn('Der beste Laden in der Stadt, wir kommen immer wieder', sent_texts)
+        self.assertIn('Der beste Laden in der Stadt, wir kommen immer wieder', translated_html)
+        self.assertIn('WELCOME TO OUR STORE', translated_html)
+        
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertEqual(status['detected_source_language'], 'en')
+        self.assertEqual(status['target_language_segments'], 1)
+    
+    @patch('uicodegen.core.html_translator.STREAM_READ_SIZE', 37)
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part', side_effect=fake_translate_html_part)
+    def test_translate_html_file_streams_document(self, mock_part, mock_client):
+        # Test that a document read in small blocks is translated in order
+        body = "".join(f"<p class='p{i}'>Paragraph <b>number</b> {i}</p>\r\n" for i in range(40))
+        source = (
+            b"<html><head><title>T</title></head><body>\r\n"
+            + "<p>Caf\u00e9 menu</p>".encode('utf-8') + b"<!-- \xff -->\r\n"
+            + body.encode('utf-8')
+            + b"<p>Paragraph number 0</p></body></html>\r\n"
+        )
+        input_path = os.path.join(self.temp_upload_dir, 'large.html')
+        with open(input_path, 'wb') as f:
+            f.write(source)
+        
+        output_path = translate_html_file(
+            self.session_manager, self.session_id, input_path, 'en', 'de',
+            max_chunk_size=60, max_concurrency=2
+        )
+        
+        with open(output_path, 'rb') as f:
+            output = f.read()
+        
+        # Only the text nodes change, including the undecodable byte
+        expected = source.replace(b"Paragraph <b>number</b>", b"PARAGRAPH <b>NUMBER</b>")
+        expected = expected.replace(b"Paragraph number", b"PARAGRAPH NUMBER")
+        expected = expected.replace("Caf\u00e9 menu".encode('utf-8'), "CAF\u00c9 MENU".encode('utf-8'))
+        self.assertEqual(output, expected)
+        self.assertGreater(mock_part.call_count, 5)
+        
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertTrue(status['processing_complete'])
+        self.assertTrue(status['streamed_output'])
+        self.assertEqual(status['elements_translated'], 42)
+        self.assertEqual(status['input_size'], len(source))
+        self.assertEqual(status['output_size'], len(expected))
+
+    @patch('uicodegen.utils.html_scanner.RAW_TEXT_FLUSH_SIZE', 50)
+    @patch('uicodegen.core.html_translator.STREAM_READ_SIZE', 41)
+    @patch('uicodegen.core.html_translator.get_routed_client')
+    @patch('uicodegen.core.html_translator.translate_html_part', side_effect=fake_translate_html_part)
+    def test_translate_html_file_long_pass_through(self, mock_part, mock_client):
+        # Test that long stretches without text, like inline scripts, are copied unchanged
+        script = "<script>" + "if (a < b) { run(); }\n" * 40 + "</script>"
+        source = ("<html><body><p>Intro text</p>" + script + "<p>Closing text</p>"
+                  + "<img src='data:image/png;base64," + "QUJD" * 200 + "'></body></html>").encode('utf-8')
+        input_path = os.path.join(self.temp_upload_dir, 'script.html')
+        with open(input_path, 'wb') as f:
+            f.write(source)
+        
+        output_path = translate_html_file(
+            self.session_manager, self.session_id, input_path, 'en', 'de',
+            max_chunk_size=20, max_concurrency=1
+        )
+        
+        with open(output_path, 'rb') as f:
+            output = f.read()
+        expected = source.replace(b"Intro text", b"INTRO TEXT").replace(b"Closing text", b"CLOSING TEXT")
+        self.assertEqual(output, expected)
+
+if __name__ == '__main__':
+    unittest.main()
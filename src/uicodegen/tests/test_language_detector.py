@@ -0,0 +1,53 @@
+import unittest
+
+from uicodegen.core.language_detector import (
+    detect_language, is_target_language, detect_dominant_language, CONFIDENT_DETECTION
+)
+
+class TestLanguageDetector(unittest.TestCase):
+    
+    def test_detect_language(self):
+        # Test that common languages are identified confidently
+        samples = {
+            'Free shipping on all orders over $50': 'en',
+            'Livraison gratuite pour toutes les commandes': 'fr',
+            'Kostenloser Versand für alle Bestellungen': 'de',
+            'Spedizione gratuita per tutti gli ordini': 'it',
+            'Darmowa dostawa dla wszystkich zamówień': 'pl',
+            'Miễn phí vận chuyển cho tất cả đơn hàng': 'vi',
+            'Frete grátis em todos os pedidos, não perca': 'pt',
+            'Безкоштовна доставка для всіх замовлень': 'uk',
+            'Вы можете выбрать способ доставки для всех заказов': 'ru',
+            '所有订单免费送货，这是我们的服务': 'zh-hans',
+            '所有訂單免費送貨，這是我們的服務': 'zh-hant',
+            'すべての注文で送料無料': 'ja',
+            'จัดส่งฟรีสำหรับทุกคำสั่งซื้อ': 'th',
+            'شحن مجاني لجميع الطلبات': 'ar'
+        }
+        for text, language in samples.items():
+            detected, confidence = detect_language(text)
+            self.assertEqual(detected, language, text)
+            self.assertGreaterEqual(confidence, CONFIDENT_DETECTION, text)
+    
+    def test_short_and_ambiguous_text_is_not_confident(self):
+        # Test that labels and script-neutral Han text stay below the threshold
+        for text in ['Home', 'iPhone', '中文', '12345']:
+            _, confidence = detect_language(text)
+            self.assertLess(confidence, CONFIDENT_DETECTION, text)
+    
+    def test_is_target_language(self):
+        # Test the bypass decision for segments already in the target language
+        self.assertTrue(is_target_language('所有訂單免費送貨，這是我們的服務', 'en', 'zh-hant'))
+        self.assertFalse(is_target_language('所有訂單免費送貨，這是我們的服務', 'en', 'zh-hans'))
+        self.assertTrue(is_target_language('Envío gratis para todos los pedidos', 'en', 'es-co'))
+        # Variants of the source language are always translated
+        self.assertFalse(is_target_language('Free shipping on all orders', 'en', 'en-sa'))
+    
+    def test_detect_dominant_language(self):
+        # Test that the main language of a page wins over embedded snippets
+        texts = ['Willkommen in unserem Shop', 'Kostenloser Versand für alle Bestellungen', 'Sale', 'Free shipping']
+        self.assertEqual(detect_dominant_language(texts, default='en'), 'de')
+        self.assertEqual(detect_dominant_language(['1234', '$5'], default='en'), 'en')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from uicodegen.core.model_configs import MODEL_CONFIGS, DEFAULT_MODEL
+from uicodegen.core.model_registry import ModelRegistry, resolve_model
+
+class TestModelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ModelRegistry(MODEL_CONFIGS)
+
+    def test_small_request_goes_to_fastest_model(self):
+        # Test that a short translation picks the fastest model
+        self.assertEqual(self.registry.choose(input_tokens=200, output_tokens=300), 'claude-3-haiku')
+
+    def test_haiku_output_limit(self):
+        # Test that outputs beyond Claude 3 Haiku's 4096 tokens go to a model that allows them
+        self.assertEqual(MODEL_CONFIGS['claude-3-haiku']['max_tokens'], 4096)
+        self.assertTrue(self.registry.fits('claude-3-haiku', 200, 4096))
+        self.assertFalse(self.registry.fits('claude-3-haiku', 200, 4097))
+        self.assertNotEqual(self.registry.choose(input_tokens=200, output_tokens=6000), 'claude-3-haiku')
+
+    def test_output_limit(self):
+        # Test that outputs beyond most models' limit go to the one that fits
+        self.assertEqual(self.registry.choose(input_tokens=20000, output_tokens=30000), 'claude-3-7-sonnet')
+
+        # Chunked jobs are sized to the model, so any model fits
+        self.assertEqual(self.registry.choose(input_tokens=20000, output_tokens=30000, chunked=True), 'claude-3-haiku')
+
+    def test_vision(self):
+        # Test that image requests skip models without vision
+        self.registry.record('claude-3-5-haiku', first_token_time=0.1, tokens_per_second=1000)
+        self.assertEqual(self.registry.choose(input_tokens=2000, output_tokens=6000), 'claude-3-5-haiku')
+        self.assertNotEqual(self.registry.choose(input_tokens=2000, output_tokens=6000, vision=True), 'claude-3-5-haiku')
+
+    def test_latency_budget(self):
+        # Test that a generous latency target buys a more capable model
+        self.assertEqual(self.registry.choose(200, 300, max_latency=60), 'claude-3-7-sonnet')
+        # A target no model meets falls back to the fastest
+        self.assertEqual(self.registry.choose(200, 300, max_latency=0.1), 'claude-3-haiku')
+
+    def test_live_measurements(self):
+        # Test that measurements from completed sessions replace the expected speed
+        for _ in range(3):
+            self.registry.record_session({
+                'selected_model': 'claude-3-5-sonnet', 'use_streaming': True,
+                'first_token_time': 0.2, 'tokens_per_second': 50, 'decode_tokens_per_second': 400
+            })
+        self.assertEqual(self.registry.get_speed('claude-3-5-sonnet'), (0.2, 400))
+        self.assertEqual(self.registry.choose(input_tokens=200, output_tokens=300), 'claude-3-5-sonnet')
+
+    def test_non_streaming_sessions_skip_ttft(self):
+        # Test that the full response latency of a non-streaming session is not taken as TTFT
+        self.registry.record_session({
+            'selected_model': 'claude-3-5-sonnet', 'use_streaming': False,
+            'first_token_time': 40.0, 'tokens_per_second': 60, 'decode_tokens_per_second': 0
+        })
+        self.assertEqual(self.registry.get_speed('claude-3-5-sonnet'), (1.2, 70))
+
+    def test_resolve_model(self):
+        # Test that explicit, unknown and missing models resolve as before
+        self.assertEqual(resolve_model('claude-3-5-haiku'), 'claude-3-5-haiku')
+        self.assertEqual(resolve_model('gpt-4'), DEFAULT_MODEL)
+        self.assertEqual(resolve_model(None), DEFAULT_MODEL)
+        self.assertIn(resolve_model('auto', output_tokens=100), MODEL_CONFIGS)
+
+if __name__ == '__main__':
+    unittest.main()
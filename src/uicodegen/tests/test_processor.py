@@ -0,0 +1,130 @@
+import unittest
+import asyncio
+import os
+import json
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch, MagicMock
+
+from uicodegen.core import processor
+from uicodegen.core.session_manager import SessionManager
+
+def text_event(text):
+    """Build a streamed content_block_delta event"""
+    chunk = {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': text}}
+    return {'chunk': {'bytes': json.dumps(chunk).encode()}}
+
+class TestStreamingArtifacts(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_upload_dir = tempfile.mkdtemp()
+        self.temp_generated_dir = tempfile.mkdtemp()
+        self.session_manager = SessionManager(
+            upload_base_dir=self.temp_upload_dir,
+            generated_base_dir=self.temp_generated_dir
+        )
+        self.session_id = self.session_manager.create_session()
+        self.session_manager.update_session_status(self.session_id, selected_model='claude-3-haiku')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_upload_dir, ignore_errors=True)
+        shutil.rmtree(self.temp_generated_dir, ignore_errors=True)
+
+    def test_save_artifact_is_atomic(self):
+        # Test that an artifact replaces its file without leaving temp files behind
+        path = processor.save_artifact(self.session_manager, self.session_id, 'css', 'p { color: red; }')
+
+        self.assertEqual(os.path.basename(path), 'styles.css')
+        with open(path) as f:
+            self.assertEqual(f.read(), 'p { color: red; }')
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['styles.css'])
+
+    @patch('uicodegen.core.processor.get_routed_client', return_value=MagicMock())
+    @patch('uicodegen.core.processor.encode_image', return_value='aW1hZ2U=')
+    def test_html_written_before_stream_ends(self, mock_encode, mock_client):
+        # Test that each artifact is on disk and reported ready as soon as its block closes
+        seen = {}
+        html_path = self.session_manager.get_generated_path(self.session_id, 'index.html')
+
+        def fake_stream(*args):
+            yield text_event("Here you go\n```html\n<h1>Hi</h1>\n`")
+            yield text_event("``\n\n```css\nh1 {")
+            seen['html_on_disk'] = os.path.exists(html_path)
+            seen['ready'] = list(self.session_manager.get_session_status(self.session_id)['ready_artifacts'])
+            yield text_event(" color: red; }\n```\n```javascript\nconsole.log(1);\n```\n")
+
+        with patch('uicodegen.core.processor.stream_model_events', side_effect=fake_stream):
+            processor.process_image_streaming(self.session_manager, self.session_id, 'design.png')
+
+        self.assertTrue(seen['html_on_disk'])
+        self.assertEqual(seen['ready'], ['html'])
+
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertTrue(status['processing_complete'])
+        self.assertIsNone(status['error_message'])
+        self.assertEqual(status['ready_artifacts'], ['html', 'css', 'js'])
+        with open(html_path) as f:
+            self.assertEqual(f.read(), '<h1>Hi</h1>')
+        self.assertTrue(self.session_manager.get_output(self.session_id)[0].startswith("Here you go\n```html"))
+
+    @patch('uicodegen.core.processor.get_routed_client', return_value=MagicMock())
+    @patch('uicodegen.core.processor.encode_image', return_value='aW1hZ2U=')
+    def test_progress_not_reported_per_chunk(self, mock_encode, mock_client):
+        # Test that progress is only reported when it changes or every few chunks
+        def fake_stream(*args):
+            for _ in range(200):
+                yield text_event("x")
+
+        update = self.session_manager.update_session_status
+        progress_updates = []
+
+        def record_update(session_id, **kwargs):
+            if 'progress_percentage' in kwargs:
+                progress_updates.append(kwargs['progress_percentage'])
+            update(session_id, **kwargs)
+
+        with patch('uicodegen.core.processor.stream_model_events', side_effect=fake_stream), \
+                patch.object(self.session_manager, 'update_session_status', side_effect=record_update):
+            processor.process_image_streaming(self.session_manager, self.session_id, 'design.png')
+
+        self.assertLess(len(progress_updates), 100)
+        self.assertEqual(self.session_manager.get_session_status(self.session_id)['streaming_chunks'], 200)
+
+    @patch('uicodegen.core.processor.get_async_routed_client')
+    @patch('uicodegen.core.processor.encode_image', return_value='aW1hZ2U=')
+    def test_async_job_saves_artifacts(self, mock_encode, mock_client):
+        # Test that the event loop variant reads the async stream like the threaded one, writing files off the loop
+        save_threads = []
+        save_artifact = processor.save_artifact
+
+        def record_save(*args):
+            save_threads.append(threading.current_thread())
+            return save_artifact(*args)
+
+        async def fake_client(model_id):
+            return MagicMock()
+
+        async def fake_stream(*args):
+            for text in ("```html\n<h1>Hi</h1>\n```\n", "```css\nh1 {}\n```\n", "```js\nrun();\n```"):
+                await asyncio.sleep(0)
+                yield text_event(text)
+
+        mock_client.side_effect = fake_client
+        with patch('uicodegen.core.processor.stream_model_events_async', side_effect=fake_stream), \
+                patch('uicodegen.core.processor.save_artifact', side_effect=record_save):
+            asyncio.run(processor.process_image_streaming_async(self.session_manager, self.session_id, 'design.png'))
+
+        self.assertTrue(save_threads)
+        self.assertNotIn(threading.main_thread(), save_threads)
+
+        status = self.session_manager.get_session_status(self.session_id)
+        self.assertTrue(status['processing_complete'])
+        self.assertFalse(status['is_processing'])
+        self.assertIsNone(status['error_message'])
+        self.assertEqual(status['ready_artifacts'], ['html', 'css', 'js'])
+        with open(self.session_manager.get_generated_path(self.session_id, 'script.js')) as f:
+            self.assertEqual(f.read(), 'run();')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import io
+import json
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from uicodegen.utils import bedrock_client, bedrock_limiter
+from uicodegen.utils.bedrock_client import get_bedrock_client, invoke_claude_model, invoke_claude_model_streaming
+from uicodegen.utils.bedrock_limiter import RetryBudget
+from uicodegen.utils.region_router import RegionRouter
+
+class FakeClientError(Exception):
+    """Exception shaped like a botocore ClientError"""
+
+    def __init__(self, code):
+        super().__init__(f"An error occurred ({code})")
+        self.response = {'Error': {'Code': code}}
+
+def stream_event(data):
+    """Build a raw response stream event"""
+    return {'chunk': {'bytes': json.dumps(data).encode()}}
+
+class TestRegionRouter(unittest.TestCase):
+
+    def test_unmeasured_regions_are_tried_first(self):
+        # Test that every region gets traffic before the averages take over
+        router = RegionRouter(['us-east-1', 'us-west-2'])
+        self.assertEqual(router.best_region('model'), 'us-east-1')
+
+        router.record_success('us-east-1', 'model', ttft=0.5)
+        self.assertEqual(router.best_region('model'), 'us-west-2')
+
+    def test_fastest_region_wins(self):
+        # Test that TTFT, throughput and errors decide the order
+        router = RegionRouter(['us-east-1', 'us-west-2'])
+        router.record_success('us-east-1', 'model', ttft=2.0)
+        router.record_success('us-west-2', 'model', ttft=0.5)
+        self.assertEqual(router.rank('model'), ['us-west-2', 'us-east-1'])
+
+        # A much slower generation outweighs the faster start
+        router.record_throughput('us-west-2', 'model', output_tokens=100, seconds=10)
+        router.record_throughput('us-east-1', 'model', output_tokens=1000, seconds=10)
+        self.assertEqual(router.best_region('model'), 'us-east-1')
+
+    def test_failing_region_cools_down(self):
+        # Test that throttling takes a region out of rotation
+        router = RegionRouter(['us-east-1', 'us-west-2'])
+        router.record_success('us-east-1', 'model', ttft=0.5)
+        router.record_success('us-west-2', 'model', ttft=2.0)
+        router.record_failure('us-east-1', 'model')
+
+        self.assertEqual(router.best_region('model'), 'us-west-2')
+        self.assertEqual(router.next_region('us-west-2', 'model'), 'us-east-1')
+
+        stats = {item['region']: item for item in router.snapshot()}
+        self.assertEqual(stats['us-east-1']['failures'], 1)
+        self.assertGreater(stats['us-east-1']['cooling_down_for'], 0)
+
+    def test_non_streaming_latency_ranks_regions(self):
+        # Test that regions serving only non-streaming requests are ranked by latency per token
+        router = RegionRouter(['us-east-1', 'us-west-2'])
+        router.record_success('us-east-1', 'model')
+        router.record_latency('us-east-1', 'model', output_tokens=500, seconds=20)
+        router.record_success('us-west-2', 'model')
+        router.record_latency('us-west-2', 'model', output_tokens=100, seconds=2)
+
+        self.assertEqual(router.rank('model'), ['us-west-2', 'us-east-1'])
+        stats = {item['region']: item for item in router.snapshot()}
+        self.assertEqual(stats['us-west-2']['seconds_per_token'], 0.02)
+        self.assertIsNone(stats['us-west-2']['ttft'])
+
+class TestRoutedRequest(unittest.TestCase):
+
+    def setUp(self):
+        bedrock_client._client_registry.clear()
+        bedrock_client._client_stats.clear()
+        bedrock_client._client_keys.clear()
+        self.router = RegionRouter(['us-east-1', 'us-west-2'])
+        self.patches = [
+            patch.object(bedrock_client, 'region_router', self.router),
+            patch.object(bedrock_limiter, 'retry_budget', RetryBudget()),
+            patch.object(bedrock_limiter, 'backoff_delay', return_value=0)
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    @patch('uicodegen.utils.bedrock_client.boto3')
+    def test_failover_on_throttling(self, mock_boto3):
+        # Test that a throttled request is sent again in the next region
+        mock_boto3.client.side_effect = lambda **kwargs: MagicMock()
+        east = get_bedrock_client(region='us-east-1')
+        west = get_bedrock_client(region='us-west-2')
+        east.invoke_model.side_effect = FakeClientError('ThrottlingException')
+        west.invoke_model.return_value = {'body': io.BytesIO(json.dumps({
+            'content': [{'text': 'hallo'}],
+            'usage': {'input_tokens': 5, 'output_tokens': 2}
+        }).encode())}
+
+        response = invoke_claude_model(east, 'hello', model_id='failover-model')
+
+        self.assertEqual(response['content'], 'hallo')
+        west.invoke_model.assert_called_once()
+        self.assertEqual(self.router.best_region('failover-model'), 'us-west-2')
+
+    @patch('uicodegen.utils.bedrock_client.boto3')
+    def test_non_streaming_request_is_measured(self, mock_boto3):
+        # Test that a non-streaming response counts as a measurement of its region
+        mock_boto3.client.side_effect = lambda **kwargs: MagicMock()
+        east = get_bedrock_client(region='us-east-1')
+        east.invoke_model.return_value = {'body': io.BytesIO(json.dumps({
+            'content': [{'text': 'hallo'}],
+            'usage': {'input_tokens': 5, 'output_tokens': 2}
+        }).encode())}
+
+        invoke_claude_model(east, 'hello', model_id='latency-model')
+
+        stats = {item['region']: item for item in self.router.snapshot()}
+        self.assertIsNotNone(stats['us-east-1']['seconds_per_token'])
+        self.assertIsNone(stats['us-east-1']['tokens_per_second'])
+        # The measured region no longer counts as untried
+        self.assertEqual(self.router.best_region('latency-model'), 'us-west-2')
+
+    @patch('uicodegen.utils.bedrock_client.boto3')
+    def test_streaming_ttft_at_first_text_delta(self, mock_boto3):
+        # Test that a stream's TTFT ends at its first text delta and its throughput leaves the TTFT out
+        mock_boto3.client.side_effect = lambda **kwargs: MagicMock()
+        east = get_bedrock_client(region='us-east-1')
+
+        def body():
+            yield stream_event({'type': 'message_start', 'message': {}})
+            time.sleep(0.1)
+            yield stream_event({'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': 'Hal'}})
+            time.sleep(0.05)
+            yield stream_event({'type': 'message_stop', 'amazon-bedrock-invocationMetrics': {
+                'inputTokenCount': 5, 'outputTokenCount': 10
+            }})
+
+        east.invoke_model_with_response_stream.return_value = {'body': body()}
+        chunks = list(invoke_claude_model_streaming(east, 'hello', model_id='ttft-model'))
+
+        self.assertEqual(chunks[0], 'Hal')
+        stats = {item['region']: item for item in self.router.snapshot()}
+        self.assertGreaterEqual(stats['us-east-1']['ttft'], 0.1)
+        # 10 tokens over the 0.05s after the first token, not over the whole 0.15s
+        self.assertGreater(stats['us-east-1']['tokens_per_second'], 120)
+
+if __name__ == '__main__':
+    unittest.main()
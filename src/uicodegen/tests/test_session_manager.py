@@ -2,8 +2,9 @@ import unittest
 import os
 import time
 import tempfile
+import threading
 import shutil
-from uicodegen.core.session_manager import SessionManager
+from uicodegen.core.session_manager import SessionManager, ProgressTicker, PROGRESS_UPDATE_CHUNKS
 
 class TestSessionManager(unittest.TestCase):
     
@@ -68,6 +69,98 @@ class TestSessionManager(unittest.TestCase):
         # Check that invalid key was not added
         self.assertNotIn('invalid_key', self.session_manager.get_session_status(session_id))
     
+    def test_on_complete_callback(self):
+        # Test that only sessions completing without an error are reported
+        completed = []
+        self.session_manager.on_complete = completed.append
+        
+        failed_id = self.session_manager.create_session()
+        self.session_manager.update_session_status(failed_id, error_message='Boom', processing_complete=True)
+        
+        session_id = self.session_manager.create_session()
+        self.session_manager.update_session_status(session_id, progress_percentage=50)
+        self.session_manager.update_session_status(session_id, progress_percentage=100, processing_complete=True)
+        
+        self.assertEqual(completed, [self.session_manager.get_session_status(session_id)])
+    
+    def test_wait_for_update(self):
+        # Test that watchers wake up as soon as the status changes
+        session_id = self.session_manager.create_session()
+        status, version = self.session_manager.wait_for_update(session_id, -1)
+        self.assertEqual(status['progress_percentage'], 0)
+        
+        # Without a change the wait times out with the same version
+        self.assertEqual(self.session_manager.wait_for_update(session_id, version, 0.01)[1], version)
+        
+        timer = threading.Timer(0.05, self.session_manager.update_session_status, [session_id], {'progress_percentage': 40})
+        timer.start()
+        status, new_version = self.session_manager.wait_for_update(session_id, version, 5)
+        timer.join()
+        self.assertGreater(new_version, version)
+        self.assertEqual(status['progress_percentage'], 40)
+        
+        # Unknown sessions return right away
+        self.assertEqual(self.session_manager.wait_for_update('missing', -1, 5), (None, -1))
+    
+    def test_generated_output(self):
+        # Test that generated text can be read from any offset
+        session_id = self.session_manager.create_session()
+        _, version = self.session_manager.wait_for_update(session_id, -1)
+        
+        self.session_manager.append_output(session_id, "Hello ")
+        self.session_manager.append_output(session_id, "wide ")
+        self.session_manager.append_output(session_id, "world")
+        self.assertGreater(self.session_manager.wait_for_update(session_id, version, 0)[1], version)
+        
+        self.assertEqual(self.session_manager.get_output(session_id), ("Hello wide world", 16))
+        self.assertEqual(self.session_manager.get_output(session_id, 8), ("de world", 16))
+        self.assertEqual(self.session_manager.get_output(session_id, 16), ("", 16))
+        self.assertFalse(self.session_manager.append_output('missing', "text"))
+    
+    def test_coalesced_status_updates(self):
+        # Test that progress fields are buffered while other updates publish right away
+        session_manager = SessionManager(
+            upload_base_dir=self.temp_upload_dir,
+            generated_base_dir=self.temp_generated_dir,
+            status_updates_per_second=5
+        )
+        session_id = session_manager.create_session()
+        _, version = session_manager.wait_for_update(session_id, -1)
+        
+        # The first update is published, the next ones wait for the interval
+        session_manager.update_session_status(session_id, streaming_chunks=1, progress_percentage=30)
+        for chunk in range(2, 10):
+            session_manager.update_session_status(session_id, streaming_chunks=chunk, current_task=f"Chunk {chunk}")
+        status = session_manager.get_session_status(session_id)
+        self.assertEqual(status['streaming_chunks'], 1)
+        self.assertEqual(status['current_task'], 'Initialized')
+        
+        # The buffer is published once the interval passes
+        status, version = session_manager.wait_for_update(session_id, version + 1, 5)
+        self.assertEqual(status['streaming_chunks'], 9)
+        self.assertEqual(status['current_task'], 'Chunk 9')
+        
+        # Completion is published at once, together with buffered fields
+        session_manager.update_session_status(session_id, streaming_chunks=10)
+        session_manager.update_session_status(session_id, processing_complete=True)
+        status = session_manager.get_session_status(session_id)
+        self.assertEqual(status['streaming_chunks'], 10)
+        self.assertTrue(status['processing_complete'])
+    
+    def test_progress_ticker(self):
+        # Test that progress is due when the percentage changes or enough chunks arrive
+        ticker = ProgressTicker()
+        ticker.interval = 60
+
+        self.assertTrue(ticker.due(30, 1))
+        self.assertFalse(ticker.due(30, 2))
+        self.assertTrue(ticker.due(31, 3))
+        self.assertFalse(ticker.due(31, 3 + PROGRESS_UPDATE_CHUNKS - 1))
+        self.assertTrue(ticker.due(31, 3 + PROGRESS_UPDATE_CHUNKS))
+
+        ticker.interval = 0
+        self.assertTrue(ticker.due(31, 4 + PROGRESS_UPDATE_CHUNKS))
+
     def test_get_file_paths(self):
         # Create a session
         session_id = self.session_manager.create_session()
@@ -0,0 +1,77 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+
+from uicodegen.core.translation_memory import TranslationMemory
+
+class TestTranslationMemory(unittest.TestCase):
+    
+    def setUp(self):
+        # Create a temporary database for testing
+        self.temp_dir = tempfile.mkdtemp()
+        self.memory = TranslationMemory(os.path.join(self.temp_dir, 'tm.db'))
+    
+    def tearDown(self):
+        # Clean up temp directory
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def test_store_and_lookup(self):
+        # Test storing and looking up translations
+        self.memory.store({'Hello': 'Hallo', 'Goodbye': 'Tschüss'}, 'en', 'de', 'claude-3-haiku')
+        
+        hits = self.memory.lookup(['Hello', 'Goodbye', 'Unknown'], 'en', 'de', 'claude-3-haiku')
+        self.assertEqual(hits, {'Hello': 'Hallo', 'Goodbye': 'Tschüss'})
+        
+        # Other languages and models do not match
+        self.assertEqual(self.memory.lookup(['Hello'], 'en', 'fr', 'claude-3-haiku'), {})
+        self.assertEqual(self.memory.lookup(['Hello'], 'en', 'de', 'claude-3-7-sonnet'), {})
+        self.assertEqual(self.memory.count(), 2)
+    
+    def test_model_agnostic_entries(self):
+        # Test that entries without a model match any model, but lose to exact ones
+        self.memory.store({'Hello': 'Hallo'}, 'en', 'de', '')
+        self.assertEqual(self.memory.lookup(['Hello'], 'en', 'de', 'claude-3-haiku'), {'Hello': 'Hallo'})
+        
+        self.memory.store({'Hello': 'Servus'}, 'en', 'de', 'claude-3-haiku')
+        self.assertEqual(self.memory.lookup(['Hello'], 'en', 'de', 'claude-3-haiku'), {'Hello': 'Servus'})
+    
+    def test_tmx_round_trip(self):
+        # Test exporting to TMX and importing into another memory
+        self.memory.store({'Hello': 'Hallo', 'Cart & checkout': 'Warenkorb & Kasse'}, 'en', 'de', 'claude-3-haiku')
+        
+        buffer = io.BytesIO()
+        exported = self.memory.export_tmx(buffer)
+        self.assertEqual(exported, 2)
+        
+        buffer.seek(0)
+        other = TranslationMemory(os.path.join(self.temp_dir, 'other.db'))
+        imported = other.import_tmx(buffer)
+        self.assertEqual(imported, 2)
+        
+        hits = other.lookup(['Hello', 'Cart & checkout'], 'en', 'de', 'claude-3-haiku')
+        self.assertEqual(hits, {'Hello': 'Hallo', 'Cart & checkout': 'Warenkorb & Kasse'})
+    
+    def test_import_tmx_multiple_targets(self):
+        # Test importing a third-party TMX file with several target languages
+        tmx = """<?xml version="1.0" encoding="UTF-8"?>
+<tmx version="1.4">
+  <header srclang="en" datatype="plaintext" segtype="sentence" adminlang="en" o-tmf="x" creationtool="x" creationtoolversion="1"/>
+  <body>
+    <tu>
+      <tuv xml:lang="en"><seg>Add to cart</seg></tuv>
+      <tuv xml:lang="de"><seg>In den Warenkorb</seg></tuv>
+      <tuv xml:lang="zh-Hans"><seg>加入购物车</seg></tuv>
+    </tu>
+  </body>
+</tmx>
+"""
+        imported = self.memory.import_tmx(io.BytesIO(tmx.encode('utf-8')))
+        self.assertEqual(imported, 2)
+        
+        self.assertEqual(self.memory.lookup(['Add to cart'], 'en', 'de', 'claude-3-haiku'), {'Add to cart': 'In den Warenkorb'})
+        self.assertEqual(self.memory.lookup(['Add to cart'], 'en', 'zh-hans', 'claude-3-haiku'), {'Add to cart': '加入购物车'})
+
+if __name__ == '__main__':
+    unittest.main()
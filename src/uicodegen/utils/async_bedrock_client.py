@@ -0,0 +1,275 @@
+"""
+Asyncio-based AWS Bedrock client for running many model streams on one event loop
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+except ImportError:
+    AioConfig = None
+    get_session = None
+
+from uicodegen.utils.bedrock_client import (
+    BEDROCK_READ_TIMEOUT, DEFAULT_REGION, TEXT_DELTA_MARKER, DEFAULT_MAX_ATTEMPTS, DEFAULT_MAX_POOL_CONNECTIONS, RoutedRequest,
+    build_request_body, parse_response_body, parse_stream_chunk, region_router,
+    register_client_stats, begin_client_request, end_client_request, usage_tokens, client_config
+)
+from uicodegen.utils.bedrock_limiter import DEFAULT_MAX_ATTEMPTS as REQUEST_MAX_ATTEMPTS, get_model_limiter
+
+# "auto" uses the async layer when aiobotocore is installed, "0" turns it off
+BEDROCK_ASYNC = os.environ.get('BEDROCK_ASYNC', 'auto')
+
+# Process-wide event loop, run by a daemon thread
+_loop = None
+_loop_lock = threading.Lock()
+
+# Shared async clients, keyed by region and client configuration. They are
+# only touched from the event loop thread.
+_async_clients = {}
+_async_clients_lock = None
+
+def async_available():
+    """
+    Check whether model requests should go through the async layer
+    
+    Returns:
+        bool: True if aiobotocore is installed and the layer is not disabled
+    """
+    return get_session is not None and BEDROCK_ASYNC.lower() not in ('0', 'false', 'off')
+
+def get_event_loop():
+    """
+    Get the shared event loop, starting its thread on first use
+    
+    Returns:
+        asyncio.AbstractEventLoop: Running event loop
+    """
+    global _loop
+    
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='bedrock-event-loop', daemon=True)
+            thread.start()
+            _loop = loop
+    
+    return _loop
+
+def run_on_loop(coroutine):
+    """
+    Schedule a coroutine on the shared event loop from any thread
+    
+    Args:
+        coroutine: Coroutine to run
+        
+    Returns:
+        concurrent.futures.Future: Future of the coroutine's result, usable
+        with concurrent.futures.as_completed
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+
+async def get_async_bedrock_client(region=DEFAULT_REGION, max_attempts=DEFAULT_MAX_ATTEMPTS, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+    """
+    Return a shared async Bedrock client for the given region and configuration
+    
+    Must be awaited on the shared event loop. Clients are created once per
+    (region, max_attempts, max_pool_connections) and show up in the
+    connection pool metrics next to the synchronous clients.
+    
+    Args:
+        region: AWS region (default: us-east-1)
+        max_attempts: Maximum attempts for botocore's retry handler
+        max_pool_connections: Size of the client's HTTP connection pool
+        
+    Returns:
+        Async bedrock-runtime client
+    """
+    global _async_clients_lock
+    
+    if get_session is None:
+        raise RuntimeError("aiobotocore is required for async Bedrock requests")
+    
+    key = ('async', region, max_attempts, max_pool_connections)
+    client = _async_clients.get(key)
+    if client is not None:
+        return client
+    
+    if _async_clients_lock is None:
+        _async_clients_lock = asyncio.Lock()
+    
+    async with _async_clients_lock:
+        client = _async_clients.get(key)
+        if client is None:
+            config = AioConfig(
+                region_name=region,
+                retries={
+                    'max_attempts': max_attempts,
+                    'mode': 'standard'
+                },
+                max_pool_connections=max_pool_connections,
+                read_timeout=BEDROCK_READ_TIMEOUT,
+                tcp_keepalive=True
+            )
+            # The client lives as long as the process, so its context is never exited
+            client = await get_session().create_client('bedrock-runtime', config=config).__aenter__()
+            _async_clients[key] = client
+            register_client_stats(client, key, region, max_attempts, max_pool_connections)
+    
+    return client
+
+async def get_async_routed_client(model_id):
+    """
+    Return the shared async Bedrock client of the best region for a model
+    
+    Must be awaited on the shared event loop.
+    
+    Args:
+        model_id: Bedrock model ID the request will call
+        
+    Returns:
+        Async bedrock-runtime client
+    """
+    return await get_async_bedrock_client(region=region_router.best_region(model_id))
+
+class AsyncRoutedRequest(RoutedRequest):
+    """
+    Send function for ModelLimiter.call_async that fails over between regions
+    """
+    
+    async def __call__(self):
+        self.started_at = time.monotonic()
+        pool_stats = begin_client_request(self.client)
+        try:
+            response = await self.request(self.client)
+        except Exception as e:
+            end_client_request(pool_stats)
+            next_region = self.failed(e)
+            if next_region:
+                self.client = await get_async_bedrock_client(next_region, *client_config(self.client))
+                self.region = next_region
+            raise
+        except BaseException:
+            end_client_request(pool_stats)
+            raise
+        self.pool_stats = pool_stats
+        self.succeeded()
+        return response
+
+async def invoke_claude_model_async(client, prompt, model_id="anthropic.claude-3-sonnet-20240229-v1:0", max_tokens=4096, temperature=0.7, prefill_prompt="here is the result", cached_prefix=None, prompt_caching=False, min_cache_tokens=0):
+    """
+    Invoke Claude model with the given prompt without blocking the event loop
+    
+    Takes the same arguments and returns the same response as
+    invoke_claude_model.
+    
+    Args:
+        client: Async Bedrock client
+        prompt: Text prompt to send to the model
+        model_id: Claude model ID
+        max_tokens: Maximum tokens to generate
+        temperature: Temperature for generation
+        prefill_prompt: Text to prefill the assistant's response
+        cached_prefix: Optional static instructions sent ahead of the prompt
+        prompt_caching: Whether to mark cached_prefix as a cache breakpoint
+        min_cache_tokens: Shortest cached_prefix the model caches, in tokens
+        
+    Returns:
+        dict: Model response
+    """
+    request_body = build_request_body(prompt, max_tokens, temperature, prefill_prompt, cached_prefix, prompt_caching, min_cache_tokens)
+    limiter = get_model_limiter(model_id)
+    routed = AsyncRoutedRequest(client, model_id, lambda client: client.invoke_model(
+        modelId=model_id,
+        body=request_body
+    ))
+    
+    with routed:
+        async with limiter.request_async(routed) as response:
+            result = parse_response_body(json.loads(await response['body'].read()))
+            limiter.record_tokens(usage_tokens(result['usage']))
+            routed.finished(result['usage'].get('output_tokens', 0))
+    
+    return result
+
+async def invoke_claude_model_streaming_async(client, prompt, model_id="anthropic.claude-3-sonnet-20240229-v1:0", max_tokens=4096, temperature=0.7, prefill_prompt="here is the result", cached_prefix=None, prompt_caching=False, min_cache_tokens=0):
+    """
+    Invoke Claude model with streaming response without blocking the event loop
+    
+    Takes the same arguments and yields the same chunks as
+    invoke_claude_model_streaming.
+    
+    Args:
+        client: Async Bedrock client
+        prompt: Text prompt to send to the model
+        model_id: Claude model ID
+        max_tokens: Maximum tokens to generate
+        temperature: Temperature for generation
+        prefill_prompt: Text to prefill the assistant's response
+        cached_prefix: Optional static instructions sent ahead of the prompt
+        prompt_caching: Whether to mark cached_prefix as a cache breakpoint
+        min_cache_tokens: Shortest cached_prefix the model caches, in tokens
+        
+    Yields:
+        str or dict: Chunks of generated text or metrics information
+    """
+    request_body = build_request_body(prompt, max_tokens, temperature, prefill_prompt, cached_prefix, prompt_caching, min_cache_tokens)
+    limiter = get_model_limiter(model_id)
+    routed = AsyncRoutedRequest(client, model_id, lambda client: client.invoke_model_with_response_stream(
+        modelId=model_id,
+        body=request_body
+    ), streaming=True)
+    
+    with routed:
+        async with limiter.request_async(routed) as response:
+            async for event in response['body']:
+                chunk = event.get('chunk')
+                if chunk:
+                    item = parse_stream_chunk(json.loads(chunk.get('bytes').decode()))
+                    if isinstance(item, str):
+                        routed.first_token()
+                    elif isinstance(item, dict) and item.get('type') == 'metrics':
+                        limiter.record_tokens(usage_tokens(item))
+                        routed.finished(item['output_tokens'])
+                    if item is not None:
+                        yield item
+
+async def stream_model_events_async(client, model_id, request_body, max_attempts=REQUEST_MAX_ATTEMPTS):
+    """
+    Send a prepared streaming request and yield its raw response events
+    without blocking the event loop
+    
+    Takes the same arguments and yields the same events as
+    stream_model_events.
+    
+    Args:
+        client: Async Bedrock client
+        model_id: Claude model ID
+        request_body: Serialized request body
+        max_attempts: Maximum attempts, first one included
+        
+    Yields:
+        dict: Events of the response stream
+    """
+    limiter = get_model_limiter(model_id)
+    routed = AsyncRoutedRequest(client, model_id, lambda client: client.invoke_model_with_response_stream(
+        modelId=model_id,
+        body=request_body
+    ), streaming=True)
+    
+    with routed:
+        async with limiter.request_async(routed, max_attempts) as response:
+            async for event in response['body']:
+                chunk = event.get('chunk')
+                if chunk and routed.first_token_at is None and TEXT_DELTA_MARKER in chunk.get('bytes', b''):
+                    routed.first_token()
+                if chunk and b'invocationMetrics' in chunk.get('bytes', b''):
+                    item = parse_stream_chunk(json.loads(chunk.get('bytes').decode()))
+                    if isinstance(item, dict):
+                        limiter.record_tokens(usage_tokens(item))
+                        routed.finished(item['output_tokens'])
+                yield event
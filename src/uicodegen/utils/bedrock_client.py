@@ -3,86 +3,541 @@ AWS Bedrock client utility for interacting with Claude models
 """
 import os
 import json
+import threading
+import time
+from contextlib import contextmanager
+
 import boto3
 from botocore.config import Config
 
-def get_bedrock_client(region="us-east-1"):
+from uicodegen.utils.bedrock_limiter import DEFAULT_MAX_ATTEMPTS as REQUEST_MAX_ATTEMPTS, get_model_limiter, is_retryable_error
+from uicodegen.utils.region_router import RegionRouter
+from uicodegen.utils.token_utils import estimate_tokens
+
+# Default region for Bedrock clients
+DEFAULT_REGION = "us-east-1"
+
+# Regions jobs are routed between (comma-separated), in order of preference
+BEDROCK_REGIONS = [
+    region.strip() for region in os.environ.get('BEDROCK_REGIONS', DEFAULT_REGION).split(',') if region.strip()
+]
+
+# Size of the HTTP connection pool of each client. It should be at least the
+# number of jobs (and parallel chunks) that can talk to Bedrock at once.
+DEFAULT_MAX_POOL_CONNECTIONS = int(os.environ.get('BEDROCK_MAX_POOL_CONNECTIONS', 50))
+
+# Seconds a client waits for response data. A non-streaming response only
+# arrives once it is complete, so long outputs need more than botocore's 60s.
+BEDROCK_READ_TIMEOUT = int(os.environ.get('BEDROCK_READ_TIMEOUT', 300))
+
+# Process-wide client registry, keyed by region and client configuration
+_client_registry = {}
+_client_stats = {}
+_client_keys = {}
+_registry_lock = threading.RLock()
+
+# botocore does not retry on its own; retries are coordinated across jobs by
+# the model limiters in bedrock_limiter
+DEFAULT_MAX_ATTEMPTS = 1
+
+def get_bedrock_client(region=DEFAULT_REGION, max_attempts=DEFAULT_MAX_ATTEMPTS, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
     """
-    Create and return a Bedrock client
+    Return a shared Bedrock client for the given region and configuration
+    
+    Clients are created once per (region, max_attempts, max_pool_connections)
+    and reused by every job, so credential resolution and TLS handshakes are
+    paid only on first use. boto3 clients are thread-safe once created.
     
     Args:
         region: AWS region (default: us-east-1)
+        max_attempts: Maximum attempts for botocore's retry handler, 1 to
+            leave retries to the model limiters
+        max_pool_connections: Size of the client's HTTP connection pool
         
     Returns:
         boto3.client: Configured Bedrock client
     """
-    # Configure retry settings
-    config = Config(
-        region_name=region,
-        retries={
-            'max_attempts': 3,
-            'mode': 'standard'
+    key = (region, max_attempts, max_pool_connections)
+    
+    client = _client_registry.get(key)
+    if client is not None:
+        return client
+    
+    with _registry_lock:
+        client = _client_registry.get(key)
+        if client is None:
+            # Configure retry and connection pool settings
+            config = Config(
+                region_name=region,
+                retries={
+                    'max_attempts': max_attempts,
+                    'mode': 'standard'
+                },
+                max_pool_connections=max_pool_connections,
+                read_timeout=BEDROCK_READ_TIMEOUT,
+                tcp_keepalive=True
+            )
+            
+            # Create Bedrock client
+            client = boto3.client(
+                service_name='bedrock-runtime',
+                config=config
+            )
+            
+            _client_registry[key] = client
+            register_client_stats(client, key, region, max_attempts, max_pool_connections)
+    
+    return client
+
+def get_routed_client(model_id):
+    """
+    Return the shared Bedrock client of the best region for a model
+    
+    Args:
+        model_id: Bedrock model ID the job will call
+        
+    Returns:
+        boto3.client: Client of the region with the lowest expected latency
+    """
+    return get_bedrock_client(region=region_router.best_region(model_id))
+
+def client_region(client):
+    """
+    Get the region of a registry client
+    
+    Returns:
+        str: Region name, or None for clients outside the registry
+    """
+    key = _client_keys.get(id(client))
+    if key is None:
+        return None
+    return _client_stats[key]['region']
+
+def get_hedge_region(client, model_id):
+    """
+    Get the region a late request on a registry client is hedged to
+    
+    Args:
+        client: Registry client of the primary request
+        model_id: Bedrock model ID
+        
+    Returns:
+        str: Best region other than the client's, or None if there is none
+        or the client is outside the registry
+    """
+    region = client_region(client)
+    if region is None:
+        return None
+    return region_router.next_region(region, model_id)
+
+def client_config(client):
+    """
+    Get the retry and pool configuration of a registry client
+    
+    Returns:
+        tuple: (max_attempts, max_pool_connections)
+    """
+    stats = _client_stats[_client_keys[id(client)]]
+    return stats['max_attempts'], stats['max_pool_connections']
+
+def register_client_stats(client, key, region, max_attempts, max_pool_connections):
+    """
+    Start tracking the connection pool of a shared client
+    
+    Args:
+        client: Shared Bedrock client, synchronous or asynchronous
+        key: Hashable key identifying the client's configuration
+        region: AWS region of the client
+        max_attempts: Maximum attempts for the client's retry handler
+        max_pool_connections: Size of the client's HTTP connection pool
+    """
+    with _registry_lock:
+        _client_keys[id(client)] = key
+        _client_stats[key] = {
+            'region': region,
+            'max_attempts': max_attempts,
+            'max_pool_connections': max_pool_connections,
+            'in_flight': 0,
+            'peak_in_flight': 0,
+            'total_requests': 0,
+            'saturated_requests': 0
         }
-    )
+
+def begin_client_request(client):
+    """
+    Count the start of a request against the connection pool of a registry client
+    
+    A request that starts while all pool connections are busy is counted as
+    saturated, since it has to wait for a connection to be released.
+    
+    Args:
+        client: Bedrock client returned by get_bedrock_client
+        
+    Returns:
+        dict: Pool statistics to pass to end_client_request, or None for
+        clients outside the registry
+    """
+    key = _client_keys.get(id(client))
+    if key is None:
+        # Not a registry client, nothing to track
+        return None
     
-    # Create Bedrock client
-    bedrock_client = boto3.client(
-        service_name='bedrock-runtime',
-        config=config
-    )
+    stats = _client_stats[key]
+    with _registry_lock:
+        if stats['in_flight'] >= stats['max_pool_connections']:
+            stats['saturated_requests'] += 1
+        stats['in_flight'] += 1
+        stats['total_requests'] += 1
+        stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+    return stats
+
+def end_client_request(stats):
+    """
+    Count the end of a request started with begin_client_request
+    """
+    if stats is not None:
+        with _registry_lock:
+            stats['in_flight'] -= 1
+
+@contextmanager
+def track_client_request(client):
+    """
+    Count a request against the connection pool of a registry client
     
-    return bedrock_client
+    Args:
+        client: Bedrock client returned by get_bedrock_client
+    """
+    stats = begin_client_request(client)
+    try:
+        yield
+    finally:
+        end_client_request(stats)
 
-def invoke_claude_model(client, prompt, model_id="anthropic.claude-3-sonnet-20240229-v1:0", max_tokens=4096, temperature=0.7, prefill_prompt="here is the result"):
+def get_client_pool_metrics():
     """
-    Invoke Claude model with the given prompt
+    Get connection pool metrics for every registry client
+    
+    Returns:
+        list: One dictionary of pool metrics per client
+    """
+    with _registry_lock:
+        return [dict(stats) for stats in _client_stats.values()]
+
+# Bytes of a raw stream event that carries generated text
+TEXT_DELTA_MARKER = b'"text_delta"'
+
+# Process-wide router, fed by every request sent through a registry client
+region_router = RegionRouter(BEDROCK_REGIONS)
+
+class RoutedRequest:
+    """
+    Send function for ModelLimiter.call that fails over between regions
+    
+    Every attempt is measured for the region router. After throttling or a
+    regional error the region is taken out of rotation and the next attempt
+    goes to the best other region, on a client with the same configuration.
+    Requests on clients outside the registry are sent as they are.
+    
+    Each attempt counts against its client's connection pool from before it
+    is sent; the successful one until the request is closed, so use it as a
+    context manager around the limiter's request().
+    """
+    
+    def __init__(self, client, model_id, request, streaming=False):
+        """
+        Initialize the request
+        
+        Args:
+            client: Registry client of the first attempt
+            model_id: Bedrock model ID
+            request: Function sending the request on a given client
+            streaming: Whether the response is streamed; its readers call
+                first_token() at the first text delta
+        """
+        self.client = client
+        self.region = client_region(client)
+        self.model_id = model_id
+        self.request = request
+        self.streaming = streaming
+        self.started_at = None
+        self.first_token_at = None
+        self.pool_stats = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def close(self):
+        """
+        Stop counting the request against its connection pool
+        """
+        end_client_request(self.pool_stats)
+        self.pool_stats = None
+    
+    def __call__(self):
+        self.started_at = time.monotonic()
+        pool_stats = begin_client_request(self.client)
+        try:
+            response = self.request(self.client)
+        except Exception as e:
+            end_client_request(pool_stats)
+            next_region = self.failed(e)
+            if next_region:
+                self.client = get_bedrock_client(next_region, *client_config(self.client))
+                self.region = next_region
+            raise
+        except BaseException:
+            end_client_request(pool_stats)
+            raise
+        self.pool_stats = pool_stats
+        self.succeeded()
+        return response
+    
+    def failed(self, error):
+        """
+        Record a failed attempt
+        
+        Returns:
+            str: Region of the next attempt, or None to stay in this region
+        """
+        if self.region is None:
+            return None
+        regional = is_retryable_error(error)
+        region_router.record_failure(self.region, self.model_id, cooldown=regional)
+        if regional:
+            return region_router.next_region(self.region, self.model_id)
+        return None
+    
+    def succeeded(self):
+        """
+        Record a successful attempt
+        
+        For a stream this is when the response headers arrive, which says
+        nothing about its time to first token.
+        """
+        if self.region is not None:
+            region_router.record_success(self.region, self.model_id)
+    
+    def first_token(self):
+        """
+        Record the time to first token at the first text delta of a stream
+        """
+        if self.first_token_at is None and self.started_at is not None:
+            self.first_token_at = time.monotonic()
+            if self.region is not None:
+                region_router.record_ttft(self.region, self.model_id, self.first_token_at - self.started_at)
+    
+    def finished(self, output_tokens):
+        """
+        Record the generation speed once the response has been read
+
+        Streams record their throughput over the decode time after the first
+        token. Non-streaming responses record their latency per output
+        token, since they have no time to first token to separate from the
+        throughput.
+        """
+        if self.region is not None and self.started_at is not None:
+            now = time.monotonic()
+            if self.streaming:
+                if self.first_token_at is not None:
+                    region_router.record_throughput(self.region, self.model_id, output_tokens, now - self.first_token_at)
+            else:
+                region_router.record_latency(self.region, self.model_id, output_tokens, now - self.started_at)
+
+def get_region_metrics():
+    """
+    Get the routing statistics of every region and model
+    
+    Returns:
+        dict: Configured regions and per-region statistics
+    """
+    return {'regions': BEDROCK_REGIONS, 'routes': region_router.snapshot()}
+
+def is_cacheable_prefix(prefix, min_cache_tokens=0):
+    """
+    Check whether a prompt prefix is long enough for Bedrock to cache
+    
+    Bedrock ignores cache breakpoints after fewer tokens than the model's
+    minimum, so such a request neither writes nor reads the cache.
+    
+    Args:
+        prefix: Static text sent ahead of the per-request content
+        min_cache_tokens: Shortest prefix the model caches, in tokens
+        
+    Returns:
+        bool: True if the prefix is estimated to reach the minimum
+    """
+    return estimate_tokens(prefix) >= min_cache_tokens
+
+def build_user_content(prompt, cached_prefix=None, prompt_caching=False, min_cache_tokens=0):
+    """
+    Build the content of the user message
+    
+    The cached prefix holds the static instructions of a prompt. With prompt
+    caching it becomes its own text block ending in a cache breakpoint, so
+    Bedrock can reuse it across requests; otherwise, or when it is shorter
+    than the model caches, it is simply prepended.
+    
+    Args:
+        prompt: Per-request part of the prompt
+        cached_prefix: Optional static part of the prompt, sent first
+        prompt_caching: Whether the model supports cache_control breakpoints
+        min_cache_tokens: Shortest prefix the model caches, in tokens
+        
+    Returns:
+        str or list: Message content
+    """
+    if not cached_prefix:
+        return prompt
+    if not prompt_caching or not is_cacheable_prefix(cached_prefix, min_cache_tokens):
+        return cached_prefix + prompt
+    return [
+        {
+            "type": "text",
+            "text": cached_prefix,
+            "cache_control": {"type": "ephemeral"}
+        },
+        {
+            "type": "text",
+            "text": prompt
+        }
+    ]
+
+def build_request_body(prompt, max_tokens=4096, temperature=0.7, prefill_prompt="here is the result", cached_prefix=None, prompt_caching=False, min_cache_tokens=0):
+    """
+    Build the JSON request body of a Claude invocation
     
     Args:
-        client: Bedrock client
         prompt: Text prompt to send to the model
-        model_id: Claude model ID
         max_tokens: Maximum tokens to generate
         temperature: Temperature for generation
         prefill_prompt: Text to prefill the assistant's response
+        cached_prefix: Optional static instructions sent ahead of the prompt
+        prompt_caching: Whether to mark cached_prefix as a cache breakpoint
+        min_cache_tokens: Shortest cached_prefix the model caches, in tokens
         
     Returns:
-        dict: Model response
+        str: Serialized request body
     """
-    request_body = {
+    return json.dumps({
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": max_tokens,
         "temperature": temperature,
         "messages": [
             {
                 "role": "user",
-                "content": prompt
+                "content": build_user_content(prompt, cached_prefix, prompt_caching, min_cache_tokens)
             },
             {
                 "role": "assistant",
                 "content": prefill_prompt
             }
         ]
-    }
-    
-    response = client.invoke_model(
-        modelId=model_id,
-        body=json.dumps(request_body)
-    )
-    
-    response_body = json.loads(response.get('body').read())
-    
-    # Extract usage information
-    usage = {}
-    if 'usage' in response_body:
-        usage = response_body['usage']
+    })
+
+def parse_response_body(response_body):
+    """
+    Extract the text, stop reason and usage of a non-streaming response
     
+    Args:
+        response_body: Decoded JSON response body
+        
+    Returns:
+        dict: Model response
+    """
     return {
         'content': response_body.get('content', [{}])[0].get('text', ''),
         'stop_reason': response_body.get('stop_reason', ''),
-        'usage': usage
+        'usage': response_body.get('usage', {})
     }
 
-def invoke_claude_model_streaming(client, prompt, model_id="anthropic.claude-3-sonnet-20240229-v1:0", max_tokens=4096, temperature=0.7, prefill_prompt="here is the result"):
+def parse_stream_chunk(chunk_data):
+    """
+    Turn one decoded event of a response stream into what the caller sees
+    
+    Args:
+        chunk_data: Decoded JSON payload of the event
+        
+    Returns:
+        str, dict or None: Generated text, a metrics or usage dictionary, or
+        None for events the caller does not need
+    """
+    # Handle different types of chunks
+    if chunk_data.get('type') == 'content_block_delta':
+        delta = chunk_data.get('delta', {})
+        if delta.get('type') == 'text_delta':
+            return delta.get('text', '') or None
+    
+    # Also yield metrics at the end if available
+    elif chunk_data.get('type') == 'message_stop' and 'amazon-bedrock-invocationMetrics' in chunk_data:
+        # This is a special yield with metrics that can be handled by the caller
+        metrics = chunk_data.get('amazon-bedrock-invocationMetrics', {})
+        return {
+            'type': 'metrics',
+            'input_tokens': metrics.get('inputTokenCount', 0),
+            'output_tokens': metrics.get('outputTokenCount', 0),
+            'cache_read_input_tokens': metrics.get('cacheReadInputTokenCount', 0),
+            'cache_write_input_tokens': metrics.get('cacheWriteInputTokenCount', 0)
+        }
+    
+    # Handle message_delta with usage information
+    elif chunk_data.get('type') == 'message_delta' and 'output_tokens' in chunk_data.get('usage', {}):
+        return {
+            'type': 'usage',
+            'output_tokens': chunk_data['usage']['output_tokens'],
+            'stop_reason': chunk_data.get('delta', {}).get('stop_reason')
+        }
+    
+    return None
+
+def usage_tokens(usage):
+    """
+    Count the tokens of a usage or metrics dictionary against the token rate
+    
+    Args:
+        usage: Usage of a response, or metrics of a stream
+        
+    Returns:
+        int: Input and output tokens
+    """
+    return (usage.get('input_tokens', 0) or 0) + (usage.get('output_tokens', 0) or 0)
+
+def invoke_claude_model(client, prompt, model_id="anthropic.claude-3-sonnet-20240229-v1:0", max_tokens=4096, temperature=0.7, prefill_prompt="here is the result", cached_prefix=None, prompt_caching=False, min_cache_tokens=0):
+    """
+    Invoke Claude model with the given prompt
+    
+    Args:
+        client: Bedrock client
+        prompt: Text prompt to send to the model
+        model_id: Claude model ID
+        max_tokens: Maximum tokens to generate
+        temperature: Temperature for generation
+        prefill_prompt: Text to prefill the assistant's response
+        cached_prefix: Optional static instructions sent ahead of the prompt
+        prompt_caching: Whether to mark cached_prefix as a cache breakpoint
+        min_cache_tokens: Shortest cached_prefix the model caches, in tokens
+        
+    Returns:
+        dict: Model response. The usage includes cache_read_input_tokens and
+        cache_creation_input_tokens when the model reports them.
+    """
+    request_body = build_request_body(prompt, max_tokens, temperature, prefill_prompt, cached_prefix, prompt_caching, min_cache_tokens)
+    limiter = get_model_limiter(model_id)
+    routed = RoutedRequest(client, model_id, lambda client: client.invoke_model(
+        modelId=model_id,
+        body=request_body
+    ))
+    
+    with routed, limiter.request(routed) as response:
+        result = parse_response_body(json.loads(response.get('body').read()))
+        limiter.record_tokens(usage_tokens(result['usage']))
+        routed.finished(result['usage'].get('output_tokens', 0))
+    
+    return result
+
+def invoke_claude_model_streaming(client, prompt, model_id="anthropic.claude-3-sonnet-20240229-v1:0", max_tokens=4096, temperature=0.7, prefill_prompt="here is the result", cached_prefix=None, prompt_caching=False, min_cache_tokens=0):
     """
     Invoke Claude model with streaming response
     
@@ -93,62 +548,71 @@ def invoke_claude_model_streaming(client, prompt, model_id="anthropic.claude-3-s
         max_tokens: Maximum tokens to generate
         temperature: Temperature for generation
         prefill_prompt: Text to prefill the assistant's response
+        cached_prefix: Optional static instructions sent ahead of the prompt
+        prompt_caching: Whether to mark cached_prefix as a cache breakpoint
+        min_cache_tokens: Shortest cached_prefix the model caches, in tokens
         
     Yields:
-        str or dict: Chunks of generated text or metrics information
+        str or dict: Chunks of generated text or metrics information. Usage
+        dictionaries carry the stop_reason of the message, metrics
+        dictionaries the cache read and write token counts.
     """
-    request_body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-        "messages": [
-            {
-                "role": "user",
-                "content": prompt
-            },
-            {
-                "role": "assistant",
-                "content": prefill_prompt 
-            }
-        ]
-    }
-    
-    response = client.invoke_model_with_response_stream(
+    request_body = build_request_body(prompt, max_tokens, temperature, prefill_prompt, cached_prefix, prompt_caching, min_cache_tokens)
+    limiter = get_model_limiter(model_id)
+    routed = RoutedRequest(client, model_id, lambda client: client.invoke_model_with_response_stream(
         modelId=model_id,
-        body=json.dumps(request_body)
-    )
+        body=request_body
+    ), streaming=True)
+    
+    # The slot is held until the stream has been read
+    with routed, limiter.request(routed) as response:
+        stream = response.get('body')
+        
+        if stream:
+            for event in stream:
+                chunk = event.get('chunk')
+                if chunk:
+                    item = parse_stream_chunk(json.loads(chunk.get('bytes').decode()))
+                    if isinstance(item, str):
+                        routed.first_token()
+                    elif isinstance(item, dict) and item.get('type') == 'metrics':
+                        limiter.record_tokens(usage_tokens(item))
+                        routed.finished(item['output_tokens'])
+                    if item is not None:
+                        yield item
+
+def stream_model_events(client, model_id, request_body, max_attempts=REQUEST_MAX_ATTEMPTS):
+    """
+    Send a prepared streaming request and yield its raw response events
     
-    stream = response.get('body')
+    For callers that build their own request body and parse the events
+    themselves. The request goes through the model's limiter and the region
+    router like the invoke functions, and holds its slot until the stream
+    is closed.
+    
+    Args:
+        client: Bedrock client
+        model_id: Claude model ID
+        request_body: Serialized request body
+        max_attempts: Maximum attempts, first one included
+        
+    Yields:
+        dict: Events of the response stream
+    """
+    limiter = get_model_limiter(model_id)
+    routed = RoutedRequest(client, model_id, lambda client: client.invoke_model_with_response_stream(
+        modelId=model_id,
+        body=request_body
+    ), streaming=True)
     
-    if stream:
-        for event in stream:
+    with routed, limiter.request(routed, max_attempts) as response:
+        for event in response.get('body') or ():
             chunk = event.get('chunk')
-            if chunk:
-                chunk_data = json.loads(chunk.get('bytes').decode())
-                
-                # Handle different types of chunks
-                if chunk_data.get('type') == 'content_block_delta':
-                    delta = chunk_data.get('delta', {})
-                    if delta.get('type') == 'text_delta':
-                        chunk_text = delta.get('text', '')
-                        if chunk_text:
-                            yield chunk_text
-                
-                # Also yield metrics at the end if available
-                elif chunk_data.get('type') == 'message_stop' and 'amazon-bedrock-invocationMetrics' in chunk_data:
-                    # This is a special yield with metrics that can be handled by the caller
-                    metrics = chunk_data.get('amazon-bedrock-invocationMetrics', {})
-                    yield {
-                        'type': 'metrics',
-                        'input_tokens': metrics.get('inputTokenCount', 0),
-                        'output_tokens': metrics.get('outputTokenCount', 0)
-                    }
-                
-                # Handle message_delta with usage information
-                elif chunk_data.get('type') == 'message_delta' and 'usage' in chunk_data:
-                    if 'output_tokens' in chunk_data.get('usage', {}):
-                        output_tokens = chunk_data['usage']['output_tokens']
-                        yield {
-                            'type': 'usage',
-                            'output_tokens': output_tokens
-                        }
+            if chunk and routed.first_token_at is None and TEXT_DELTA_MARKER in chunk.get('bytes', b''):
+                routed.first_token()
+            if chunk and b'invocationMetrics' in chunk.get('bytes', b''):
+                item = parse_stream_chunk(json.loads(chunk.get('bytes').decode()))
+                if isinstance(item, dict):
+                    limiter.record_tokens(usage_tokens(item))
+                    routed.finished(item['output_tokens'])
+            yield event
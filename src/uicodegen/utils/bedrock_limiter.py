@@ -0,0 +1,625 @@
+"""
+Shared admission control for Bedrock requests
+
+Every model gets one limiter for the whole process. It bounds the requests
+in flight with AIMD (additive increase on success, multiplicative decrease
+on throttling), tracks tokens per minute, and opens a circuit breaker when
+the model keeps throttling. Retries of all jobs draw from one budget with
+jittered exponential backoff, so a throttling episode does not turn into a
+retry storm.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+# Concurrency bounds of each model's limiter
+DEFAULT_CONCURRENCY = int(os.environ.get('BEDROCK_MODEL_CONCURRENCY', 16))
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = int(os.environ.get('BEDROCK_MAX_MODEL_CONCURRENCY', 64))
+
+# Factor applied to the limit on throttling, at most once per cooldown
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 1.0
+
+# Optional tokens per minute per model, 0 for no limit
+DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get('BEDROCK_TOKENS_PER_MINUTE', 0))
+
+# Consecutive throttled or server-failed requests that open the circuit, and
+# how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+# Longest wait for a free slot before the model counts as saturated
+ACQUIRE_TIMEOUT = 120.0
+
+# Attempts per request, first one included
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Jittered exponential backoff between attempts
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+
+# Retry budget: each request earns RETRY_RATIO retries, up to RETRY_BUDGET_MAX,
+# and RETRY_BUDGET_REFILL retries per second keep low-traffic jobs retrying
+RETRY_RATIO = 0.2
+RETRY_BUDGET_MAX = 20.0
+RETRY_BUDGET_REFILL = 0.5
+
+# Error codes that mean the model is over capacity
+THROTTLING_ERROR_CODES = frozenset([
+    'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException'
+])
+
+# Error codes worth another attempt
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES | frozenset([
+    'ServiceUnavailableException', 'ModelNotReadyException', 'InternalServerException'
+])
+
+# botocore connection errors worth another attempt, matched by name so the
+# sync and async clients are handled alike
+RETRYABLE_ERROR_TYPES = frozenset(['EndpointConnectionError', 'ConnectionClosedError'])
+
+# botocore errors raised when response data does not arrive within the read timeout
+READ_TIMEOUT_ERROR_TYPES = frozenset(['ReadTimeoutError', 'AioReadTimeoutError'])
+
+# Window of the request, throttle and token rates
+RATE_WINDOW = 60.0
+
+# Circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class ModelSaturatedError(RuntimeError):
+    """Raised when a model is throttling and requests are failed fast"""
+
+def get_error_code(error):
+    """
+    Get the AWS error code of an exception
+
+    Args:
+        error: Exception raised by a Bedrock call
+
+    Returns:
+        str: Error code, or None
+    """
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code')
+
+def is_throttling_error(error):
+    """
+    Check whether an exception means the model is throttling requests
+    """
+    return get_error_code(error) in THROTTLING_ERROR_CODES
+
+def is_retryable_error(error):
+    """
+    Check whether a request that raised an exception is worth another attempt
+    """
+    if type(error).__name__ in RETRYABLE_ERROR_TYPES:
+        return True
+    return get_error_code(error) in RETRYABLE_ERROR_CODES
+
+def is_server_error(error):
+    """
+    Check whether a request failed on the service side without being throttled
+
+    Unavailable or failing models, 5xx responses and dropped connections
+    count toward opening the circuit; client errors such as validation or
+    access errors do not.
+    """
+    if is_throttling_error(error):
+        return False
+    if is_retryable_error(error):
+        return True
+    response = getattr(error, 'response', None) or {}
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+    return status >= 500
+
+def is_read_timeout(error):
+    """
+    Check whether a request failed because its response took longer than the read timeout
+    """
+    return any(cls.__name__ in READ_TIMEOUT_ERROR_TYPES for cls in type(error).__mro__)
+
+def failure_outcome(error):
+    """
+    Get the release() arguments of a request that raised an exception
+
+    Returns:
+        dict: throttled, failed and server_error flags
+    """
+    throttled = is_throttling_error(error)
+    return {'throttled': throttled, 'failed': not throttled, 'server_error': is_server_error(error)}
+
+def backoff_delay(attempt):
+    """
+    Get the delay before an attempt, with full jitter
+
+    Args:
+        attempt: Number of the failed attempts so far, from 1
+
+    Returns:
+        float: Seconds to wait
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+class RetryBudget:
+    """
+    Process-wide token bucket that caps retries relative to requests
+    """
+
+    def __init__(self, ratio=RETRY_RATIO, capacity=RETRY_BUDGET_MAX, refill_per_second=RETRY_BUDGET_REFILL):
+        """
+        Initialize the budget
+
+        Args:
+            ratio: Retries earned by each request
+            capacity: Most retries that can be saved up
+            refill_per_second: Retries earned per second regardless of traffic
+        """
+        self.ratio = ratio
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.retries = 0
+        self.denied = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def deposit(self):
+        """
+        Earn retries for a request
+        """
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """
+        Take one retry from the budget
+
+        Returns:
+            bool: True if the retry may go ahead
+        """
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.retries += 1
+                return True
+            self.denied += 1
+            return False
+
+    def snapshot(self):
+        """
+        Get the state of the budget
+        """
+        with self._lock:
+            self._refill()
+            return {
+                'available': round(self.tokens, 2),
+                'capacity': self.capacity,
+                'retries': self.retries,
+                'denied': self.denied
+            }
+
+class ModelLimiter:
+    """
+    Adaptive concurrency limit, token rate and circuit breaker of one model
+
+    Take a slot with acquire() (or acquire_async() on an event loop) before
+    a request and give it back with release() once the response has been
+    read. request() and request_async() do both around a response, with
+    retries.
+
+    While the circuit is half open, the one request let through is the
+    probe; acquire() tells its caller, which passes probe=True to release().
+    Only the probe's outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, model_id, limit=DEFAULT_CONCURRENCY, min_limit=MIN_CONCURRENCY, max_limit=MAX_CONCURRENCY, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        """
+        Initialize the limiter
+
+        Args:
+            model_id: Bedrock model ID
+            limit: Initial concurrency limit
+            min_limit: Lowest concurrency limit
+            max_limit: Highest concurrency limit
+            tokens_per_minute: Optional token rate limit, 0 for none
+        """
+        self.model_id = model_id
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tokens_per_minute = tokens_per_minute
+        self.in_flight = 0
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._last_decrease = 0.0
+        self._requests = deque()
+        self._throttles = deque()
+        self._tokens = deque()
+        self._condition = threading.Condition()
+        # (loop, asyncio.Event) of every acquire_async() waiting for a slot
+        self._async_waiters = set()
+
+    def _prune(self, now):
+        """
+        Drop rate samples older than the window
+        """
+        for samples in (self._requests, self._throttles, self._tokens):
+            while samples and now - samples[0][0] > RATE_WINDOW:
+                samples.popleft()
+
+    def _tokens_in_window(self):
+        return sum(tokens for _, tokens in self._tokens)
+
+    def _check_breaker(self, now):
+        """
+        Fail fast while the circuit is open; let one probe through after the cooldown
+        """
+        if self.state == OPEN:
+            remaining = BREAKER_COOLDOWN - (now - self.opened_at)
+            if remaining > 0:
+                raise ModelSaturatedError(
+                    f"Model {self.model_id} is saturated ({self.consecutive_failures} throttled or failed requests in a row); "
+                    f"retry in {remaining:.0f}s"
+                )
+            self.state = HALF_OPEN
+
+        if self.state == HALF_OPEN and self._probe_in_flight:
+            raise ModelSaturatedError(f"Model {self.model_id} is saturated; waiting for a probe request to succeed")
+
+    def _try_acquire(self):
+        """
+        Take a slot if one is free
+
+        Returns:
+            bool or None: None if no slot is free, otherwise whether the
+            slot is the probe of a half-open circuit
+        """
+        now = time.monotonic()
+        self._prune(now)
+        self._check_breaker(now)
+
+        if self.in_flight >= max(self.min_limit, int(self.limit)):
+            return None
+        if self.tokens_per_minute and self._tokens_in_window() >= self.tokens_per_minute:
+            return None
+
+        probe = self.state == HALF_OPEN
+        if probe:
+            self._probe_in_flight = True
+        self.in_flight += 1
+        self._requests.append((now, 1))
+        return probe
+
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        """
+        Wait for a request slot
+
+        Args:
+            timeout: Longest wait in seconds
+
+        Returns:
+            bool: True if the slot is the probe of a half-open circuit
+
+        Raises:
+            ModelSaturatedError: If the circuit is open or no slot freed up in time
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                probe = self._try_acquire()
+                if probe is not None:
+                    return probe
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ModelSaturatedError(f"Model {self.model_id} is saturated; no request slot within {timeout:.0f}s")
+                # Token limits free up as samples age out, so wake up periodically
+                self._condition.wait(min(remaining, 1.0))
+
+    async def acquire_async(self, timeout=ACQUIRE_TIMEOUT):
+        """
+        Wait for a request slot without blocking the event loop
+
+        The coroutine sleeps on an event that release() sets from whichever
+        thread frees the slot.
+
+        Args:
+            timeout: Longest wait in seconds
+
+        Returns:
+            bool: True if the slot is the probe of a half-open circuit
+
+        Raises:
+            ModelSaturatedError: If the circuit is open or no slot freed up in time
+        """
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        while True:
+            waiter = (loop, asyncio.Event())
+            with self._condition:
+                probe = self._try_acquire()
+                if probe is not None:
+                    return probe
+                self._async_waiters.add(waiter)
+            try:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ModelSaturatedError(f"Model {self.model_id} is saturated; no request slot within {timeout:.0f}s")
+                # Token limits free up as samples age out, so wake up periodically
+                await asyncio.wait_for(waiter[1].wait(), min(remaining, 1.0))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._condition:
+                    self._async_waiters.discard(waiter)
+
+    def _wake_async_waiters(self):
+        """
+        Wake every acquire_async() waiting for a slot, from any thread
+
+        Must be called with the condition held.
+        """
+        for loop, event in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's loop has been closed
+                pass
+        self._async_waiters.clear()
+
+    def record_tokens(self, tokens):
+        """
+        Count the input and output tokens of a request against the token rate
+        """
+        if tokens:
+            with self._condition:
+                self._tokens.append((time.monotonic(), tokens))
+
+    def release(self, throttled=False, probe=False, cancelled=False, failed=False, server_error=False):
+        """
+        Give a slot back and adjust the limit
+
+        Only a success grows the limit or closes a half-open circuit. A
+        failed probe opens the circuit again.
+
+        Args:
+            throttled: Whether the request was throttled
+            probe: Whether the slot is the probe returned by acquire()
+            cancelled: Whether the request was abandoned before it finished,
+                so it tells nothing about the model's capacity
+            failed: Whether the request failed for another reason
+            server_error: Whether that failure was on the service side, which
+                counts toward opening the circuit like throttling
+        """
+        with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+
+            if probe:
+                # The next request becomes the probe if this one was cancelled
+                self._probe_in_flight = False
+
+            if cancelled:
+                pass
+            elif throttled or server_error:
+                self.consecutive_failures += 1
+                if throttled:
+                    self._throttles.append((now, 1))
+                    if now - self._last_decrease >= DECREASE_COOLDOWN:
+                        self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                        self._last_decrease = now
+                if probe or self.consecutive_failures >= BREAKER_THRESHOLD:
+                    self.state = OPEN
+                    self.opened_at = now
+            elif failed:
+                if probe:
+                    self.state = OPEN
+                    self.opened_at = now
+            else:
+                self.consecutive_failures = 0
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                if probe and self.state == HALF_OPEN:
+                    self.state = CLOSED
+
+            self._condition.notify_all()
+            self._wake_async_waiters()
+
+    def _after_failure(self, error, attempt, max_attempts, probe=False):
+        """
+        Release the slot of a failed attempt and decide whether to retry
+
+        Returns:
+            float: Seconds to wait before the next attempt
+
+        Raises:
+            The error, or ModelSaturatedError, if there is no retry
+        """
+        outcome = failure_outcome(error)
+        self.release(probe=probe, **outcome)
+
+        if not is_retryable_error(error) or attempt >= max_attempts or not retry_budget.withdraw():
+            if self.state == OPEN and (outcome['throttled'] or outcome['server_error']):
+                raise ModelSaturatedError(f"Model {self.model_id} is saturated: {error}") from error
+            raise error
+        return backoff_delay(attempt)
+
+    def call(self, request, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Send a request in a slot, retrying throttled and transient failures
+
+        The slot is still held when the result is returned, so a streamed
+        response counts as in flight until it has been read. The caller
+        must call release() with the returned probe flag afterwards.
+
+        Args:
+            request: Function sending the request
+            max_attempts: Maximum attempts, first one included
+
+        Returns:
+            tuple: (result of request(), whether the slot is the probe)
+        """
+        attempt = 0
+        while True:
+            probe = self.acquire()
+            retry_budget.deposit()
+            attempt += 1
+            try:
+                return request(), probe
+            except Exception as e:
+                time.sleep(self._after_failure(e, attempt, max_attempts, probe))
+            except BaseException:
+                self.release(probe=probe, cancelled=True)
+                raise
+
+    async def call_async(self, request, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Send a request from the event loop in a slot, with retries
+
+        Args:
+            request: Function returning an awaitable that sends the request
+            max_attempts: Maximum attempts, first one included
+
+        Returns:
+            tuple: (result of the awaited request, whether the slot is the
+            probe), with the slot still held
+        """
+        attempt = 0
+        while True:
+            probe = await self.acquire_async()
+            retry_budget.deposit()
+            attempt += 1
+            try:
+                return await request(), probe
+            except Exception as e:
+                await asyncio.sleep(self._after_failure(e, attempt, max_attempts, probe))
+            except BaseException:
+                self.release(probe=probe, cancelled=True)
+                raise
+
+    @contextmanager
+    def request(self, send, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Send a request with call() and hold its slot while the response is read
+
+        Args:
+            send: Function sending the request
+            max_attempts: Maximum attempts, first one included
+
+        Yields:
+            Result of send()
+        """
+        response, probe = self.call(send, max_attempts)
+        outcome = {}
+        try:
+            yield response
+        except Exception as e:
+            outcome = failure_outcome(e)
+            raise
+        except BaseException:
+            # Closed or cancelled before the response was read, like the
+            # losing stream of a hedged request
+            outcome = {'cancelled': True}
+            raise
+        finally:
+            self.release(probe=probe, **outcome)
+
+    @asynccontextmanager
+    async def request_async(self, send, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Send a request with call_async() and hold its slot while the response is read
+
+        Args:
+            send: Function returning an awaitable that sends the request
+            max_attempts: Maximum attempts, first one included
+
+        Yields:
+            Result of the awaited request
+        """
+        response, probe = await self.call_async(send, max_attempts)
+        outcome = {}
+        try:
+            yield response
+        except Exception as e:
+            outcome = failure_outcome(e)
+            raise
+        except BaseException:
+            # Closed or cancelled before the response was read, like the
+            # losing stream of a hedged request
+            outcome = {'cancelled': True}
+            raise
+        finally:
+            self.release(probe=probe, **outcome)
+
+    def snapshot(self):
+        """
+        Get the state of the limiter
+        """
+        with self._condition:
+            now = time.monotonic()
+            self._prune(now)
+            requests = len(self._requests)
+            throttles = len(self._throttles)
+            return {
+                'model_id': self.model_id,
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'requests_per_minute': requests,
+                'throttles_per_minute': throttles,
+                'throttle_rate': round(throttles / requests, 4) if requests else 0,
+                'tokens_per_minute': self._tokens_in_window(),
+                'tokens_per_minute_limit': self.tokens_per_minute,
+                'open_for': round(max(0.0, BREAKER_COOLDOWN - (now - self.opened_at)), 1) if self.state == OPEN else 0
+            }
+
+# Process-wide retry budget and limiters, keyed by model ID
+retry_budget = RetryBudget()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_model_limiter(model_id):
+    """
+    Get the shared limiter of a model
+
+    Args:
+        model_id: Bedrock model ID
+
+    Returns:
+        ModelLimiter: Limiter of the model
+    """
+    limiter = _limiters.get(model_id)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(model_id, ModelLimiter(model_id))
+    return limiter
+
+def get_limiter_metrics():
+    """
+    Get the state of every model limiter and of the retry budget
+
+    Returns:
+        dict: Limiter snapshots and the retry budget
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {
+        'models': [limiter.snapshot() for limiter in limiters],
+        'retry_budget': retry_budget.snapshot()
+    }
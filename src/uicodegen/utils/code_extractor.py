@@ -1,72 +1,169 @@
 """
 Utility for extracting code blocks from AI model responses
 """
-import re
+
+# Marker opening and closing a code block
+FENCE = "```"
+
+# Artifact of each fence label
+FENCE_ARTIFACTS = {
+    "html": "html",
+    "css": "css",
+    "javascript": "js",
+    "js": "js"
+}
+
+# Name of each artifact in debug logs
+ARTIFACT_NAMES = {
+    "html": "HTML",
+    "css": "CSS",
+    "js": "JavaScript"
+}
+
+# Events reported by CodeFenceTokenizer.feed
+BLOCK_OPENED = "block_opened"
+BLOCK_CLOSED = "block_closed"
+
+def _is_label_char(char):
+    return char.isalnum() or char in "-_+"
+
+class CodeFenceTokenizer:
+    """
+    Incremental parser for the code blocks of a streamed response
+
+    Every delta is scanned once. Only the first block of each artifact
+    (html, css, js) is collected, in its own buffer; the text between
+    blocks and the content of other blocks is dropped.
+    """
+
+    def __init__(self):
+        self.length = 0
+        self.head = ""
+        self.blocks = {}
+        self.open_label = None
+        self._open_artifact = None
+        self._buffer = []
+        self._pending = ""
+
+    def feed(self, text):
+        """
+        Consume the next part of the response
+
+        Args:
+            text (str): Text delta
+
+        Returns:
+            list: (event, artifact) tuples for the first block of each
+            artifact that opened or closed in this delta
+        """
+        self.length += len(text)
+        if len(self.head) < 100:
+            self.head += text[:100 - len(self.head)]
+
+        data = self._pending + text
+        self._pending = ""
+        events = []
+        pos = 0
+
+        while True:
+            index = data.find(FENCE, pos)
+
+            if self.open_label is None:
+                # Outside a block; a fence and its label open the next one
+                if index < 0:
+                    self._pending = self._trailing_backticks(data, pos)
+                    return events
+
+                label_end = index + len(FENCE)
+                while label_end < len(data) and _is_label_char(data[label_end]):
+                    label_end += 1
+                if label_end == len(data):
+                    # The label may continue in the next delta
+                    self._pending = data[index:]
+                    return events
+
+                self.open_label = data[index + len(FENCE):label_end].lower()
+                artifact = FENCE_ARTIFACTS.get(self.open_label)
+                if artifact and artifact not in self.blocks:
+                    self._open_artifact = artifact
+                    events.append((BLOCK_OPENED, artifact))
+                pos = label_end
+            else:
+                # Inside a block; everything up to the next fence is code
+                if index < 0:
+                    pending = self._trailing_backticks(data, pos)
+                    self._append(data[pos:len(data) - len(pending)])
+                    self._pending = pending
+                    return events
+
+                self._append(data[pos:index])
+                if self._open_artifact:
+                    self.blocks[self._open_artifact] = "".join(self._buffer).strip()
+                    events.append((BLOCK_CLOSED, self._open_artifact))
+                self.open_label = None
+                self._open_artifact = None
+                self._buffer = []
+                pos = index + len(FENCE)
+
+    @staticmethod
+    def _trailing_backticks(data, pos):
+        """
+        Get the backticks at the end of the data that may start a fence
+        """
+        count = 0
+        while count < len(FENCE) - 1 and len(data) - count > pos and data[len(data) - count - 1] == "`":
+            count += 1
+        return data[len(data) - count:] if count else ""
+
+    def _append(self, text):
+        if self._open_artifact and text:
+            self._buffer.append(text)
+
+    def get_code(self, artifact):
+        """
+        Get the code of an artifact's closed block
+
+        Returns:
+            str: Stripped code, or "" if the block has not closed
+        """
+        return self.blocks.get(artifact, "")
+
+    def extract(self, debug_file=None):
+        """
+        Get the code of every artifact from the text consumed so far
+
+        Blocks that never closed count as missing.
+
+        Args:
+            debug_file (file): Optional file-like object for debug logging
+
+        Returns:
+            tuple: (html_code, css_code, js_code)
+        """
+        if debug_file:
+            debug_file.write(f"Input text length: {self.length}\n")
+            debug_file.write(f"First 100 chars: {self.head}\n\n")
+
+            for artifact, name in ARTIFACT_NAMES.items():
+                code = self.get_code(artifact)
+                if code:
+                    debug_file.write(f"Found {name} code ({len(code)} chars)\n")
+                else:
+                    debug_file.write(f"No {name} code found\n")
+
+        return self.get_code("html"), self.get_code("css"), self.get_code("js")
 
 def extract_code_from_text(text, debug_file=None):
     """
     Extract HTML, CSS, and JavaScript code blocks from text
-    
+
     Args:
         text (str): Text containing code blocks
         debug_file (file): Optional file-like object for debug logging
-        
+
     Returns:
         tuple: (html_code, css_code, js_code)
     """
-    # Initialize empty code blocks
-    html_code = ""
-    css_code = ""
-    js_code = ""
-    
-    # Log the input text length if debug file is provided
-    if debug_file:
-        debug_file.write(f"Input text length: {len(text)}\n")
-        debug_file.write(f"First 100 chars: {text[:100]}\n\n")
-    
-    # Extract HTML code
-    html_pattern = r"```html\s*(.*?)```"
-    html_matches = re.findall(html_pattern, text, re.DOTALL)
-    
-    if html_matches:
-        html_code = html_matches[0].strip()
-        if debug_file:
-            debug_file.write(f"Found HTML code ({len(html_code)} chars)\n")
-    else:
-        if debug_file:
-            debug_file.write("No HTML code found\n")
-    
-    # Extract CSS code
-    css_pattern = r"```css\s*(.*?)```"
-    css_matches = re.findall(css_pattern, text, re.DOTALL)
-    
-    if css_matches:
-        css_code = css_matches[0].strip()
-        if debug_file:
-            debug_file.write(f"Found CSS code ({len(css_code)} chars)\n")
-    else:
-        if debug_file:
-            debug_file.write("No CSS code found\n")
-    
-    # Extract JavaScript code
-    js_pattern = r"```javascript\s*(.*?)```"
-    js_matches = re.findall(js_pattern, text, re.DOTALL)
-    
-    if js_matches:
-        js_code = js_matches[0].strip()
-        if debug_file:
-            debug_file.write(f"Found JavaScript code ({len(js_code)} chars)\n")
-    else:
-        # Try alternative pattern for JavaScript
-        js_pattern = r"```js\s*(.*?)```"
-        js_matches = re.findall(js_pattern, text, re.DOTALL)
-        
-        if js_matches:
-            js_code = js_matches[0].strip()
-            if debug_file:
-                debug_file.write(f"Found JavaScript code using alternative pattern ({len(js_code)} chars)\n")
-        else:
-            if debug_file:
-                debug_file.write("No JavaScript code found\n")
-    
-    return html_code, css_code, js_code
+    tokenizer = CodeFenceTokenizer()
+    tokenizer.feed(text)
+    return tokenizer.extract(debug_file)
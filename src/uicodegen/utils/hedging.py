@@ -0,0 +1,340 @@
+"""
+Hedged model streams for cutting time-to-first-token tail latency
+
+When the first token of a stream is later than a percentile of the model's
+recent time to first token (TTFT), a duplicate request is sent to a hedge
+target. Whichever stream yields a token first is kept and the other one is
+cancelled.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# Hedging is off unless BEDROCK_HEDGING is set to 1
+BEDROCK_HEDGING = os.environ.get('BEDROCK_HEDGING', '0')
+
+# Percentile of recent TTFT after which a hedge is sent
+HEDGE_PERCENTILE = float(os.environ.get('BEDROCK_HEDGE_PERCENTILE', 95))
+
+# TTFT samples kept per model, and needed before hedging starts
+TTFT_SAMPLES = 200
+MIN_TTFT_SAMPLES = 20
+
+# Item kinds passed from the stream runners to the consumer
+ITEM = 'item'
+DONE = 'done'
+ERROR = 'error'
+
+def _any_item(item):
+    return True
+
+def hedging_enabled():
+    """
+    Check whether hedging is turned on
+    """
+    return BEDROCK_HEDGING.lower() in ('1', 'true', 'on')
+
+class TtftTracker:
+    """
+    Recent time-to-first-token samples and hedge counters per model
+    """
+
+    def __init__(self, size=TTFT_SAMPLES):
+        self.size = size
+        self._samples = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_id, seconds):
+        """
+        Add a TTFT sample of a model
+        """
+        with self._lock:
+            self._samples.setdefault(model_id, deque(maxlen=self.size)).append(seconds)
+
+    def count(self, model_id, name):
+        """
+        Increase a hedge counter of a model
+        """
+        with self._lock:
+            counters = self._counters.setdefault(model_id, {'hedges': 0, 'hedge_wins': 0})
+            counters[name] += 1
+
+    def percentile(self, model_id, percentile):
+        """
+        Get a percentile of the recent TTFT of a model
+
+        Returns:
+            float: TTFT in seconds, or None without enough samples
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(model_id, ()))
+        if len(samples) < MIN_TTFT_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[index]
+
+    def snapshot(self):
+        """
+        Get TTFT percentiles and hedge counters of every model
+        """
+        with self._lock:
+            model_ids = set(self._samples) | set(self._counters)
+            counters = {model_id: dict(self._counters.get(model_id, {'hedges': 0, 'hedge_wins': 0})) for model_id in model_ids}
+            samples = {model_id: len(self._samples.get(model_id, ())) for model_id in model_ids}
+        return [
+            dict(
+                model_id=model_id,
+                samples=samples[model_id],
+                p50=self.percentile(model_id, 50),
+                p99=self.percentile(model_id, 99),
+                hedge_after=self.percentile(model_id, HEDGE_PERCENTILE),
+                **counters[model_id]
+            )
+            for model_id in sorted(model_ids)
+        ]
+
+ttft_tracker = TtftTracker()
+
+def hedge_delay(model_id):
+    """
+    Get how long to wait for the first item before hedging
+
+    Args:
+        model_id: Model ID of the primary request
+
+    Returns:
+        float: Seconds, or None if hedging is off or there are too few samples
+    """
+    if not hedging_enabled():
+        return None
+    return ttft_tracker.percentile(model_id, HEDGE_PERCENTILE)
+
+def get_hedging_metrics():
+    """
+    Get TTFT percentiles and hedge counters of every model
+
+    Returns:
+        dict: Hedging settings and per-model metrics
+    """
+    return {
+        'enabled': hedging_enabled(),
+        'percentile': HEDGE_PERCENTILE,
+        'models': ttft_tracker.snapshot()
+    }
+
+class _StreamRunner(threading.Thread):
+    """
+    Thread reading one stream into the shared item queue
+    """
+
+    def __init__(self, model_id, start, items):
+        super().__init__(daemon=True)
+        self.model_id = model_id
+        self.start_stream = start
+        self.items = items
+        self.started_at = time.monotonic()
+        self.cancelled = threading.Event()
+        # Items received before the first token
+        self.buffer = []
+
+    def run(self):
+        try:
+            stream = self.start_stream()
+            try:
+                for item in stream:
+                    if self.cancelled.is_set():
+                        break
+                    self.items.put((self, ITEM, item))
+            finally:
+                # Closing the generator releases its request and limiter slot
+                close = getattr(stream, 'close', None)
+                if close is not None:
+                    close()
+        except Exception as e:
+            self.items.put((self, ERROR, e))
+        else:
+            self.items.put((self, DONE, None))
+
+def hedged_stream(model_id, start, hedge_start=None, hedge_model_id=None, is_first_token=None):
+    """
+    Yield the items of a model stream, hedging when the first token is late
+
+    Without a hedge target, or while hedging is off, the stream is passed
+    through and only its TTFT is recorded.
+
+    Args:
+        model_id: Model ID of the primary request
+        start: Function starting the primary stream
+        hedge_start: Optional function starting the duplicate stream
+        hedge_model_id: Model ID of the duplicate request
+        is_first_token: Optional function telling whether an item carries
+            generated text; by default every item does. Items before the
+            first token, like message_start events, neither stop the hedge
+            timer nor pick the winning stream.
+
+    Yields:
+        Items of whichever stream yielded a token first
+    """
+    is_first_token = is_first_token or _any_item
+    delay = hedge_delay(model_id) if hedge_start is not None else None
+
+    if delay is None:
+        started_at = time.monotonic()
+        first = True
+        for item in start():
+            if first and is_first_token(item):
+                ttft_tracker.record(model_id, time.monotonic() - started_at)
+                first = False
+            yield item
+        return
+
+    items = queue.Queue()
+    runners = [_StreamRunner(model_id, start, items)]
+    runners[0].start()
+    failed = 0
+    winner = None
+
+    try:
+        while winner is None:
+            timeout = None
+            if len(runners) == 1:
+                timeout = max(0.0, runners[0].started_at + delay - time.monotonic())
+            try:
+                runner, kind, payload = items.get(timeout=timeout)
+            except queue.Empty:
+                hedge = _StreamRunner(hedge_model_id or model_id, hedge_start, items)
+                hedge.start()
+                runners.append(hedge)
+                ttft_tracker.count(model_id, 'hedges')
+                continue
+
+            if kind == ERROR:
+                # Keep waiting while another stream may still start
+                failed += 1
+                if failed < len(runners):
+                    continue
+                raise payload
+            if kind == ITEM and not is_first_token(payload):
+                runner.buffer.append(payload)
+                continue
+
+            winner = runner
+            ttft_tracker.record(winner.model_id, time.monotonic() - winner.started_at)
+            if winner is not runners[0]:
+                ttft_tracker.count(model_id, 'hedge_wins')
+            for other in runners:
+                if other is not winner:
+                    other.cancelled.set()
+
+        for item in winner.buffer:
+            yield item
+
+        while True:
+            if kind == ITEM:
+                yield payload
+            elif kind == DONE:
+                return
+            else:
+                raise payload
+
+            runner, kind, payload = items.get()
+            while runner is not winner:
+                runner, kind, payload = items.get()
+    finally:
+        for runner in runners:
+            runner.cancelled.set()
+
+async def hedged_stream_async(model_id, start, hedge_start=None, hedge_model_id=None, is_first_token=None):
+    """
+    Yield the items of an async model stream, hedging when the first token is late
+
+    Takes the same arguments as hedged_stream, with start functions that
+    return async generators. The losing stream is cancelled right away.
+
+    Yields:
+        Items of whichever stream yielded a token first
+    """
+    is_first_token = is_first_token or _any_item
+    delay = hedge_delay(model_id) if hedge_start is not None else None
+
+    if delay is None:
+        started_at = time.monotonic()
+        first = True
+        async for item in start():
+            if first and is_first_token(item):
+                ttft_tracker.record(model_id, time.monotonic() - started_at)
+                first = False
+            yield item
+        return
+
+    items = asyncio.Queue()
+
+    async def pump(runner, stream_start):
+        try:
+            async for item in stream_start():
+                await items.put((runner, ITEM, item))
+        except Exception as e:
+            await items.put((runner, ERROR, e))
+        else:
+            await items.put((runner, DONE, None))
+
+    def start_runner(runner_model_id, stream_start):
+        runner = {'model_id': runner_model_id, 'started_at': time.monotonic(), 'buffer': []}
+        runner['task'] = asyncio.ensure_future(pump(runner, stream_start))
+        return runner
+
+    runners = [start_runner(model_id, start)]
+    failed = 0
+    winner = None
+
+    try:
+        while winner is None:
+            timeout = None
+            if len(runners) == 1:
+                timeout = max(0.0, runners[0]['started_at'] + delay - time.monotonic())
+            try:
+                runner, kind, payload = await asyncio.wait_for(items.get(), timeout)
+            except asyncio.TimeoutError:
+                runners.append(start_runner(hedge_model_id or model_id, hedge_start))
+                ttft_tracker.count(model_id, 'hedges')
+                continue
+
+            if kind == ERROR:
+                # Keep waiting while another stream may still start
+                failed += 1
+                if failed < len(runners):
+                    continue
+                raise payload
+            if kind == ITEM and not is_first_token(payload):
+                runner['buffer'].append(payload)
+                continue
+
+            winner = runner
+            ttft_tracker.record(winner['model_id'], time.monotonic() - winner['started_at'])
+            if winner is not runners[0]:
+                ttft_tracker.count(model_id, 'hedge_wins')
+            for other in runners:
+                if other is not winner:
+                    other['task'].cancel()
+
+        for item in winner['buffer']:
+            yield item
+
+        while True:
+            if kind == ITEM:
+                yield payload
+            elif kind == DONE:
+                return
+            else:
+                raise payload
+
+            runner, kind, payload = await items.get()
+            while runner is not winner:
+                runner, kind, payload = await items.get()
+    finally:
+        for runner in runners:
+            runner['task'].cancel()
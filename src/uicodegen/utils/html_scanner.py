@@ -0,0 +1,257 @@
+"""
+Lightweight HTML tokenizer that records the source span of every token
+"""
+import re
+from collections import namedtuple
+
+# Token kinds
+TEXT = 'text'
+START_TAG = 'start'
+END_TAG = 'end'
+OTHER = 'other'
+
+# A token of the source document. start and end are offsets into the whole
+# document, raw is the exact source text between them. For text tokens,
+# parent is the enclosing element name and hidden tells whether that element
+# is styled display:none. For tags, name is the lower-cased tag name.
+HtmlToken = namedtuple('HtmlToken', ['kind', 'start', 'end', 'raw', 'name', 'parent', 'hidden'])
+
+# Elements that never have content or an end tag
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+])
+
+# Elements whose content is text up to the matching end tag
+RAW_TEXT_ELEMENTS = frozenset(['script', 'style', 'textarea', 'title'])
+
+# Start tags that implicitly close an open element of the listed names
+IMPLIED_END_TAGS = {
+    'p': frozenset(['p']),
+    'li': frozenset(['li']),
+    'option': frozenset(['option']),
+    'dt': frozenset(['dt', 'dd']),
+    'dd': frozenset(['dt', 'dd']),
+    'tr': frozenset(['tr', 'td', 'th']),
+    'td': frozenset(['td', 'th']),
+    'th': frozenset(['td', 'th'])
+}
+
+# Longest malformed tag the incremental scanner waits for before giving up
+MAX_TAG_LENGTH = 64 * 1024
+
+# Raw text elements whose content is opaque, so a long one may be reported in
+# several text tokens instead of being buffered up to its end tag
+SPLITTABLE_RAW_TEXT_ELEMENTS = frozenset(['script', 'style'])
+
+# Buffered content of a splittable raw text element that is reported early
+RAW_TEXT_FLUSH_SIZE = 64 * 1024
+
+TAG_OPEN_PATTERN = re.compile(r"<[a-zA-Z/!?]")
+START_TAG_PATTERN = re.compile(r"<([a-zA-Z][^\s/>]*)((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>")
+END_TAG_PATTERN = re.compile(r"</([a-zA-Z][^\s/>]*)[^>]*>")
+STYLE_ATTR_PATTERN = re.compile(r"(?:^|\s)style\s*=\s*(?:\"([^\"]*)\"|'([^']*)'|([^\s>]+))", re.IGNORECASE)
+
+class HtmlScanner:
+    """
+    Incremental HTML tokenizer
+
+    Feed the document in pieces with feed() and finish with close(). Tokens
+    are only emitted once they are complete, so a construct split across
+    two pieces is reported once, with offsets into the whole document.
+    """
+
+    def __init__(self):
+        """
+        Initialize the scanner
+        """
+        self._buffer = ""
+        self._base = 0
+        self._stack = []
+        self._raw_text_tag = None
+        self._raw_text_end = None
+        # Document offset the search for the raw text end tag resumes from
+        self._raw_text_resume = 0
+
+    def feed(self, data):
+        """
+        Add data to the document and return the tokens it completes
+
+        Args:
+            data (str): Next piece of the document
+
+        Returns:
+            list: Complete HtmlToken objects, in document order
+        """
+        self._buffer += data
+        return self._scan(final=False)
+
+    @property
+    def offset(self):
+        """
+        Document offset of the first character no token has covered yet
+        """
+        return self._base
+
+    def close(self):
+        """
+        Finish the document and return the remaining tokens
+
+        Returns:
+            list: Remaining HtmlToken objects, in document order
+        """
+        return self._scan(final=True)
+
+    def _parent(self):
+        """
+        Get the name and hidden flag of the innermost open element
+        """
+        if self._stack:
+            return self._stack[-1]
+        return ('[document]', False)
+
+    def _text(self, tokens, start, end):
+        """
+        Emit a text token for buffer[start:end]
+        """
+        if end > start:
+            parent, hidden = self._parent()
+            tokens.append(HtmlToken(
+                TEXT, self._base + start, self._base + end, self._buffer[start:end], None, parent, hidden
+            ))
+
+    def _start_tag(self, name, attrs):
+        """
+        Update the element stack for a start tag
+        """
+        implied = IMPLIED_END_TAGS.get(name)
+        if implied and self._stack and self._stack[-1][0] in implied:
+            self._stack.pop()
+
+        if name in VOID_ELEMENTS or attrs.rstrip().endswith('/'):
+            return
+
+        hidden = False
+        style = STYLE_ATTR_PATTERN.search(attrs)
+        if style:
+            hidden = next(group for group in style.groups() if group is not None) == "display:none;"
+
+        self._stack.append((name, hidden))
+        if name in RAW_TEXT_ELEMENTS:
+            self._raw_text_tag = name
+            self._raw_text_end = re.compile(r"</" + name + r"[\s/>]", re.IGNORECASE)
+            self._raw_text_resume = 0
+
+    def _end_tag(self, name):
+        """
+        Update the element stack for an end tag
+        """
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index][0] == name:
+                del self._stack[index:]
+                return
+
+    def _scan(self, final):
+        """
+        Tokenize as much of the buffer as possible
+        """
+        buffer = self._buffer
+        length = len(buffer)
+        tokens = []
+        pos = 0
+
+        while pos < length:
+            # Content of script, style, textarea and title runs to its end tag
+            if self._raw_text_tag:
+                match = self._raw_text_end.search(buffer, max(pos, self._raw_text_resume - self._base))
+                if match is None:
+                    if not final:
+                        # Only the last few characters can start the end tag,
+                        # so the next piece does not search everything again
+                        keep = len(self._raw_text_tag) + 3
+                        if self._raw_text_tag in SPLITTABLE_RAW_TEXT_ELEMENTS and length - pos > RAW_TEXT_FLUSH_SIZE:
+                            self._text(tokens, pos, length - keep)
+                            pos = length - keep
+                        self._raw_text_resume = self._base + max(pos, length - keep)
+                        break
+                    self._text(tokens, pos, length)
+                    pos = length
+                    break
+                self._text(tokens, pos, match.start())
+                pos = match.start()
+                self._raw_text_tag = None
+
+            match = TAG_OPEN_PATTERN.search(buffer, pos)
+            if match is None:
+                # Trailing text may continue in the next piece
+                if final:
+                    self._text(tokens, pos, length)
+                    pos = length
+                break
+
+            tag_start = match.start()
+            self._text(tokens, pos, tag_start)
+            pos = tag_start
+
+            if buffer.startswith('<!--', pos):
+                end = buffer.find('-->', pos + 4)
+                end = end + 3 if end != -1 else -1
+            elif buffer.startswith('<![CDATA[', pos):
+                end = buffer.find(']]>', pos + 9)
+                end = end + 3 if end != -1 else -1
+            elif buffer[pos + 1] in '!?':
+                end = buffer.find('>', pos + 2)
+                end = end + 1 if end != -1 else -1
+            else:
+                end = None
+
+            if end is not None:
+                if end == -1:
+                    if not final:
+                        break
+                    end = length
+                tokens.append(HtmlToken(OTHER, self._base + pos, self._base + end, buffer[pos:end], None, None, None))
+                pos = end
+                continue
+
+            is_end_tag = buffer[pos + 1] == '/'
+            match = (END_TAG_PATTERN if is_end_tag else START_TAG_PATTERN).match(buffer, pos)
+
+            if match is None:
+                # Unterminated or malformed tag
+                close = buffer.find('>', pos)
+                if not final and (close == -1 or length - pos < MAX_TAG_LENGTH):
+                    break
+                end = close + 1 if close != -1 else length
+                tokens.append(HtmlToken(OTHER, self._base + pos, self._base + end, buffer[pos:end], None, None, None))
+                pos = end
+                continue
+
+            name = match.group(1).lower()
+            end = match.end()
+            if is_end_tag:
+                self._end_tag(name)
+                kind = END_TAG
+            else:
+                self._start_tag(name, match.group(2))
+                kind = START_TAG
+            tokens.append(HtmlToken(kind, self._base + pos, self._base + end, buffer[pos:end], name, None, None))
+            pos = end
+
+        # Keep only the unprocessed tail
+        self._buffer = buffer[pos:]
+        self._base += pos
+        return tokens
+
+def scan_html(html_content):
+    """
+    Tokenize a complete HTML document
+
+    Args:
+        html_content (str): HTML document
+
+    Returns:
+        list: HtmlToken objects, in document order
+    """
+    scanner = HtmlScanner()
+    return scanner.feed(html_content) + scanner.close()
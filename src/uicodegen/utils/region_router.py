@@ -0,0 +1,215 @@
+"""
+Latency-aware routing of Bedrock requests across regions
+
+The router keeps exponentially weighted moving averages (EWMA) of time to
+first token, output tokens per second and error rate for every region and
+model, and of the latency per output token of non-streaming responses. New jobs go to the region with the lowest expected latency, and a
+region that throttles or fails is skipped for a cooldown period.
+"""
+import threading
+import time
+
+# Weight of the newest sample in the moving averages
+EWMA_ALPHA = 0.2
+
+# Seconds a region is skipped after throttling or a regional error
+REGION_COOLDOWN = 30.0
+
+# Output tokens of a typical response, to weigh throughput against TTFT
+REFERENCE_OUTPUT_TOKENS = 500
+
+# How much an error rate of 1 multiplies the expected latency
+ERROR_PENALTY = 4.0
+
+def ewma(average, sample, alpha=EWMA_ALPHA):
+    """
+    Fold a sample into a moving average, which starts at the first sample
+    """
+    if average is None:
+        return sample
+    return average + alpha * (sample - average)
+
+class RegionStats:
+    """
+    Moving averages of one region and model
+    """
+
+    def __init__(self):
+        self.ttft = None
+        self.tokens_per_second = None
+        self.seconds_per_token = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def expected_latency(self):
+        """
+        Get the expected seconds of a typical response, None if nothing is known
+
+        Streamed responses are timed by TTFT and throughput; regions that
+        only served non-streaming requests by their latency per token.
+        """
+        if self.ttft is None:
+            if self.seconds_per_token is None:
+                return None
+            return REFERENCE_OUTPUT_TOKENS * self.seconds_per_token * (1 + ERROR_PENALTY * self.error_rate)
+        latency = self.ttft
+        if self.tokens_per_second:
+            latency += REFERENCE_OUTPUT_TOKENS / self.tokens_per_second
+        return latency * (1 + ERROR_PENALTY * self.error_rate)
+
+class RegionRouter:
+    """
+    Picks the region of each request from live per-region statistics
+    """
+
+    def __init__(self, regions):
+        """
+        Initialize the router
+
+        Args:
+            regions: Regions to route between, in order of preference
+        """
+        self.regions = list(regions)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get_stats(self, region, model_id):
+        return self._stats.setdefault((region, model_id), RegionStats())
+
+    def rank(self, model_id):
+        """
+        Order the regions from best to worst for a model
+
+        Regions without measurements come first, so each one is tried;
+        regions cooling down after an error come last.
+
+        Args:
+            model_id: Bedrock model ID
+
+        Returns:
+            list: Region names
+        """
+        now = time.monotonic()
+        with self._lock:
+            def key(item):
+                index, region = item
+                stats = self._get_stats(region, model_id)
+                latency = stats.expected_latency()
+                return (stats.cooldown_until > now, latency is not None, latency or 0, index)
+
+            return [region for _, region in sorted(enumerate(self.regions), key=key)]
+
+    def best_region(self, model_id):
+        """
+        Get the region a new job for a model should use
+        """
+        return self.rank(model_id)[0]
+
+    def next_region(self, region, model_id):
+        """
+        Get the region to fail over to from a region
+
+        Returns:
+            str: Best other region, or None if there is only one region
+        """
+        for candidate in self.rank(model_id):
+            if candidate != region:
+                return candidate
+        return None
+
+    def record_success(self, region, model_id, ttft=None):
+        """
+        Record a successful request
+
+        Args:
+            region: Region of the request
+            model_id: Bedrock model ID
+            ttft: Seconds until the first token, if already known
+        """
+        with self._lock:
+            stats = self._get_stats(region, model_id)
+            stats.requests += 1
+            stats.error_rate = ewma(stats.error_rate, 0.0)
+            if ttft is not None:
+                stats.ttft = ewma(stats.ttft, ttft)
+
+    def record_ttft(self, region, model_id, ttft):
+        """
+        Record the time to first token of a streamed response
+
+        Args:
+            region: Region of the request
+            model_id: Bedrock model ID
+            ttft: Seconds from sending the request to its first text delta
+        """
+        with self._lock:
+            stats = self._get_stats(region, model_id)
+            stats.ttft = ewma(stats.ttft, ttft)
+
+    def record_throughput(self, region, model_id, output_tokens, seconds):
+        """
+        Record the generation speed of a finished response
+
+        Args:
+            region: Region of the request
+            model_id: Bedrock model ID
+            output_tokens: Output tokens of the response
+            seconds: Decode time, from the first text delta to the end
+        """
+        if output_tokens and seconds > 0:
+            with self._lock:
+                stats = self._get_stats(region, model_id)
+                stats.tokens_per_second = ewma(stats.tokens_per_second, output_tokens / seconds)
+
+    def record_latency(self, region, model_id, output_tokens, seconds):
+        """
+        Record the latency of a finished non-streaming response
+
+        The whole response arrives at once, so its latency is normalised by
+        the output tokens instead of being split into TTFT and throughput.
+        """
+        if seconds > 0:
+            with self._lock:
+                stats = self._get_stats(region, model_id)
+                stats.seconds_per_token = ewma(stats.seconds_per_token, seconds / max(output_tokens, 1))
+
+    def record_failure(self, region, model_id, cooldown=True):
+        """
+        Record a failed request
+
+        Args:
+            region: Region of the request
+            model_id: Bedrock model ID
+            cooldown: Whether the failure was throttling or a regional error,
+                which takes the region out of rotation for a while
+        """
+        with self._lock:
+            stats = self._get_stats(region, model_id)
+            stats.requests += 1
+            stats.failures += 1
+            stats.error_rate = ewma(stats.error_rate, 1.0)
+            if cooldown:
+                stats.cooldown_until = time.monotonic() + REGION_COOLDOWN
+
+    def snapshot(self):
+        """
+        Get the statistics of every region and model
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'region': region,
+                    'model_id': model_id,
+                    'ttft': round(stats.ttft, 3) if stats.ttft is not None else None,
+                    'tokens_per_second': round(stats.tokens_per_second, 1) if stats.tokens_per_second else None,
+                    'seconds_per_token': round(stats.seconds_per_token, 4) if stats.seconds_per_token is not None else None,
+                    'error_rate': round(stats.error_rate, 4),
+                    'requests': stats.requests,
+                    'failures': stats.failures,
+                    'cooling_down_for': round(max(0.0, stats.cooldown_until - now), 1)
+                }
+                for (region, model_id), stats in self._stats.items()
+            ]
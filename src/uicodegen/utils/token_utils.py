@@ -0,0 +1,40 @@
+"""
+Utility functions for estimating token counts
+"""
+import re
+
+# Han, kana and Hangul characters are roughly one token each
+CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+
+# Approximate characters per token for each class of characters
+ASCII_CHARS_PER_TOKEN = 4.0
+NON_ASCII_CHARS_PER_TOKEN = 2.5
+CJK_CHARS_PER_TOKEN = 1.0
+
+def estimate_tokens(text):
+    """
+    Roughly estimate the number of tokens in a text
+
+    ASCII text averages about four characters per token, other alphabets
+    (Cyrillic, Thai, Arabic, accented Latin) about two and a half, and CJK
+    characters about one.
+
+    Args:
+        text (str): Text to estimate
+
+    Returns:
+        int: Estimated token count
+    """
+    if text.isascii():
+        return max(1, round(len(text) / ASCII_CHARS_PER_TOKEN))
+
+    ascii_chars = sum(1 for char in text if char < '\x80')
+    cjk_chars = len(CJK_PATTERN.findall(text))
+    other_chars = len(text) - ascii_chars - cjk_chars
+
+    tokens = (
+        ascii_chars / ASCII_CHARS_PER_TOKEN
+        + other_chars / NON_ASCII_CHARS_PER_TOKEN
+        + cjk_chars / CJK_CHARS_PER_TOKEN
+    )
+    return max(1, round(tokens))
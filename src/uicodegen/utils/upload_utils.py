@@ -0,0 +1,74 @@
+"""
+Utility functions for streaming request bodies to disk
+"""
+import zlib
+
+# Bytes copied from the request at a time
+UPLOAD_BLOCK_SIZE = 64 * 1024
+
+# Content encodings accepted for uploaded documents
+SUPPORTED_CONTENT_ENCODINGS = ('', 'identity', 'gzip', 'x-gzip', 'deflate')
+
+class UploadTooLargeError(ValueError):
+    """Raised when a decoded upload exceeds the allowed size"""
+
+def save_request_stream(stream, file_path, content_encoding=None, max_size=None, block_size=UPLOAD_BLOCK_SIZE):
+    """
+    Copy a request body to a file, decompressing it on the fly
+
+    The body is copied block by block, so memory use does not depend on
+    the size of the upload.
+
+    Args:
+        stream: Readable binary stream of the request body
+        file_path (str): Path to write the decoded body to
+        content_encoding (str): Content-Encoding header of the request
+        max_size (int): Optional limit on the decoded size in bytes
+        block_size (int): Bytes read from the stream at a time
+
+    Returns:
+        int: Number of decoded bytes written
+
+    Raises:
+        ValueError: If the content encoding is not supported
+        UploadTooLargeError: If the decoded body exceeds max_size
+    """
+    encoding = (content_encoding or '').strip().lower()
+    if encoding not in SUPPORTED_CONTENT_ENCODINGS:
+        raise ValueError(f"Unsupported content encoding: {content_encoding}")
+
+    decompressor = None
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        # Detect gzip and zlib headers automatically
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+
+    written = 0
+    with open(file_path, 'wb') as f:
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+
+            if decompressor:
+                # Bound each output so a small compressed block cannot expand unchecked
+                data = decompressor.decompress(block, block_size)
+                while data:
+                    written += len(data)
+                    if max_size and written > max_size:
+                        raise UploadTooLargeError(f"Decoded upload exceeds {max_size} bytes")
+                    f.write(data)
+                    data = decompressor.decompress(decompressor.unconsumed_tail, block_size)
+            else:
+                written += len(block)
+                if max_size and written > max_size:
+                    raise UploadTooLargeError(f"Upload exceeds {max_size} bytes")
+                f.write(block)
+
+        if decompressor:
+            data = decompressor.flush()
+            written += len(data)
+            if max_size and written > max_size:
+                raise UploadTooLargeError(f"Decoded upload exceeds {max_size} bytes")
+            f.write(data)
+
+    return written
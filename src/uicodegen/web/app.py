@@ -1,13 +1,27 @@
 import os
 import sys
-from flask import Flask, render_template
+from flask import Flask, Request, current_app, render_template
 
 # Add the project root directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from uicodegen.core.session_manager import SessionManager
+from uicodegen.core.model_registry import model_registry
+from uicodegen.core.translation_memory import configure_translation_memory
 from uicodegen.web.routes import init_app
 
+# Endpoints that stream large documents to disk
+LARGE_UPLOAD_ENDPOINTS = frozenset(['upload_html_translation'])
+
+class UploadRequest(Request):
+    """Request that allows larger bodies for streamed document uploads"""
+    
+    @property
+    def max_content_length(self):
+        if current_app and self.endpoint in LARGE_UPLOAD_ENDPOINTS:
+            return current_app.config['MAX_HTML_UPLOAD_LENGTH']
+        return super().max_content_length
+
 def create_app(test_config=None):
     """Create and configure the Flask application"""
     # Get the project root directory
@@ -16,13 +30,17 @@ def create_app(test_config=None):
     app = Flask(__name__, 
                 static_folder=os.path.join(project_root, 'generated'),
                 template_folder=os.path.join(project_root, 'templates'))
+    app.request_class = UploadRequest
     
     # Default configuration
     app.config.from_mapping(
         SECRET_KEY=os.environ.get('SECRET_KEY', 'dev_secret_key_change_in_production'),
         UPLOAD_FOLDER=os.path.join(project_root, 'uploads'),
         GENERATED_FOLDER=os.path.join(project_root, 'generated'),
-        MAX_CONTENT_LENGTH=16 * 1024 * 1024  # 16MB max upload
+        TRANSLATION_MEMORY_PATH=os.environ.get('TRANSLATION_MEMORY_PATH', os.path.join(project_root, 'translation_memory.db')),
+        MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16MB max upload
+        MAX_HTML_UPLOAD_LENGTH=100 * 1024 * 1024,  # 100MB max streamed HTML upload body
+        MAX_HTML_DOCUMENT_SIZE=200 * 1024 * 1024  # 200MB max decompressed HTML document
     )
     
     # Override config with test config if provided
@@ -33,10 +51,14 @@ def create_app(test_config=None):
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['GENERATED_FOLDER'], exist_ok=True)
     
+    # Point the shared translation memory at the configured database
+    configure_translation_memory(app.config['TRANSLATION_MEMORY_PATH'])
+    
     # Initialize session manager
     session_manager = SessionManager(
         upload_base_dir=app.config['UPLOAD_FOLDER'],
-        generated_base_dir=app.config['GENERATED_FOLDER']
+        generated_base_dir=app.config['GENERATED_FOLDER'],
+        on_complete=model_registry.record_session
     )
     
     # Initialize routes
@@ -1,29 +1,77 @@
+import io
 import os
+import json
 import threading
-from flask import Flask, request, render_template, jsonify, send_from_directory
+from flask import (
+    Flask, Response, request, render_template, jsonify, send_from_directory, send_file, stream_with_context
+)
 from werkzeug.utils import secure_filename
 
 from uicodegen.core.session_manager import SessionManager
-from uicodegen.core.processor import process_image
-from uicodegen.core.translator import translate_text
-from uicodegen.core.html_translator import translate_html
-from uicodegen.core.model_configs import MODEL_CONFIGS, DEFAULT_MODEL
-from uicodegen.core.language_configs import get_all_languages, DEFAULT_SOURCE_LANGUAGE, DEFAULT_TARGET_LANGUAGE
+from uicodegen.core.processor import process_image, process_image_streaming_async
+from uicodegen.core.translator import translate_text, translate_text_async
+from uicodegen.core.html_translator import translate_html, translate_html_file
+from uicodegen.core.model_configs import MODEL_CONFIGS
+from uicodegen.core.model_registry import (
+    AUTO_MODEL, CODEGEN_OUTPUT_TOKENS, TRANSLATION_EXPANSION, model_registry, parse_max_latency, resolve_model
+)
+from uicodegen.core.language_configs import get_all_languages, DEFAULT_TARGET_LANGUAGE
+from uicodegen.core.language_detector import AUTO_DETECT_LANGUAGE
+from uicodegen.core.translation_memory import get_translation_memory
+from uicodegen.utils.async_bedrock_client import async_available, run_on_loop
+from uicodegen.utils.bedrock_client import get_client_pool_metrics, get_region_metrics
+from uicodegen.utils.bedrock_limiter import get_limiter_metrics
+from uicodegen.utils.hedging import get_hedging_metrics
+from uicodegen.utils.token_utils import estimate_tokens
+from uicodegen.utils.upload_utils import save_request_stream, UploadTooLargeError
+
+# Seconds between keepalive comments on an idle progress event stream
+EVENTS_KEEPALIVE_INTERVAL = 15
+
+def parse_offset(value):
+    """
+    Parse a generated text offset from a request header or parameter
+
+    Returns:
+        int: Offset, 0 when missing or invalid
+    """
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+def start_job(target, args, async_target=None):
+    """
+    Run a processing job in the background
+
+    Jobs with a coroutine variant run on the shared event loop when the async
+    Bedrock client is available, so a job waiting on the model holds no
+    thread. Other jobs get a thread of their own.
+
+    Args:
+        target: Job function
+        args: Arguments of the job
+        async_target: Optional coroutine function taking the same arguments
+    """
+    if async_target is not None and async_available():
+        run_on_loop(async_target(*args))
+    else:
+        threading.Thread(target=target, args=args).start()
 
 def init_app(app, session_manager):
     """Initialize Flask routes"""
     
     @app.route('/')
     def index():
-        return render_template('index.html', models=list(MODEL_CONFIGS.keys()), languages=get_all_languages(), active_tab="codegen")
+        return render_template('index.html', models=list(MODEL_CONFIGS.keys()) + [AUTO_MODEL], languages=get_all_languages(), active_tab="codegen")
         
     @app.route('/translate')
     def translate_page():
-        return render_template('index.html', models=list(MODEL_CONFIGS.keys()), languages=get_all_languages(), active_tab="translate")
+        return render_template('index.html', models=list(MODEL_CONFIGS.keys()) + [AUTO_MODEL], languages=get_all_languages(), active_tab="translate")
         
     @app.route('/html-translate')
     def html_translate_page():
-        return render_template('index.html', models=list(MODEL_CONFIGS.keys()), languages=get_all_languages(), active_tab="html-translate")
+        return render_template('index.html', models=list(MODEL_CONFIGS.keys()) + [AUTO_MODEL], languages=get_all_languages(), active_tab="html-translate")
 
     @app.route('/upload', methods=['POST'])
     def upload_file():
@@ -35,12 +83,13 @@ def init_app(app, session_manager):
         
         file = request.files['file']
         
-        # Get selected model
-        selected_model = DEFAULT_MODEL
-        if 'model' in request.form:
-            model_name = request.form['model']
-            if model_name in MODEL_CONFIGS:
-                selected_model = model_name
+        # Get selected model; "auto" picks the fastest model that can take the image
+        selected_model = resolve_model(
+            request.form.get('model'),
+            output_tokens=CODEGEN_OUTPUT_TOKENS,
+            max_latency=parse_max_latency(request.form.get('max_latency')),
+            vision=True
+        )
         
         # Get streaming preference
         use_streaming = False
@@ -59,6 +108,8 @@ def init_app(app, session_manager):
             error_message=None,
             input_tokens=0,
             output_tokens=0,
+            cache_read_input_tokens=0,
+            cache_write_input_tokens=0,
             processing_time=0,
             streaming_chunks=0
         )
@@ -76,9 +127,12 @@ def init_app(app, session_manager):
             file_path = session_manager.get_upload_path(session_id, filename)
             file.save(file_path)
             
-            # Start processing in a separate thread
-            thread = threading.Thread(target=process_image, args=(session_manager, session_id, file_path))
-            thread.start()
+            # Start processing in the background
+            start_job(
+                process_image,
+                (session_manager, session_id, file_path),
+                process_image_streaming_async if use_streaming else None
+            )
             
             return jsonify({
                 'message': 'Processing started', 
@@ -95,6 +149,45 @@ def init_app(app, session_manager):
         else:
             return jsonify({'error': 'Session not found'}), 404
 
+    @app.route('/events/<session_id>')
+    def get_progress_events(session_id):
+        if not session_manager.get_session_status(session_id):
+            return jsonify({'error': 'Session not found'}), 404
+
+        # Reconnecting clients resume the generated text where they left off
+        offset = parse_offset(request.headers.get('Last-Event-ID') or request.args.get('offset'))
+
+        def generate():
+            # Push new text and the changed status every time the session
+            # changes, until it ends
+            output_offset = offset
+            version = -1
+            last_status = None
+            while True:
+                status, new_version = session_manager.wait_for_update(session_id, version, EVENTS_KEEPALIVE_INTERVAL)
+                if status is None:
+                    return
+                if new_version == version:
+                    yield ": keepalive\n\n"
+                    continue
+                version = new_version
+
+                text, output_offset = session_manager.get_output(session_id, output_offset)
+                if text:
+                    yield f"id: {output_offset}\nevent: output\ndata: {json.dumps({'text': text})}\n\n"
+
+                if status != last_status:
+                    last_status = status
+                    yield f"data: {json.dumps(status)}\n\n"
+                    if status['processing_complete'] or status['error_message']:
+                        return
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
     @app.route('/result/<session_id>')
     def get_result(session_id):
         status = session_manager.get_session_status(session_id)
@@ -110,6 +203,8 @@ def init_app(app, session_manager):
                 'metrics': {
                     'input_tokens': status['input_tokens'],
                     'output_tokens': status['output_tokens'],
+                    'cache_read_input_tokens': status.get('cache_read_input_tokens', 0),
+                    'cache_write_input_tokens': status.get('cache_write_input_tokens', 0),
                     'processing_time': status['processing_time'],
                     'streaming_chunks': status['streaming_chunks'] if status['use_streaming'] else 0,
                     'first_token_time': status.get('first_token_time', 0),
@@ -120,6 +215,26 @@ def init_app(app, session_manager):
         else:
             return jsonify({'error': 'Processing not complete'})
 
+    @app.route('/admin/models')
+    def get_model_metrics():
+        return jsonify({'models': model_registry.snapshot()})
+
+    @app.route('/admin/bedrock/pool')
+    def get_bedrock_pool_metrics():
+        return jsonify({'clients': get_client_pool_metrics()})
+
+    @app.route('/admin/bedrock/limiters')
+    def get_bedrock_limiter_metrics():
+        return jsonify(get_limiter_metrics())
+
+    @app.route('/admin/bedrock/hedging')
+    def get_bedrock_hedging_metrics():
+        return jsonify(get_hedging_metrics())
+
+    @app.route('/admin/bedrock/regions')
+    def get_bedrock_region_metrics():
+        return jsonify(get_region_metrics())
+
     @app.route('/generated/<path:filename>')
     def generated_files(filename):
         print(f"Serving file: {app.config['GENERATED_FOLDER']}/{filename}")
@@ -132,29 +247,37 @@ def init_app(app, session_manager):
         
         # Get text to translate
         text = request.form.get('text', '')
-        source_lang = request.form.get('source_lang', DEFAULT_SOURCE_LANGUAGE)
+        source_lang = request.form.get('source_lang') or AUTO_DETECT_LANGUAGE
         target_lang = request.form.get('target_lang', DEFAULT_TARGET_LANGUAGE)
         
         if not text:
             return jsonify({'error': 'No text provided'})
         
-        # Get selected model
-        selected_model = DEFAULT_MODEL
-        if 'model' in request.form:
-            model_name = request.form['model']
-            if model_name in MODEL_CONFIGS:
-                selected_model = model_name
+        # Get selected model; "auto" picks one by the size of the text
+        input_tokens = estimate_tokens(text)
+        selected_model = resolve_model(
+            request.form.get('model'),
+            input_tokens=input_tokens,
+            output_tokens=int(input_tokens * TRANSLATION_EXPANSION),
+            max_latency=parse_max_latency(request.form.get('max_latency'))
+        )
         
         # Get streaming preference
         use_streaming = False
         if 'streaming' in request.form:
             use_streaming = request.form['streaming'].lower() == 'true'
         
+        # Get translation memory preference
+        use_translation_memory = True
+        if 'translation_memory' in request.form:
+            use_translation_memory = request.form['translation_memory'].lower() == 'true'
+        
         # Update session with selected options
         session_manager.update_session_status(
             session_id,
             selected_model=selected_model,
             use_streaming=use_streaming,
+            use_translation_memory=use_translation_memory,
             current_task="Starting translation",
             progress_percentage=0,
             is_processing=True,
@@ -162,16 +285,18 @@ def init_app(app, session_manager):
             error_message=None,
             input_tokens=0,
             output_tokens=0,
+            cache_read_input_tokens=0,
+            cache_write_input_tokens=0,
             processing_time=0,
             streaming_chunks=0
         )
         
-        # Start processing in a separate thread
-        thread = threading.Thread(
-            target=translate_text, 
-            args=(session_manager, session_id, text, source_lang, target_lang)
+        # Start processing in the background
+        start_job(
+            translate_text,
+            (session_manager, session_id, text, source_lang, target_lang),
+            translate_text_async
         )
-        thread.start()
         
         return jsonify({
             'message': 'Translation started', 
@@ -202,12 +327,18 @@ def init_app(app, session_manager):
                     'metrics': {
                         'input_tokens': status.get('input_tokens', 0),
                         'output_tokens': status.get('output_tokens', 0),
+                        'cache_read_input_tokens': status.get('cache_read_input_tokens', 0),
+                        'cache_write_input_tokens': status.get('cache_write_input_tokens', 0),
                         'processing_time': status.get('processing_time', 0),
                         'streaming_chunks': status.get('streaming_chunks', 0) if status.get('use_streaming', False) else 0,
                         'first_token_time': status.get('first_token_time', 0),
-                        'tokens_per_second': status.get('tokens_per_second', 0)
+                        'tokens_per_second': status.get('tokens_per_second', 0),
+                        'tm_hits': status.get('tm_hits', 0),
+                        'tm_hit_rate': status.get('tm_hit_rate', 0),
+                        'tm_tokens_saved': status.get('tm_tokens_saved', 0)
                     },
-                    'model': status.get('selected_model', 'Unknown')
+                    'model': status.get('selected_model', 'Unknown'),
+                    'detected_source_language': status.get('detected_source_language')
                 })
             except Exception as e:
                 return jsonify({'error': f'Error reading translation: {str(e)}'})
@@ -221,29 +352,39 @@ def init_app(app, session_manager):
         
         # Get HTML content to translate
         html_content = request.form.get('html', '')
-        source_lang = request.form.get('source_lang', DEFAULT_SOURCE_LANGUAGE)
+        source_lang = request.form.get('source_lang') or AUTO_DETECT_LANGUAGE
         target_lang = request.form.get('target_lang', DEFAULT_TARGET_LANGUAGE)
         
         if not html_content:
             return jsonify({'error': 'No HTML content provided'})
         
-        # Get selected model
-        selected_model = DEFAULT_MODEL
-        if 'model' in request.form:
-            model_name = request.form['model']
-            if model_name in MODEL_CONFIGS:
-                selected_model = model_name
+        # Get selected model; "auto" picks one by the size of the document,
+        # which is translated in chunks sized to the model
+        input_tokens = estimate_tokens(html_content)
+        selected_model = resolve_model(
+            request.form.get('model'),
+            input_tokens=input_tokens,
+            output_tokens=int(input_tokens * TRANSLATION_EXPANSION),
+            max_latency=parse_max_latency(request.form.get('max_latency')),
+            chunked=True
+        )
         
         # Get streaming preference
         use_streaming = False
         if 'streaming' in request.form:
             use_streaming = request.form['streaming'].lower() == 'true'
         
+        # Get translation memory preference
+        use_translation_memory = True
+        if 'translation_memory' in request.form:
+            use_translation_memory = request.form['translation_memory'].lower() == 'true'
+        
         # Update session with selected options
         session_manager.update_session_status(
             session_id,
             selected_model=selected_model,
             use_streaming=use_streaming,
+            use_translation_memory=use_translation_memory,
             current_task="Starting HTML translation",
             progress_percentage=0,
             is_processing=True,
@@ -251,6 +392,8 @@ def init_app(app, session_manager):
             error_message=None,
             input_tokens=0,
             output_tokens=0,
+            cache_read_input_tokens=0,
+            cache_write_input_tokens=0,
             processing_time=0,
             streaming_chunks=0
         )
@@ -269,6 +412,85 @@ def init_app(app, session_manager):
             'streaming': use_streaming
         })
         
+    @app.route('/html-translate/upload', methods=['POST'])
+    def upload_html_translation():
+        # The request body is the HTML document itself, optionally compressed
+        # with Content-Encoding: gzip; options are passed in the query string
+        source_lang = request.args.get('source_lang') or AUTO_DETECT_LANGUAGE
+        target_lang = request.args.get('target_lang', DEFAULT_TARGET_LANGUAGE)
+        
+        # Get streaming and translation memory preferences
+        use_streaming = request.args.get('streaming', 'false').lower() == 'true'
+        use_translation_memory = request.args.get('translation_memory', 'true').lower() == 'true'
+        
+        # Create a new session
+        session_id = session_manager.create_session()
+        input_path = session_manager.get_upload_path(session_id, "original_html.html")
+        
+        # Stream the body to disk so the document is never held in memory
+        try:
+            input_size = save_request_stream(
+                request.stream,
+                input_path,
+                content_encoding=request.headers.get('Content-Encoding'),
+                max_size=app.config['MAX_HTML_DOCUMENT_SIZE']
+            )
+        except UploadTooLargeError as e:
+            return jsonify({'error': str(e)}), 413
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 415
+        except Exception as e:
+            return jsonify({'error': f'Error reading HTML upload: {str(e)}'}), 400
+        
+        if input_size == 0:
+            return jsonify({'error': 'No HTML content provided'})
+        
+        # Get selected model; "auto" estimates the document at about four
+        # bytes per token, since it is not read here
+        input_tokens = input_size // 4
+        selected_model = resolve_model(
+            request.args.get('model'),
+            input_tokens=input_tokens,
+            output_tokens=int(input_tokens * TRANSLATION_EXPANSION),
+            max_latency=parse_max_latency(request.args.get('max_latency')),
+            chunked=True
+        )
+        
+        # Update session with selected options
+        session_manager.update_session_status(
+            session_id,
+            selected_model=selected_model,
+            use_streaming=use_streaming,
+            use_translation_memory=use_translation_memory,
+            current_task="Starting HTML translation",
+            progress_percentage=0,
+            is_processing=True,
+            processing_complete=False,
+            error_message=None,
+            input_tokens=0,
+            output_tokens=0,
+            cache_read_input_tokens=0,
+            cache_write_input_tokens=0,
+            processing_time=0,
+            streaming_chunks=0,
+            input_size=input_size
+        )
+        
+        # Start processing in a separate thread
+        thread = threading.Thread(
+            target=translate_html_file, 
+            args=(session_manager, session_id, input_path, source_lang, target_lang)
+        )
+        thread.start()
+        
+        return jsonify({
+            'message': 'HTML translation started', 
+            'session_id': session_id,
+            'model': selected_model,
+            'streaming': use_streaming,
+            'input_size': input_size
+        })
+        
     @app.route('/html-translate/result/<session_id>')
     def get_html_translation_result(session_id):
         status = session_manager.get_session_status(session_id)
@@ -277,6 +499,39 @@ def init_app(app, session_manager):
             return jsonify({'error': 'Session not found'}), 404
             
         if status['processing_complete']:
+            metrics = {
+                'input_tokens': status.get('input_tokens', 0),
+                'output_tokens': status.get('output_tokens', 0),
+                'cache_read_input_tokens': status.get('cache_read_input_tokens', 0),
+                'cache_write_input_tokens': status.get('cache_write_input_tokens', 0),
+                'processing_time': status.get('processing_time', 0),
+                'streaming_chunks': status.get('streaming_chunks', 0) if status.get('use_streaming', False) else 0,
+                'first_token_time': status.get('first_token_time', 0),
+                'tokens_per_second': status.get('tokens_per_second', 0),
+                'tm_hits': status.get('tm_hits', 0),
+                'tm_hit_rate': status.get('tm_hit_rate', 0),
+                'tm_tokens_saved': status.get('tm_tokens_saved', 0),
+                'deduplicated_segments': status.get('deduplicated_segments', 0),
+                'skipped_segments': status.get('skipped_segments', 0),
+                'skipped_tokens': status.get('skipped_tokens', 0),
+                'target_language_segments': status.get('target_language_segments', 0),
+                'truncated_chunks': status.get('truncated_chunks', 0),
+                'retried_segments': status.get('retried_segments', 0),
+                'missing_segments': status.get('missing_segments', 0)
+            }
+            
+            # Streamed documents are too large to inline, so link to the file
+            if status.get('streamed_output'):
+                return jsonify({
+                    'html_path': f'/generated/{session_id}/translated_html.html',
+                    'elements_translated': status.get('elements_translated', 0),
+                    'input_size': status.get('input_size', 0),
+                    'output_size': status.get('output_size', 0),
+                    'metrics': metrics,
+                    'model': status.get('selected_model', 'Unknown'),
+                    'detected_source_language': status.get('detected_source_language')
+                })
+            
             # Read the translated HTML file
             translated_path = session_manager.get_generated_path(session_id, "translated_html.html")
             original_path = session_manager.get_generated_path(session_id, "original_html.html")
@@ -288,27 +543,51 @@ def init_app(app, session_manager):
                 with open(original_path, 'r', encoding='utf-8') as f:
                     original_html = f.read()
                 
-                # Count elements translated (approximate)
-                from bs4 import BeautifulSoup
-                soup = BeautifulSoup(original_html, "html.parser")
-                text_nodes = len([node for node in soup.find_all(string=True) if node.strip()])
-                
                 return jsonify({
                     'html_content': translated_html,
-                    'elements_translated': text_nodes,
+                    'elements_translated': status.get('elements_translated', 0),
                     'input_size': len(original_html),
                     'output_size': len(translated_html),
-                    'metrics': {
-                        'input_tokens': status.get('input_tokens', 0),
-                        'output_tokens': status.get('output_tokens', 0),
-                        'processing_time': status.get('processing_time', 0),
-                        'streaming_chunks': status.get('streaming_chunks', 0) if status.get('use_streaming', False) else 0,
-                        'first_token_time': status.get('first_token_time', 0),
-                        'tokens_per_second': status.get('tokens_per_second', 0)
-                    },
-                    'model': status.get('selected_model', 'Unknown')
+                    'metrics': metrics,
+                    'model': status.get('selected_model', 'Unknown'),
+                    'detected_source_language': status.get('detected_source_language')
                 })
             except Exception as e:
                 return jsonify({'error': f'Error reading HTML translation: {str(e)}'})
         else:
             return jsonify({'error': 'Processing not complete'})
+
+    @app.route('/translation-memory/export')
+    def export_translation_memory():
+        source_lang = request.args.get('source_lang')
+        target_lang = request.args.get('target_lang')
+        
+        buffer = io.BytesIO()
+        get_translation_memory().export_tmx(buffer, source_lang=source_lang, target_lang=target_lang)
+        buffer.seek(0)
+        
+        return send_file(
+            buffer,
+            mimetype='application/x-tmx+xml',
+            as_attachment=True,
+            download_name='translation_memory.tmx'
+        )
+
+    @app.route('/translation-memory/import', methods=['POST'])
+    def import_translation_memory():
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file part'})
+        
+        file = request.files['file']
+        model = request.form.get('model', '')
+        
+        try:
+            imported = get_translation_memory().import_tmx(file.stream, model=model)
+        except Exception as e:
+            return jsonify({'error': f'Error importing TMX: {str(e)}'})
+        
+        return jsonify({
+            'message': 'Translation memory imported',
+            'imported': imported,
+            'total_entries': get_translation_memory().count()
+        })